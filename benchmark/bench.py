@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from payloads import PayloadGenerator, default_preprocessor_path, load_vocabularies
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+# Une ligne de log par requête fausserait la mesure
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SERVING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serving')
+
+# Métriques comparées à la baseline : (clé, True si "plus grand est meilleur")
+GATED_METRICS = (("throughput_rps", True), ("p99_ms", False), ("cpu_ms_per_request", False))
+
+
+class LifespanManager:
+    """Déclenche startup/shutdown d'une app ASGI chargée en process (chargement des artefacts, workers)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._receive_queue: asyncio.Queue = asyncio.Queue()
+        self._send_queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _send(self, message):
+        await self._send_queue.put(message)
+
+    async def __aenter__(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self._task = asyncio.create_task(self.app(scope, self._receive_queue.get, self._send))
+        await self._receive_queue.put({"type": "lifespan.startup"})
+        message = await self._send_queue.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Echec du démarrage de l'app: {message}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._receive_queue.put({"type": "lifespan.shutdown"})
+        await self._send_queue.get()
+        await self._task
+
+
+def server_cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    """Temps CPU (user + system) d'un process serveur local, lu dans /proc."""
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "p999_ms": float(np.percentile(values, 99.9)),
+        "max_ms": float(values.max()),
+    }
+
+
+class Benchmark:
+    """Exécute un scénario contre /predict, /predict/batch ou /feedback et mesure les latences."""
+
+    def __init__(self, client: httpx.AsyncClient, generator: PayloadGenerator, endpoint: str, batch_size: int = 1):
+        self.client = client
+        self.generator = generator
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_codes: Dict[int, int] = {}
+
+    def _request_kwargs(self) -> Dict:
+        if self.endpoint == "predict":
+            return {"url": "/predict", "json": self.generator.transaction()}
+        if self.endpoint == "batch":
+            return {"url": "/predict/batch", "json": self.generator.transactions(self.batch_size)}
+        if self.endpoint == "feedback":
+            return {"url": "/feedback", "json": self.generator.feedback()}
+        raise ValueError(f"Endpoint inconnu: {self.endpoint}")
+
+    async def _one(self, scheduled_at: Optional[float] = None):
+        kwargs = self._request_kwargs()
+        start = time.perf_counter() if scheduled_at is None else scheduled_at
+        try:
+            response = await self.client.post(**kwargs)
+            self.status_codes[response.status_code] = self.status_codes.get(response.status_code, 0) + 1
+            if response.status_code >= 400:
+                self.errors += 1
+        except httpx.HTTPError:
+            self.errors += 1
+        # En boucle ouverte, la latence part de l'instant prévu (pas d'omission coordonnée)
+        self.latencies.append(time.perf_counter() - start)
+
+    async def closed_loop(self, n_requests: int, concurrency: int):
+        """`concurrency` clients qui enchaînent les requêtes jusqu'à `n_requests` au total."""
+        remaining = iter(range(n_requests))
+
+        async def worker():
+            for _ in remaining:
+                await self._one()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, duration_s: float, seed: int = 0):
+        """Arrivées de Poisson à `rate` req/s pendant `duration_s`, indépendamment des réponses."""
+        rng = random.Random(seed)
+        tasks = []
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < duration_s:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._one(scheduled_at=next_at)))
+            next_at += rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+
+async def run(args) -> Dict:
+    generator = PayloadGenerator(load_vocabularies(args.preprocessor), seed=args.seed,
+                                 unknown_rate=args.unknown_rate)
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+        lifespan = None
+        target = args.url
+    else:
+        # En process : l'API est importée et appelée via le transport ASGI (pas de réseau)
+        if SERVING_DIR not in sys.path:
+            sys.path.insert(0, SERVING_DIR)
+        import api
+        lifespan = LifespanManager(api.app)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app),
+                                   base_url="http://bench", timeout=args.timeout)
+        target = "asgi"
+
+    if lifespan is not None:
+        await lifespan.__aenter__()
+    try:
+        bench = Benchmark(client, generator, args.endpoint, batch_size=args.batch_size)
+
+        # Echauffement (non mesuré)
+        warmup = Benchmark(client, generator, args.endpoint, batch_size=args.batch_size)
+        await warmup.closed_loop(args.warmup, min(args.concurrency, max(args.warmup, 1)))
+
+        server_pid = os.getpid() if target == "asgi" else args.server_pid
+        cpu_start = server_cpu_seconds(server_pid)
+        client_cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+
+        if args.rate:
+            await bench.open_loop(args.rate, args.duration, seed=args.seed)
+            mode = "open"
+        else:
+            await bench.closed_loop(args.requests, args.concurrency)
+            mode = "closed"
+
+        wall = time.perf_counter() - wall_start
+        client_cpu = time.process_time() - client_cpu_start
+        cpu_end = server_cpu_seconds(server_pid)
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    n = len(bench.latencies)
+    rows_per_request = args.batch_size if args.endpoint == "batch" else 1
+    report = {
+        "target": target,
+        "endpoint": args.endpoint,
+        "mode": mode,
+        "concurrency": args.concurrency if mode == "closed" else None,
+        "arrival_rate_rps": args.rate if mode == "open" else None,
+        "batch_size": rows_per_request,
+        "requests": n,
+        "errors": bench.errors,
+        "status_codes": {str(k): v for k, v in sorted(bench.status_codes.items())},
+        "duration_s": wall,
+        "throughput_rps": n / wall if wall else 0.0,
+        "rows_per_s": n * rows_per_request / wall if wall else 0.0,
+        **percentiles(bench.latencies),
+        "client_cpu_ms_per_request": 1000 * client_cpu / n if n else None,
+    }
+    if cpu_start is not None and cpu_end is not None:
+        # En process, client et serveur partagent le même CPU
+        report["cpu_ms_per_request"] = 1000 * (cpu_end - cpu_start) / n if n else None
+    return report
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Liste des métriques dégradées de plus de `max_regression` (fraction) par rapport à la baseline."""
+    scenario = ("endpoint", "mode", "concurrency", "arrival_rate_rps", "batch_size")
+    mismatched = [k for k in scenario if report.get(k) != baseline.get(k)]
+    if mismatched:
+        return [f"scénario différent de la baseline ({', '.join(mismatched)})"]
+
+    failures = []
+    for key, higher_is_better in GATED_METRICS:
+        new, old = report.get(key), baseline.get(key)
+        if new is None or old is None or old == 0:
+            continue
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > max_regression:
+            failures.append(f"{key}: {old:.3f} -> {new:.3f} ({change:+.1%})")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de latence / débit de l'API de détection de fraude")
+    parser.add_argument("--url", type=str, default=None, help="URL de l'API (par défaut : app chargée en process via ASGI)")
+    parser.add_argument("--endpoint", choices=["predict", "batch", "feedback"], default="predict")
+    parser.add_argument("--requests", type=int, default=2000, help="Nombre de requêtes (boucle fermée)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clients simultanés (boucle fermée)")
+    parser.add_argument("--rate", type=float, default=None, help="Taux d'arrivée en req/s (active la boucle ouverte)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée en secondes (boucle ouverte)")
+    parser.add_argument("--batch_size", type=int, default=100, help="Transactions par requête pour --endpoint batch")
+    parser.add_argument("--warmup", type=int, default=50, help="Requêtes d'échauffement non mesurées")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--unknown_rate", type=float, default=0.0, help="Part de catégories inconnues injectées")
+    parser.add_argument("--preprocessor", type=str, default=default_preprocessor_path(), help="preprocessor.pickle (vocabulaires)")
+    parser.add_argument("--server_pid", type=int, default=None, help="PID du serveur local pour mesurer son CPU (mode --url)")
+    parser.add_argument("--output", type=str, default=None, help="Fichier JSON de sortie")
+    parser.add_argument("--baseline", type=str, default=None, help="Rapport JSON de référence à ne pas dégrader")
+    parser.add_argument("--max_regression", type=float, default=0.10, help="Dégradation tolérée vs baseline (fraction)")
+
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare_to_baseline(report, json.load(f), args.max_regression)
+        if failures:
+            logger.error("Régression détectée :\n" + "\n".join(failures))
+            sys.exit(1)
+        logger.info("Aucune régression par rapport à la baseline.")
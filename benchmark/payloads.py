@@ -0,0 +1,78 @@
+import os
+import pickle
+import random
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Colonnes entières / booléennes de TransactionInput (serving/api.py)
+INT_FIELDS = {"transaction_hour"}
+
+
+def load_vocabularies(preprocessor_path: str) -> Dict:
+    """
+    Extrait du ColumnTransformer les vocabulaires catégoriels (OneHotEncoder.categories_)
+    et les moyennes/écarts-types numériques (StandardScaler) vus à l'entraînement.
+    """
+    with open(preprocessor_path, 'rb') as f:
+        preprocessor = pickle.load(f)
+
+    vocab = {"categorical": {}, "numerical": {}}
+    for name, transformer, columns in preprocessor.transformers_:
+        kind = type(transformer).__name__
+        if kind == "OneHotEncoder":
+            for col, categories in zip(columns, transformer.categories_):
+                vocab["categorical"][col] = [c.item() if isinstance(c, np.generic) else c for c in categories]
+        elif kind == "StandardScaler":
+            for col, mean, scale in zip(columns, transformer.mean_, transformer.scale_):
+                vocab["numerical"][col] = (float(mean), float(scale))
+    return vocab
+
+
+class PayloadGenerator:
+    """Génère des TransactionInput réalistes à partir des vocabulaires du preprocessor."""
+
+    def __init__(self, vocab: Dict, seed: Optional[int] = 42, unknown_rate: float = 0.0):
+        self.vocab = vocab
+        self.rng = random.Random(seed)
+        self.unknown_rate = unknown_rate
+
+    def _numeric(self, col: str, mean: float, std: float):
+        if col in INT_FIELDS:
+            return self.rng.randint(0, 23)
+        # Variable 0/1 (écart-type de Bernoulli) : on tire une Bernoulli
+        if 0 <= mean <= 1 and abs(std - (mean * (1 - mean)) ** 0.5) < 0.01:
+            return float(self.rng.random() < mean)
+        # Montants positifs très dispersés : log-normale de même moyenne / écart-type
+        if mean > 0 and std > 0:
+            sigma2 = np.log(1 + (std / mean) ** 2)
+            mu = np.log(mean) - sigma2 / 2
+            return round(float(self.rng.lognormvariate(mu, sigma2 ** 0.5)), 2)
+        return float(self.rng.gauss(mean, std))
+
+    def transaction(self) -> Dict:
+        tx = {col: self._numeric(col, mean, std) for col, (mean, std) in self.vocab["numerical"].items()}
+        for col, categories in self.vocab["categorical"].items():
+            if self.unknown_rate and self.rng.random() < self.unknown_rate and isinstance(categories[0], str):
+                tx[col] = "__unknown__"
+            elif isinstance(categories[0], bool):
+                tx[col] = self.rng.random() < 0.5
+            else:
+                tx[col] = self.rng.choice(categories)
+        tx["email"] = f"client{self.rng.randint(0, 10 ** 6)}@example.com"
+        return tx
+
+    def transactions(self, n: int) -> List[Dict]:
+        return [self.transaction() for _ in range(n)]
+
+    def feedback(self) -> Dict:
+        return {
+            "payload": self.transaction(),
+            "correct_class": self.rng.random() < 0.1,
+            "prediction": self.rng.random() < 0.1,
+        }
+
+
+def default_preprocessor_path() -> str:
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    return os.getenv("PREPROCESSOR_PATH", os.path.join(root, 'artifacts', 'preprocessor.pickle'))
@@ -0,0 +1,458 @@
+import os
+import json
+import hashlib
+import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy.stats import kstwobign
+
+# Quantiles de la référence servant de bornes aux histogrammes (100 classes de même masse, 1 % chacune)
+QUANTILE_LEVELS = np.linspace(0, 1, 101)
+# Classes des histogrammes : sous q0, 100 classes entre quantiles, au-dessus de q100
+N_BINS = len(QUANTILE_LEVELS) + 1
+# Fichiers arrivant en retard dans une partition horaire (flush à cheval sur deux heures, réécriture après erreur)
+PARTITION_GRACE = pd.Timedelta(hours=2)
+# Lignes lues au plus par lot d'ingestion (le premier passage sur un long historique ne charge pas tout)
+INGEST_BATCH_ROWS = 500000
+
+
+def reference_stats_from_frame(ref_data, feature_cols):
+    """Statistiques de référence (format ref_stats.json) calculées depuis un échantillon, pour les anciens entraînements."""
+    features = {}
+    for col in feature_cols:
+        values = ref_data[col].to_numpy(dtype=np.float64)
+        features[col] = {
+            "count": int(len(values)),
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "quantiles": np.quantile(values, QUANTILE_LEVELS).tolist(),
+        }
+    return {"n_rows": int(len(ref_data)), "features": features}
+
+
+class WindowSummary:
+    """
+    Résumé fusionnable d'une fenêtre de feedbacks, par feature :
+    histogramme sur les quantiles de la référence, moments (n, somme, somme des carrés), min/max
+    et sommes des valeurs hors bornes (Wasserstein exact sur les queues).
+    Deux résumés sur les mêmes bornes s'additionnent : une fenêtre journalière est la somme de ses heures.
+    """
+
+    def __init__(self, edges, start=None):
+        self.edges = edges  # (n_features, 101)
+        self.start = start
+        n_features = edges.shape[0]
+        self.counts = np.zeros((n_features, N_BINS), dtype=np.int64)
+        self.n = 0
+        self.total = np.zeros(n_features)
+        self.total_sq = np.zeros(n_features)
+        self.minimum = np.full(n_features, np.inf)
+        self.maximum = np.full(n_features, -np.inf)
+        self.under_sum = np.zeros(n_features)
+        self.over_sum = np.zeros(n_features)
+        self.target_pos = 0
+        self.prediction_pos = 0
+
+    def update(self, X, target=None, prediction=None):
+        X = np.asarray(X, dtype=np.float64)
+        if not len(X):
+            return
+        n_features = self.edges.shape[0]
+        bins = np.empty(X.shape, dtype=np.int64)
+        for j in range(n_features):
+            bins[:, j] = np.searchsorted(self.edges[j], X[:, j], side='right')
+            # Le maximum de la référence appartient à la dernière classe, pas au débordement
+            bins[X[:, j] == self.edges[j, -1], j] = N_BINS - 2
+        offsets = bins + np.arange(n_features) * N_BINS
+        self.counts += np.bincount(offsets.ravel(), minlength=n_features * N_BINS).reshape(n_features, N_BINS)
+
+        self.n += len(X)
+        self.total += X.sum(axis=0)
+        self.total_sq += (X ** 2).sum(axis=0)
+        self.minimum = np.minimum(self.minimum, X.min(axis=0))
+        self.maximum = np.maximum(self.maximum, X.max(axis=0))
+        self.under_sum += np.where(bins == 0, X, 0.0).sum(axis=0)
+        self.over_sum += np.where(bins == N_BINS - 1, X, 0.0).sum(axis=0)
+        if target is not None:
+            self.target_pos += int(np.asarray(target, dtype=bool).sum())
+        if prediction is not None:
+            self.prediction_pos += int(np.asarray(prediction, dtype=bool).sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.under_sum += other.under_sum
+        self.over_sum += other.over_sum
+        self.target_pos += other.target_pos
+        self.prediction_pos += other.prediction_pos
+        return self
+
+    def cdf_at_edges(self):
+        """Fonction de répartition empirique aux 101 bornes, (n_features, 101)."""
+        return np.cumsum(self.counts, axis=1)[:, :-1] / max(self.n, 1)
+
+    def quantiles(self, levels):
+        """Quantiles approchés (interpolation linéaire dans les classes), (n_features, len(levels))."""
+        cdf = self.cdf_at_edges()
+        return np.array([np.interp(levels, cdf[j], self.edges[j]) for j in range(len(cdf))])
+
+    def to_dict(self):
+        return {
+            "start": self.start.isoformat() if self.start is not None else None,
+            "counts": self.counts.tolist(),
+            "n": self.n,
+            "total": self.total.tolist(),
+            "total_sq": self.total_sq.tolist(),
+            "minimum": self.minimum.tolist(),
+            "maximum": self.maximum.tolist(),
+            "under_sum": self.under_sum.tolist(),
+            "over_sum": self.over_sum.tolist(),
+            "target_pos": self.target_pos,
+            "prediction_pos": self.prediction_pos,
+        }
+
+    @classmethod
+    def from_dict(cls, data, edges):
+        summary = cls(edges, pd.Timestamp(data["start"]) if data.get("start") else None)
+        summary.counts = np.asarray(data["counts"], dtype=np.int64)
+        summary.n = data["n"]
+        for attr in ("total", "total_sq", "minimum", "maximum", "under_sum", "over_sum"):
+            setattr(summary, attr, np.asarray(data[attr], dtype=np.float64))
+        summary.target_pos = data["target_pos"]
+        summary.prediction_pos = data["prediction_pos"]
+        return summary
+
+
+def drift_statistics(summary, reference, feature_cols, psi_threshold=0.2):
+    """
+    PSI (déciles de la référence), KS et Wasserstein normé (par l'écart-type de la référence) de chaque feature,
+    calculés uniquement à partir du résumé : coût indépendant du nombre de lignes.
+    """
+    if summary.n == 0:
+        return {"rows": 0, "features": {}, "share_of_drifted_features": None}
+
+    edges = summary.edges
+    cdf = summary.cdf_at_edges()
+    ref_cdf = QUANTILE_LEVELS
+    diff = cdf - ref_cdf
+
+    # PSI sur 10 classes de même masse dans la référence (débordements rattachés aux déciles extrêmes)
+    deciles = np.add.reduceat(summary.counts[:, 1:-1], np.arange(0, 100, 10), axis=1).astype(np.float64)
+    deciles[:, 0] += summary.counts[:, 0]
+    deciles[:, -1] += summary.counts[:, -1]
+    current = np.clip(deciles / summary.n, 1e-4, None)
+    psi = ((current - 0.1) * np.log(current / 0.1)).sum(axis=1)
+
+    # KS : écart maximal des fonctions de répartition aux bornes
+    ks = np.abs(diff).max(axis=1)
+
+    # Wasserstein-1 : aire entre les fonctions de répartition (trapèzes entre bornes) + queues exactes
+    widths = np.diff(edges, axis=1)
+    wasserstein = (widths * (np.abs(diff[:, :-1]) + np.abs(diff[:, 1:])) / 2).sum(axis=1)
+    wasserstein += (summary.counts[:, 0] * edges[:, 0] - summary.under_sum) / summary.n
+    wasserstein += (summary.over_sum - summary.counts[:, -1] * edges[:, -1]) / summary.n
+
+    mean = summary.total / summary.n
+    std = np.sqrt(np.maximum(summary.total_sq / summary.n - mean ** 2, 0.0))
+    features = {}
+    for j, col in enumerate(feature_cols):
+        ref = reference["features"][col]
+        ref_std = ref["std"] or 1.0
+        n_ref = ref.get("count", reference.get("n_rows", summary.n))
+        en = np.sqrt(summary.n * n_ref / (summary.n + n_ref))
+        features[col] = {
+            "psi": float(psi[j]),
+            "ks": float(ks[j]),
+            "ks_p_value": float(kstwobign.sf(en * ks[j])),
+            "wasserstein_normed": float(wasserstein[j] / ref_std),
+            "mean": float(mean[j]),
+            "std": float(std[j]),
+            "mean_shift": float((mean[j] - ref["mean"]) / ref_std),
+            "drifted": bool(psi[j] > psi_threshold),
+        }
+    return {
+        "rows": int(summary.n),
+        "target_rate": summary.target_pos / summary.n,
+        "prediction_rate": summary.prediction_pos / summary.n,
+        "features": features,
+        "share_of_drifted_features": float(np.mean([f["drifted"] for f in features.values()])),
+    }
+
+
+class WindowedDriftEngine:
+    """
+    Drift incrémental par fenêtres sur le store Parquet des feedbacks (serving/feedback_store.py).
+
+    Chaque exécution ne lit que les fichiers Parquet pas encore ingérés (checkpoint des noms de fichiers
+    des partitions récentes), par lots de `batch_rows` lignes, met à jour le résumé des fenêtres concernées
+    et un échantillon réservoir borné par fenêtre (pour les snapshots Evidently). Le rapport glissant
+    fusionne les `report_windows` dernières fenêtres : son coût ne dépend pas de la longueur de l'historique.
+
+    Résumés et échantillons sont écrits sous un nouveau numéro de génération ; checkpoint.json (écrit
+    atomiquement) désigne la génération courante de chaque fenêtre et les fichiers ingérés. Il est le
+    seul point de validation : un arrêt en cours de lot laisse des fichiers orphelins, jamais un double comptage.
+    """
+
+    def __init__(self, state_dir, feedback_dir, reference, window="h", retention_windows=24 * 30,
+                 report_windows=24, sample_rows=5000, psi_threshold=0.2, batch_rows=INGEST_BATCH_ROWS, seed=42):
+        self.state_dir = state_dir
+        self.feedback_dir = feedback_dir
+        self.reference = reference
+        self.window = window
+        self.retention_windows = retention_windows
+        self.report_windows = report_windows
+        self.sample_rows = sample_rows
+        self.psi_threshold = psi_threshold
+        self.batch_rows = batch_rows
+        self.rng = np.random.default_rng(seed)
+
+        self.feature_cols = sorted(reference["features"], key=lambda c: int(c.split('_')[-1]))
+        self.edges = np.array([reference["features"][c]["quantiles"] for c in self.feature_cols], dtype=np.float64)
+        self.windows_dir = os.path.join(state_dir, "windows")
+        self.samples_dir = os.path.join(state_dir, "samples")
+        os.makedirs(self.windows_dir, exist_ok=True)
+        os.makedirs(self.samples_dir, exist_ok=True)
+        self.checkpoint = self._load_checkpoint()
+
+    # --- Etat persistant ---
+
+    def _fingerprint(self):
+        payload = json.dumps({"window": self.window, "edges": self.edges.tolist()}).encode()
+        return hashlib.sha256(payload).hexdigest()[:16]
+
+    def _load_checkpoint(self):
+        path = os.path.join(self.state_dir, "checkpoint.json")
+        checkpoint = None
+        if os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+        if checkpoint is None or checkpoint.get("reference") != self._fingerprint():
+            # Nouvelle référence (nouveau modèle, nouvel espace PCA) : les résumés existants ne sont plus comparables
+            if checkpoint is not None:
+                print("Reference changed: resetting drift windows.")
+            for d in (self.windows_dir, self.samples_dir):
+                for name in os.listdir(d):
+                    os.remove(os.path.join(d, name))
+            checkpoint = {"reference": self._fingerprint(), "files": {}, "watermark": None, "emitted_until": None,
+                          "windows": {}, "generation": 0}
+        if "windows" not in checkpoint:
+            # Etat antérieur aux générations : <fenêtre>.json, sans numéro
+            checkpoint["windows"] = {name[:-5]: None for name in os.listdir(self.windows_dir)
+                                     if name.endswith(".json") and name.count(".") == 1}
+            checkpoint["generation"] = 0
+        self._remove_orphans(checkpoint["windows"])
+        return checkpoint
+
+    def _remove_orphans(self, windows):
+        """Supprime les résumés et échantillons d'un lot interrompu (non référencés par le checkpoint)."""
+        valid = {os.path.basename(path) for key, generation in windows.items()
+                 for path in (self._window_path(key, generation), self._sample_path(key, generation))}
+        for d in (self.windows_dir, self.samples_dir):
+            for name in os.listdir(d):
+                if name not in valid:
+                    os.remove(os.path.join(d, name))
+
+    def _save_checkpoint(self):
+        self._write_json(os.path.join(self.state_dir, "checkpoint.json"), self.checkpoint)
+
+    @staticmethod
+    def _write_json(path, data):
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def window_key(start):
+        return f"{start:%Y%m%dT%H%M}"
+
+    def _window_path(self, key, generation):
+        return os.path.join(self.windows_dir, f"{key}.json" if generation is None else f"{key}.{generation}.json")
+
+    def _sample_path(self, key, generation):
+        return os.path.join(self.samples_dir, f"{key}.parquet" if generation is None else f"{key}.{generation}.parquet")
+
+    def _remove_window(self, key, generation):
+        for path in (self._window_path(key, generation), self._sample_path(key, generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_window(self, key):
+        if key not in self.checkpoint["windows"]:
+            return None
+        with open(self._window_path(key, self.checkpoint["windows"][key])) as f:
+            return WindowSummary.from_dict(json.load(f), self.edges)
+
+    def window_keys(self):
+        return sorted(self.checkpoint["windows"])
+
+    # --- Ingestion ---
+
+    def _new_files(self):
+        """Fichiers Parquet pas encore ingérés, en sautant les partitions plus anciennes que le watermark."""
+        watermark = pd.Timestamp(self.checkpoint["watermark"]) if self.checkpoint["watermark"] else None
+        new_files = []
+        if not os.path.isdir(self.feedback_dir):
+            return new_files
+        for date_dir in sorted(os.listdir(self.feedback_dir)):
+            if not date_dir.startswith("date="):
+                continue
+            if watermark is not None and pd.Timestamp(date_dir[5:], tz="UTC") + pd.Timedelta(days=1) + PARTITION_GRACE <= watermark:
+                continue
+            for hour_dir in sorted(os.listdir(os.path.join(self.feedback_dir, date_dir))):
+                if not hour_dir.startswith("hour="):
+                    continue
+                hour = pd.Timestamp(f"{date_dir[5:]} {hour_dir[5:]}:00", tz="UTC")
+                if watermark is not None and hour + pd.Timedelta(hours=1) + PARTITION_GRACE <= watermark:
+                    continue
+                partition = f"{date_dir}/{hour_dir}"
+                seen = set(self.checkpoint["files"].get(partition, []))
+                part_dir = os.path.join(self.feedback_dir, date_dir, hour_dir)
+                for name in sorted(os.listdir(part_dir)):
+                    if name.endswith(".parquet") and not name.startswith(".") and name not in seen:
+                        new_files.append((partition, hour, os.path.join(part_dir, name)))
+        return new_files
+
+    def pending_rows(self):
+        """Lignes en attente d'ingestion, lues dans les métadonnées Parquet (sans charger les données)."""
+        return sum(pq.ParquetFile(path).metadata.num_rows for _, _, path in self._new_files())
+
+    def _update_sample(self, key, X, n_before, generation):
+        """Réservoir (algorithme R) des lignes de la fenêtre, borné à `sample_rows`, écrit sous `generation`."""
+        previous = self._sample_path(key, self.checkpoint["windows"][key]) if key in self.checkpoint["windows"] else None
+        sample = pd.read_parquet(previous) if previous and os.path.exists(previous) else X.iloc[:0]
+        n_fill = max(0, min(self.sample_rows - len(sample), len(X)))
+        sample = pd.concat([sample, X.iloc[:n_fill]], ignore_index=True)
+        rest = X.iloc[n_fill:]
+        if len(rest):
+            ranks = n_before + n_fill + np.arange(len(rest))
+            slots = (self.rng.random(len(rest)) * (ranks + 1)).astype(np.int64)
+            keep = slots < self.sample_rows
+            # Ordre du flux respecté : le dernier élément tiré pour un slot l'emporte
+            for col in sample.columns:
+                values = sample[col].to_numpy().copy()
+                values[slots[keep]] = rest[col].to_numpy()[keep]
+                sample[col] = values
+        path = self._sample_path(key, generation)
+        sample.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    def _batches(self, new_files):
+        """Fichiers regroupés par lots d'environ `batch_rows` lignes (métadonnées Parquet)."""
+        batch, rows = [], 0
+        for item in new_files:
+            batch.append(item)
+            rows += pq.ParquetFile(item[2]).metadata.num_rows
+            if rows >= self.batch_rows:
+                yield batch
+                batch, rows = [], 0
+        if batch:
+            yield batch
+
+    def ingest(self):
+        """Ingère les nouveaux fichiers du store, lot par lot ; renvoie (lignes lues, fenêtres modifiées)."""
+        total, touched = 0, set()
+        for batch in self._batches(self._new_files()):
+            rows, keys = self._ingest_batch(batch)
+            total += rows
+            touched.update(keys)
+        return total, sorted(touched)
+
+    def _ingest_batch(self, new_files):
+        columns = self.feature_cols + ["target", "prediction", "received_at"]
+        df = pd.concat([pd.read_parquet(path, columns=columns) for _, _, path in new_files], ignore_index=True)
+
+        generation = self.checkpoint["generation"] + 1
+        touched = []
+        if len(df):
+            starts = df["received_at"].dt.floor(self.window)
+            for start, part in df.groupby(starts):
+                key = self.window_key(start)
+                summary = self.load_window(key) or WindowSummary(self.edges, start)
+                n_before = summary.n
+                summary.update(part[self.feature_cols].to_numpy(), part["target"], part["prediction"])
+                # Nouvelle génération : la précédente reste celle du checkpoint jusqu'à sa réécriture
+                self._update_sample(key, part[self.feature_cols + ["target", "prediction"]], n_before, generation)
+                self._write_json(self._window_path(key, generation), summary.to_dict())
+                touched.append(key)
+
+        # Validation : générations des fenêtres, fichiers ingérés et watermark dans la même écriture du checkpoint
+        replaced = [(key, self.checkpoint["windows"][key]) for key in touched if key in self.checkpoint["windows"]]
+        for key in touched:
+            self.checkpoint["windows"][key] = generation
+        self.checkpoint["generation"] = generation
+        for partition, _, path in new_files:
+            self.checkpoint["files"].setdefault(partition, []).append(os.path.basename(path))
+        latest = max(hour for _, hour, _ in new_files)
+        if self.checkpoint["watermark"] is None or latest > pd.Timestamp(self.checkpoint["watermark"]):
+            self.checkpoint["watermark"] = latest.isoformat()
+        expired = self._prune()
+        self._save_checkpoint()
+        for key, old_generation in replaced + expired:
+            self._remove_window(key, old_generation)
+        return len(df), touched
+
+    def _prune(self):
+        """
+        Oublie les noms de fichiers des partitions anciennes et les fenêtres hors rétention ;
+        renvoie les (fenêtre, génération) à supprimer une fois le checkpoint écrit.
+        """
+        watermark = pd.Timestamp(self.checkpoint["watermark"])
+        for partition in list(self.checkpoint["files"]):
+            date_dir, hour_dir = partition.split("/")
+            hour = pd.Timestamp(f"{date_dir[5:]} {hour_dir[5:]}:00", tz="UTC")
+            if hour + pd.Timedelta(hours=1) + PARTITION_GRACE <= watermark:
+                del self.checkpoint["files"][partition]
+
+        keys = self.window_keys()
+        return [(key, self.checkpoint["windows"].pop(key)) for key in keys[:max(0, len(keys) - self.retention_windows)]]
+
+    # --- Rapports ---
+
+    def pending_windows(self, now=None):
+        """
+        Fenêtres closes dont le snapshot n'a pas encore été émis (postérieures au dernier snapshot).
+        Les lignes arrivées en retard dans une fenêtre déjà émise mettent à jour son résumé, pas son snapshot.
+        """
+        return [self.load_window(key) for key in self.pending_window_keys(now)]
+
+    def pending_window_keys(self, now=None):
+        current = self.window_key((now or pd.Timestamp.now(tz="UTC")).floor(self.window))
+        emitted_until = self.checkpoint["emitted_until"] or ""
+        return [key for key in self.window_keys() if emitted_until < key < current]
+
+    def window_sample(self, key):
+        return pd.read_parquet(self._sample_path(key, self.checkpoint["windows"][key]))
+
+    def mark_emitted(self, summary):
+        self.checkpoint["emitted_until"] = max(self.checkpoint["emitted_until"] or "", self.window_key(summary.start))
+        self._save_checkpoint()
+
+    def statistics(self, summary):
+        return drift_statistics(summary, self.reference, self.feature_cols, self.psi_threshold)
+
+    def rolling_report(self):
+        """Drift des `report_windows` dernières fenêtres fusionnées, et de chacune d'elles."""
+        keys = self.window_keys()[-self.report_windows:]
+        merged = WindowSummary(self.edges)
+        windows = {}
+        for key in keys:
+            summary = self.load_window(key)
+            merged.merge(summary)
+            windows[key] = {"start": summary.start.isoformat(), **self.statistics(summary)}
+        report = {
+            "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "window": self.window,
+            "windows_merged": len(keys),
+            "rolling": self.statistics(merged),
+            "windows": windows,
+        }
+        self._write_json(os.path.join(self.state_dir, "drift_latest.json"), report)
+        return report
@@ -0,0 +1,150 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import distance
+from scipy.stats import chisquare, ks_2samp, norm
+
+# Seuils par défaut des tests d'Evidently (DataDriftPreset)
+WASSERSTEIN_THRESHOLD = 0.1
+JENSENSHANNON_THRESHOLD = 0.1
+P_VALUE_THRESHOLD = 0.05
+DRIFT_SHARE = 0.5
+# Au-delà, les colonnes numériques sont réparties sur un pool de process
+POOL_MIN_CELLS = 5000000
+
+
+def sample_frame(df, max_rows, seed=42):
+    """Echantillon uniforme de `max_rows` lignes (le DataFrame entier s'il est plus petit)."""
+    if max_rows is None or len(df) <= max_rows:
+        return df
+    return df.sample(n=max_rows, random_state=seed)
+
+
+def numerical_drift(ref, cur):
+    """
+    Tests d'Evidently pour des colonnes numériques, sur toutes les colonnes de (n, d) à la fois :
+    Wasserstein normé si la référence dépasse 1000 lignes, KS sinon ; JS / Z-test si au plus 5 valeurs distinctes.
+    """
+    n, m = len(ref), len(cur)
+    values = np.concatenate([ref, cur], axis=0)
+    order = np.argsort(values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    deltas = np.diff(sorted_values, axis=0)
+    n_unique = (deltas != 0).sum(axis=0) + 1
+
+    if n > 1000:
+        # Distance de Wasserstein-1 : aire entre les fonctions de répartition (même calcul que scipy)
+        from_ref = order < n
+        cdf_ref = np.cumsum(from_ref, axis=0)[:-1] / n
+        cdf_cur = np.cumsum(~from_ref, axis=0)[:-1] / m
+        scores = (np.abs(cdf_ref - cdf_cur) * deltas).sum(axis=0) / np.maximum(ref.std(axis=0), 0.001)
+        results = [{"stattest": "wasserstein", "score": float(s), "threshold": WASSERSTEIN_THRESHOLD,
+                    "drift": bool(s >= WASSERSTEIN_THRESHOLD)} for s in scores]
+    else:
+        p_values = np.atleast_1d(ks_2samp(ref, cur, axis=0).pvalue)
+        results = [{"stattest": "ks", "score": float(p), "threshold": P_VALUE_THRESHOLD,
+                    "drift": bool(p <= P_VALUE_THRESHOLD)} for p in p_values]
+
+    for j in np.flatnonzero(n_unique <= 5):
+        results[j] = categorical_drift(ref[:, j], cur[:, j])
+    return results
+
+
+def categorical_drift(ref, cur):
+    """Jensen-Shannon sur les fréquences (référence > 1000 lignes), Z-test de proportions (binaire) sinon."""
+    ref, cur = np.asarray(ref), np.asarray(cur)
+    keys = np.unique(np.concatenate([ref[pd.notna(ref)], cur[pd.notna(cur)]]))
+    ref_freq = np.array([(ref == k).sum() for k in keys]) / len(ref)
+    cur_freq = np.array([(cur == k).sum() for k in keys]) / len(cur)
+
+    if len(ref) > 1000:
+        score = float(distance.jensenshannon(ref_freq, cur_freq))
+        return {"stattest": "jensenshannon", "score": score, "threshold": JENSENSHANNON_THRESHOLD,
+                "drift": bool(score >= JENSENSHANNON_THRESHOLD)}
+
+    if len(keys) <= 1:
+        p_value = 1.0
+    elif len(keys) == 2:
+        # Proportion de la seconde modalité dans chaque échantillon
+        p1, p2 = ref_freq[1], cur_freq[1]
+        pooled = (p1 * len(ref) + p2 * len(cur)) / (len(ref) + len(cur))
+        z = (p1 - p2) / np.sqrt(pooled * (1 - pooled) * (1 / len(ref) + 1 / len(cur)))
+        p_value = float(2 * (1 - norm.cdf(abs(z))))
+    else:
+        # Effectifs attendus : fréquences de la référence ramenées à la taille du courant
+        p_value = float(chisquare(cur_freq * len(cur), ref_freq * len(cur)).pvalue)
+    return {"stattest": "z" if len(keys) <= 2 else "chisquare", "score": p_value,
+            "threshold": P_VALUE_THRESHOLD, "drift": bool(p_value < P_VALUE_THRESHOLD)}
+
+
+def _drift_worker(paths, start, stop):
+    """Worker : tests numériques sur les colonnes [start, stop) des matrices mmap."""
+    ref = np.load(paths["ref"], mmap_mode='r')
+    cur = np.load(paths["cur"], mmap_mode='r')
+    return numerical_drift(np.ascontiguousarray(ref[:, start:stop]), np.ascontiguousarray(cur[:, start:stop]))
+
+
+def _parallel_numerical_drift(ref, cur, n_jobs):
+    """Colonnes réparties sur `n_jobs` process ; matrices écrites une fois en .npy et relues en mmap."""
+    bounds = np.array_split(np.arange(ref.shape[1]), n_jobs)
+    with tempfile.TemporaryDirectory(prefix='drift-') as tmp_dir:
+        paths = {"ref": os.path.join(tmp_dir, "ref.npy"), "cur": os.path.join(tmp_dir, "cur.npy")}
+        np.save(paths["ref"], ref)
+        np.save(paths["cur"], cur)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(_drift_worker, paths, int(b[0]), int(b[-1]) + 1) for b in bounds if len(b)]
+            return [result for f in futures for result in f.result()]
+
+
+def compute_drift(ref_data, current_data, numerical_cols, categorical_cols=(), max_rows=200000, n_jobs=None,
+                  drift_share=DRIFT_SHARE, seed=42):
+    """
+    Drift par colonne (mêmes tests et seuils par défaut que DataDriftPreset) et drift global du dataset.
+    Les deux jeux sont échantillonnés à `max_rows` lignes au plus.
+    """
+    ref_data = sample_frame(ref_data, max_rows, seed)
+    current_data = sample_frame(current_data, max_rows, seed)
+    ref = ref_data[numerical_cols].to_numpy(dtype=np.float64)
+    cur = current_data[numerical_cols].to_numpy(dtype=np.float64)
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(numerical_cols))
+    if n_jobs > 1 and (len(ref) + len(cur)) * len(numerical_cols) >= POOL_MIN_CELLS:
+        numerical = _parallel_numerical_drift(ref, cur, n_jobs)
+    else:
+        numerical = numerical_drift(ref, cur) if numerical_cols else []
+
+    columns = dict(zip(numerical_cols, numerical))
+    for col in categorical_cols:
+        columns[col] = categorical_drift(ref_data[col].to_numpy(), current_data[col].to_numpy())
+
+    share = float(np.mean([c["drift"] for c in columns.values()])) if columns else 0.0
+    return {
+        "reference_rows": int(len(ref_data)),
+        "current_rows": int(len(current_data)),
+        "columns": columns,
+        "number_of_drifted_columns": int(sum(c["drift"] for c in columns.values())),
+        "share_of_drifted_columns": share,
+        "dataset_drift": bool(share >= drift_share),
+    }
+
+
+def classification_metrics(current_data, target='target', prediction='prediction'):
+    """Matrice de confusion et métriques de classification binaire, en une passe NumPy."""
+    y = current_data[target].to_numpy().astype(bool)
+    y_pred = current_data[prediction].to_numpy().astype(bool)
+    tp = int((y & y_pred).sum())
+    fp = int((~y & y_pred).sum())
+    fn = int((y & ~y_pred).sum())
+    tn = int((~y & ~y_pred).sum())
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "accuracy": (tp + tn) / max(len(y), 1),
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
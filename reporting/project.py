@@ -1,5 +1,9 @@
 import pandas as pd
+import numpy as np
 import os
+import json
+import time
+import argparse
 import datetime
 
 from evidently.report import Report
@@ -8,64 +12,407 @@ from evidently.test_suite import TestSuite
 from evidently.tests import TestNumberOfColumnsWithMissingValues
 from evidently import ColumnMapping
 from evidently.ui.workspace import Workspace
-from evidently.ui.dashboards import DashboardPanelCounter, DashboardPanelPlot, CounterAgg, PlotType, ReportFilter
+from evidently.ui.dashboards import DashboardPanelCounter, DashboardPanelPlot, CounterAgg, PlotType, ReportFilter, PanelValue
+from evidently.metrics.custom_metric import CustomValueMetric
 from evidently.renderers.html_renderer import HtmlRenderer
 
-def create_report():
+from drift_windows import WindowedDriftEngine, reference_stats_from_frame
+from fast_drift import compute_drift, classification_metrics
+
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+# auto : échantillon de référence s'il existe, sinon statistiques précalculées ; stats : toujours les statistiques
+REFERENCE_SOURCE = os.getenv("REFERENCE_SOURCE", "auto")
+# Taille de la référence reconstruite à partir des quantiles
+REFERENCE_STATS_ROWS = int(os.getenv("REFERENCE_STATS_ROWS", "10000"))
+
+# Drift incrémental sur le store Parquet des feedbacks (écrit par serving/feedback_store.py)
+FEEDBACK_STORE_PATH = os.getenv("FEEDBACK_STORE_PATH", os.path.join(DATA_DIR, "feedback"))
+DRIFT_STATE_DIR = os.getenv("DRIFT_STATE_DIR", os.path.join(DATA_DIR, "drift_state"))
+DRIFT_WINDOW = os.getenv("DRIFT_WINDOW", "h") # Fenêtre des résumés et snapshots : "h" (heure) ou "D" (jour)
+DRIFT_REPORT_WINDOWS = int(os.getenv("DRIFT_REPORT_WINDOWS", "24")) # Fenêtres fusionnées dans le rapport glissant
+DRIFT_RETENTION_WINDOWS = int(os.getenv("DRIFT_RETENTION_WINDOWS", str(24 * 30)))
+DRIFT_WINDOW_SAMPLE_ROWS = int(os.getenv("DRIFT_WINDOW_SAMPLE_ROWS", "5000")) # Lignes par fenêtre pour Evidently
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.2"))
+
+# Workspace Evidently et démon de reporting
+WORKSPACE_PATH = os.getenv("WORKSPACE_PATH", "workspace")
+PROJECT_NAME = "Fraud Detection Monitoring"
+REPORT_POLL_S = float(os.getenv("REPORT_POLL_S", "30")) # Vérification des nouveaux feedbacks
+REPORT_INTERVAL_S = float(os.getenv("REPORT_INTERVAL_S", "3600")) # Cadence des rapports s'il y a du nouveau
+REPORT_MIN_ROWS = int(os.getenv("REPORT_MIN_ROWS", "5000")) # Volume déclenchant un rapport immédiat
+SNAPSHOT_RETENTION_DAYS = float(os.getenv("SNAPSHOT_RETENTION_DAYS", "30"))
+
+# Calcul du drift : numpy (tests d'Evidently vectorisés, valeurs enregistrées comme métriques) ou evidently (presets)
+DRIFT_BACKEND = os.getenv("DRIFT_BACKEND", "numpy")
+DRIFT_MAX_ROWS = int(os.getenv("DRIFT_MAX_ROWS", "200000")) # Echantillon max par jeu (référence / courant)
+DRIFT_N_JOBS = int(os.getenv("DRIFT_N_JOBS", "0")) or None # Process du backend numpy (défaut : nombre de CPU)
+
+
+def load_reference_stats(data_dir=DATA_DIR):
+    """Statistiques par feature écrites à l'entraînement (ref_stats.json), ou None."""
+    path = os.path.join(data_dir, 'ref_stats.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def reference_from_stats(stats, n_rows=REFERENCE_STATS_ROWS, seed=42):
+    """
+    Référence synthétique reconstruite par inversion des quantiles de chaque feature : mêmes marginales
+    que le train, ce qui suffit aux tests de drift (colonne par colonne) sans relire les lignes.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name, feature in stats["features"].items():
+        quantiles = np.asarray(feature["quantiles"])
+        levels = np.linspace(0, 1, len(quantiles))
+        data[name] = np.interp(rng.random(n_rows), levels, quantiles).astype(np.float32)
+    ref_data = pd.DataFrame(data)
+
+    # Cible tirée selon les effectifs par classe du train
+    classes = list(stats["target"])
+    counts = np.array([stats["target"][c] for c in classes], dtype=float)
+    values = [c == "True" if c in ("True", "False") else c for c in classes]
+    ref_data['target'] = rng.choice(np.array(values), size=n_rows, p=counts / counts.sum())
+    return ref_data
+
+
+def load_reference(data_dir=DATA_DIR, source=REFERENCE_SOURCE):
+    """Données de référence : ref_data.parquet (float32), ancien ref_data.csv, ou reconstruites depuis ref_stats.json."""
+    if source != "stats":
+        parquet_path = os.path.join(data_dir, 'ref_data.parquet')
+        if os.path.exists(parquet_path):
+            return pd.read_parquet(parquet_path)
+        csv_path = os.path.join(data_dir, 'ref_data.csv')
+        if os.path.exists(csv_path):
+            return pd.read_csv(csv_path)
+
+    stats = load_reference_stats(data_dir)
+    if stats is None:
+        raise FileNotFoundError(f"Ni ref_data.parquet, ni ref_data.csv, ni ref_stats.json dans {data_dir}")
+    print(f"Reference rebuilt from ref_stats.json ({stats['n_rows']} training rows summarized).")
+    return reference_from_stats(stats)
+
+
+def value_metrics(values):
+    """Valeurs déjà calculées, enregistrées comme métriques Evidently (une CustomValueMetric par valeur)."""
+    return [CustomValueMetric(func=lambda data, v=float(v): v, title=name) for name, v in values.items()]
+
+
+def add_fast_reports(ws, project, ref_data, current_data, timestamp=None, tags=None, metadata=None):
+    """
+    Drift (mêmes tests que DataDriftPreset, vectorisés) et performance calculés par fast_drift.py,
+    ajoutés au projet en un seul snapshot léger : des valeurs, sans les données.
+    """
+    numerical_cols = [c for c in ref_data.columns if c.startswith('PCA_')]
+    categorical_cols = [c for c in ('target', 'prediction') if c in ref_data.columns and c in current_data.columns]
+    drift = compute_drift(ref_data, current_data, numerical_cols, categorical_cols,
+                          max_rows=DRIFT_MAX_ROWS, n_jobs=DRIFT_N_JOBS)
+
+    values = {f"drift_score:{col}": c["score"] for col, c in drift["columns"].items()}
+    values.update({
+        "share_of_drifted_columns": drift["share_of_drifted_columns"],
+        "number_of_drifted_columns": drift["number_of_drifted_columns"],
+        "dataset_drift": float(drift["dataset_drift"]),
+        "current_rows": len(current_data),
+    })
+    if {'target', 'prediction'} <= set(current_data.columns) and current_data['target'].notna().all():
+        values.update(classification_metrics(current_data))
+
+    metadata = {
+        **(metadata or {}),
+        "drift_backend": "numpy",
+        "stattests": {col: c["stattest"] for col, c in drift["columns"].items()},
+        "drifted_columns": [col for col, c in drift["columns"].items() if c["drift"]],
+    }
+    report = Report(metrics=value_metrics(values), timestamp=timestamp, tags=(tags or []) + ["fast_drift"],
+                    metadata=metadata)
+    report.run(reference_data=None, current_data=pd.DataFrame({"rows": [len(current_data)]}))
+    ws.add_report(project.id, report)
+    print(f"Drift report added: {drift['number_of_drifted_columns']}/{len(drift['columns'])} drifted columns.")
+
+
+def add_reports(ws, project, ref_data, current_data, timestamp=None, tags=None, metadata=None):
+    """Rapports de drift et de performance de `current_data` face à la référence, ajoutés au projet."""
+    # Libellés booléens (parquet, feedbacks) pris par Evidently pour des probabilités : on passe en 0/1
+    for df in (ref_data, current_data):
+        for col in ('target', 'prediction'):
+            if col in df.columns and pd.api.types.is_bool_dtype(df[col]):
+                df[col] = df[col].astype(int)
+
+    if DRIFT_BACKEND == "numpy":
+        add_fast_reports(ws, project, ref_data, current_data, timestamp=timestamp, tags=tags, metadata=metadata)
+        return
+
+    # Define Column Mapping
+    # target = 'target'
+    # prediction = 'prediction'
+    # numerical_features = [c for c in ref_data.columns if c.startswith('PCA_')]
+    
+    column_mapping = ColumnMapping()
+    column_mapping.target = 'target'
+    # La référence (train) n'a pas de prédictions : Evidently refuse une colonne présente d'un seul côté
+    column_mapping.prediction = 'prediction' if 'prediction' in ref_data.columns else None
+    column_mapping.numerical_features = [c for c in ref_data.columns if c.startswith('PCA_')]
+    
+    # 1. Data Drift Report
+    drift_report = Report(metrics=[
+        DataDriftPreset(),
+    ], timestamp=timestamp, tags=tags, metadata=metadata)
+    
+    drift_report.run(reference_data=ref_data, current_data=current_data, column_mapping=column_mapping)
+    ws.add_report(project.id, drift_report)
+    print("Data Drift report added.")
+    
+    # 2. Classification Performance (if we have targets in prod)
+    # Assuming prod_data has ground truth 'target' coming from feedback
+    if 'target' in current_data.columns and current_data['target'].notna().sum() > 0:
+        classification_mapping = ColumnMapping()
+        classification_mapping.target = 'target'
+        classification_mapping.prediction = 'prediction'
+        classification_mapping.numerical_features = column_mapping.numerical_features
+        classification_report = Report(metrics=[
+            ClassificationPreset(),
+        ], timestamp=timestamp, tags=tags, metadata=metadata)
+        classification_report.run(reference_data=ref_data if 'prediction' in ref_data.columns else None,
+                                  current_data=current_data, column_mapping=classification_mapping)
+        ws.add_report(project.id, classification_report)
+        print("Classification report added.")
+
+
+def get_project(ws):
+    """
+    Projet de monitoring, réutilisé par son nom (créé au premier passage).
+    Les doublons vides laissés par les anciennes versions du script sont supprimés.
+    """
+    projects = ws.search_project(PROJECT_NAME)
+    if not projects:
+        project = ws.create_project(PROJECT_NAME)
+        project.description = "Monitoring model performance and data drift."
+        add_dashboard_panels(project)
+        project.save()
+        return project
+
+    # On garde le projet qui a le plus de snapshots (le plus ancien à égalité)
+    counts = {project.id: len(project.list_snapshots()) for project in projects}
+    projects.sort(key=lambda p: (-counts[p.id], p.created_at))
+    for duplicate in projects[1:]:
+        if counts[duplicate.id] == 0:
+            ws.delete_project(duplicate.id)
+            print(f"Deleted empty duplicate project {duplicate.id}.")
+        else:
+            print(f"Duplicate project {duplicate.id} kept ({counts[duplicate.id]} snapshots).")
+    project = projects[0]
+    if add_dashboard_panels(project):
+        project.save()
+    return project
+
+
+def add_dashboard_panels(project):
+    """Courbes des métriques du backend numpy (part de colonnes en drift, F1) ; True si un panneau a été ajouté."""
+    existing = {panel.title for panel in project.dashboard.panels}
+    added = False
+    for title, names in (("Share of drifted columns", ["share_of_drifted_columns"]),
+                         ("Classification quality", ["f1", "precision", "recall"])):
+        if title in existing:
+            continue
+        project.dashboard.add_panel(DashboardPanelPlot(
+            title=title,
+            filter=ReportFilter(metadata_values={}, tag_values=["fast_drift"]),
+            values=[PanelValue(metric_id="CustomValueMetric", metric_args={"title": name}, field_path="value", legend=name)
+                    for name in names],
+            plot_type=PlotType.LINE,
+        ))
+        added = True
+    return added
+
+
+def compact_snapshots(ws, project, retention_days=SNAPSHOT_RETENTION_DAYS):
+    """
+    Supprime les snapshots expirés et, pour une même fenêtre et un même rapport, ne garde que le plus récent
+    (fenêtre réémise après un changement de référence).
+    """
+    snapshots = project.list_snapshots()
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    latest = {}
+    deleted = 0
+    # Identifiants uuid7 : l'ordre lexicographique est l'ordre de création
+    for snapshot in sorted(snapshots, key=lambda s: str(s.id)):
+        timestamp = snapshot.timestamp
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        if timestamp < cutoff:
+            ws.delete_snapshot(project.id, snapshot.id)
+            deleted += 1
+            continue
+        window = (snapshot.metadata or {}).get("window")
+        if window is None:
+            continue
+        key = (window, tuple((snapshot.metadata or {}).get("metric_presets", [])))
+        if key in latest:
+            ws.delete_snapshot(project.id, latest[key])
+            deleted += 1
+        latest[key] = snapshot.id
+    if deleted:
+        print(f"{deleted} snapshot(s) removed, {len(snapshots) - deleted} kept.")
+    return deleted
+
+
+def load_engine(ref_data):
+    feature_cols = [c for c in ref_data.columns if c.startswith('PCA_')]
+    reference = load_reference_stats() or reference_stats_from_frame(ref_data, feature_cols)
+    return WindowedDriftEngine(DRIFT_STATE_DIR, FEEDBACK_STORE_PATH, reference, window=DRIFT_WINDOW,
+                               retention_windows=DRIFT_RETENTION_WINDOWS, report_windows=DRIFT_REPORT_WINDOWS,
+                               sample_rows=DRIFT_WINDOW_SAMPLE_ROWS, psi_threshold=DRIFT_PSI_THRESHOLD)
+
+
+def run_windowed_drift(ws, project, ref_data, engine=None):
+    """
+    Drift incrémental : ingère les seuls feedbacks Parquet nouveaux, émet un snapshot par fenêtre close
+    (échantillon borné de la fenêtre) et écrit le rapport glissant (PSI / KS / Wasserstein) dans drift_latest.json.
+    """
+    engine = engine or load_engine(ref_data)
+    rows, touched = engine.ingest()
+    print(f"{rows} new feedback rows ingested into {len(touched)} window(s).")
+
+    for summary in engine.pending_windows():
+        key = engine.window_key(summary.start)
+        stats = engine.statistics(summary)
+        metadata = {
+            "window": key,
+            "rows": str(stats["rows"]),
+            "psi": {col: f"{f['psi']:.4f}" for col, f in stats["features"].items()},
+            "wasserstein_normed": {col: f"{f['wasserstein_normed']:.4f}" for col, f in stats["features"].items()},
+        }
+        print(f"Window {key}: {stats['rows']} rows, {stats['share_of_drifted_features']:.0%} drifted features.")
+        add_reports(ws, project, ref_data, engine.window_sample(key), timestamp=summary.start.to_pydatetime(),
+                    tags=["window", DRIFT_WINDOW], metadata=metadata)
+        engine.mark_emitted(summary)
+
+    report = engine.rolling_report()
+    rolling = report["rolling"]
+    if rolling["rows"]:
+        drifted = [col for col, f in rolling["features"].items() if f["drifted"]]
+        print(f"Rolling drift over {report['windows_merged']} window(s), {rolling['rows']} rows: "
+              f"drifted features {drifted or 'none'}")
+
+
+def create_report(ws=None, project=None):
     print("Loading data for reporting...")
     try:
-        ref_data = pd.read_csv('/data/ref_data.csv')
+        ref_data = load_reference()
     except Exception as e:
-        print(f"Could not load ref_data.csv: {e}")
+        print(f"Could not load reference data: {e}")
+        return
+
+    ws = ws or Workspace(WORKSPACE_PATH)
+    project = project or get_project(ws)
+
+    # Store Parquet des feedbacks (serving) : calcul incrémental par fenêtres
+    if os.path.isdir(FEEDBACK_STORE_PATH):
+        run_windowed_drift(ws, project, ref_data)
+        print("Project initialized.")
         return
 
     # Prod data might be empty or missing initially
     prod_data = None
-    if os.path.exists('/data/prod_data.csv'):
+    prod_path = os.path.join(DATA_DIR, 'prod_data.csv')
+    if os.path.exists(prod_path):
         try:
-            prod_data = pd.read_csv('/data/prod_data.csv')
+            prod_data = pd.read_csv(prod_path)
         except:
             pass
             
     # If no prod data, we can't generate a drift report comparing Ref vs Prod efficiently yet.
     # But we can initialize the workspace.
     
-    ws = Workspace("workspace")
-    project = ws.create_project("Fraud Detection Monitoring")
-    project.description = "Monitoring model performance and data drift."
-    project.save()
-    
     if prod_data is not None and len(prod_data) > 0:
-        # Define Column Mapping
-        # target = 'target'
-        # prediction = 'prediction'
-        # numerical_features = [c for c in ref_data.columns if c.startswith('PCA_')]
-        
-        column_mapping = ColumnMapping()
-        column_mapping.target = 'target'
-        column_mapping.prediction = 'prediction'
-        column_mapping.numerical_features = [c for c in ref_data.columns if c.startswith('PCA_')]
-        
-        # 1. Data Drift Report
-        drift_report = Report(metrics=[
-            DataDriftPreset(),
-        ])
-        
-        drift_report.run(reference_data=ref_data, current_data=prod_data, column_mapping=column_mapping)
-        ws.add_report(project.id, drift_report)
-        print("Data Drift report added.")
-        
-        # 2. Classification Performance (if we have targets in prod)
-        # Assuming prod_data has ground truth 'target' coming from feedback
-        if 'target' in prod_data.columns and prod_data['target'].notna().sum() > 0:
-            classification_report = Report(metrics=[
-                ClassificationPreset(),
-            ])
-            classification_report.run(reference_data=ref_data, current_data=prod_data, column_mapping=column_mapping)
-            ws.add_report(project.id, classification_report)
-            print("Classification report added.")
+        add_reports(ws, project, ref_data, prod_data)
 
     print("Project initialized.")
 
+
+class ReportScheduler:
+    """
+    Démon de reporting : toutes les `poll_s` secondes, regarde combien de feedbacks sont arrivés
+    (métadonnées Parquet, ou octets ajoutés à prod_data.csv) et génère les rapports
+    dès `min_rows` nouvelles lignes, ou à la cadence `interval_s` s'il y a du nouveau.
+    Sans nouvelle donnée ni fenêtre close à émettre, aucun travail n'est fait.
+    """
+
+    def __init__(self, ws, interval_s=REPORT_INTERVAL_S, min_rows=REPORT_MIN_ROWS, poll_s=REPORT_POLL_S):
+        self.ws = ws
+        self.interval_s = interval_s
+        self.min_rows = min_rows
+        self.poll_s = poll_s
+        self.last_run = None
+        self._reference_key = None
+        self._ref_data = None
+        self._csv_offset = 0
+
+    def _reference_files_key(self):
+        paths = [os.path.join(DATA_DIR, name) for name in ('ref_data.parquet', 'ref_data.csv', 'ref_stats.json')]
+        return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in paths)
+
+    def reference(self):
+        """Référence relue seulement si un de ses fichiers a changé (nouvel entraînement)."""
+        key = self._reference_files_key()
+        if key != self._reference_key:
+            self._ref_data = load_reference()
+            self._reference_key = key
+        return self._ref_data
+
+    def pending(self):
+        """(nouvelles lignes, fenêtres closes à émettre) depuis le dernier rapport."""
+        if os.path.isdir(FEEDBACK_STORE_PATH):
+            engine = load_engine(self.reference())
+            return engine.pending_rows(), len(engine.pending_window_keys())
+        prod_path = os.path.join(DATA_DIR, 'prod_data.csv')
+        if not os.path.exists(prod_path):
+            return 0, 0
+        rows = 0
+        with open(prod_path, 'rb') as f:
+            f.seek(self._csv_offset)
+            for block in iter(lambda: f.read(1 << 20), b""):
+                rows += block.count(b"\n")
+        return rows, 0
+
+    def run_once(self):
+        rows, windows = self.pending()
+        now = time.monotonic()
+        due = self.last_run is None or now - self.last_run >= self.interval_s
+        if not rows and not windows:
+            return False
+        if rows < self.min_rows and not windows and not due:
+            return False
+
+        print(f"Reporting: {rows} new row(s), {windows} closed window(s).")
+        project = get_project(self.ws)
+        create_report(self.ws, project)
+        compact_snapshots(self.ws, project)
+        self.last_run = now
+        prod_path = os.path.join(DATA_DIR, 'prod_data.csv')
+        if os.path.exists(prod_path):
+            self._csv_offset = os.path.getsize(prod_path)
+        return True
+
+    def run_forever(self):
+        print(f"Reporting scheduler started (every {self.interval_s}s or {self.min_rows} new rows).")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Reporting failed: {e}")
+            time.sleep(self.poll_s)
+
+
 if __name__ == "__main__":
-    create_report()
+    parser = argparse.ArgumentParser(description="Rapports Evidently de drift et de performance")
+    parser.add_argument("--daemon", action="store_true", help="Tourne en continu (cadence / seuil de volume)")
+    args = parser.parse_args()
+
+    if args.daemon:
+        ReportScheduler(Workspace(WORKSPACE_PATH)).run_forever()
+    else:
+        create_report()
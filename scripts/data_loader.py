@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+logger = logging.getLogger(__name__)
+
+# Colonnes du dataset brut non utilisées par le modèle (identifiants, texte libre)
+DROP_COLS = [
+    'transaction_id', 'customer_id', 'card_number', 'timestamp',
+    'merchant', 'city', 'device_fingerprint', 'ip_address',
+    'velocity_last_hour'
+]
+
+# A incrémenter si le parsing change : invalide les caches existants
+LOADER_VERSION = 1
+
+
+def file_hash(path, block_size=8 * 1024 * 1024):
+    """Empreinte du contenu du fichier source (lecture par blocs, mémoire constante)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def optimize_chunk(chunk):
+    """Types compacts : entiers réduits, chaînes en category. Les flottants restent en float64."""
+    for col in chunk.columns:
+        dtype = chunk[col].dtype
+        if pd.api.types.is_integer_dtype(dtype):
+            chunk[col] = pd.to_numeric(chunk[col], downcast='integer')
+        elif pd.api.types.is_string_dtype(dtype):
+            chunk[col] = chunk[col].astype('category')
+    return chunk
+
+
+def concat_chunks(chunks):
+    """Concatène les chunks en gardant les colonnes category (catégories unies) et les petits entiers."""
+    if not chunks:
+        return pd.DataFrame()
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [c[col] for c in chunks]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            columns[col] = pd.Series(union_categoricals(parts), name=col)
+        else:
+            values = pd.concat(parts, ignore_index=True)
+            # Un chunk peut avoir été réduit en int8 et un autre en int16
+            if pd.api.types.is_integer_dtype(values.dtype):
+                values = pd.to_numeric(values, downcast='integer')
+            columns[col] = values
+    return pd.DataFrame(columns)
+
+
+def iter_chunks(data_path, nrows=None, chunk_size=500000, drop_cols=DROP_COLS):
+    """Chunks typés des colonnes utiles, sans jamais charger le fichier entier (CSV ou Parquet)."""
+    drop = set(drop_cols)
+    if os.path.splitext(data_path)[1].lower() in ('.parquet', '.pq'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(data_path)
+        columns = [c for c in parquet.schema_arrow.names if c not in drop]
+        remaining = nrows
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            chunk = batch.to_pandas()
+            if remaining is not None:
+                chunk = chunk.iloc[:remaining]
+                remaining -= len(chunk)
+            yield optimize_chunk(chunk)
+            if remaining is not None and remaining <= 0:
+                return
+        return
+
+    reader = pd.read_csv(data_path, usecols=lambda c: c not in drop, nrows=nrows, chunksize=chunk_size)
+    for chunk in reader:
+        yield optimize_chunk(chunk)
+
+
+def read_csv_optimized(data_path, nrows=None, chunk_size=500000, drop_cols=DROP_COLS):
+    """Lit uniquement les colonnes utiles, par chunks, en réduisant les types au fil de l'eau."""
+    return concat_chunks(list(iter_chunks(data_path, nrows=nrows, chunk_size=chunk_size, drop_cols=drop_cols)))
+
+
+def load_dataset(data_path, nrows=None, chunk_size=500000, cache_dir=None, drop_cols=DROP_COLS):
+    """
+    Charge le dataset d'entraînement avec des types compacts.
+
+    Le résultat est mis en cache au format Parquet, indexé par le hash du fichier source
+    (et les options de lecture) : les exécutions suivantes ne reparsent pas le CSV.
+    Sans pyarrow, le cache est simplement désactivé.
+    """
+    start = time.perf_counter()
+    cache_path = None
+    if cache_dir is not None:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.warning("pyarrow non installé, cache Parquet désactivé.")
+        else:
+            key = json.dumps({
+                "source": file_hash(data_path),
+                "nrows": nrows,
+                "drop_cols": sorted(drop_cols),
+                "loader": LOADER_VERSION,
+            }, sort_keys=True)
+            name = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+            cache_path = os.path.join(cache_dir, f"{os.path.basename(data_path)}.{name}.parquet")
+
+    if cache_path is not None and os.path.exists(cache_path):
+        df = pd.read_parquet(cache_path)
+        logger.info(f"Données relues depuis le cache {cache_path} en {time.perf_counter() - start:.1f}s")
+        return df
+
+    df = read_csv_optimized(data_path, nrows=nrows, chunk_size=chunk_size, drop_cols=drop_cols)
+    logger.info(f"CSV parsé en {time.perf_counter() - start:.1f}s "
+                f"({df.memory_usage(deep=True).sum() / 1e6:.1f} MB en mémoire)")
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+        logger.info(f"Cache Parquet écrit dans {cache_path}")
+    return df
+
+
+def feature_columns(X):
+    """Colonnes catégorielles (chaînes, category, booléens) et numériques d'un DataFrame chargé."""
+    categorical_cols = X.select_dtypes(include=['object', 'category', 'bool']).columns.tolist()
+    numerical_cols = X.select_dtypes(include=[np.number]).columns.tolist()
+    return categorical_cols, numerical_cols
@@ -0,0 +1,152 @@
+import os
+import logging
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.decomposition import IncrementalPCA
+from sklearn.compose import ColumnTransformer
+
+from data_loader import iter_chunks, feature_columns
+
+logger = logging.getLogger(__name__)
+
+
+def split_mask(chunk_index, n_rows, test_size=0.2, seed=42):
+    """Masque test d'un chunk, déterministe : chaque passe sur le fichier retrouve le même split."""
+    rng = np.random.default_rng([seed, chunk_index])
+    return rng.random(n_rows) < test_size
+
+
+def iter_split_chunks(data_path, nrows=None, chunk_size=500000, test_size=0.2, seed=42, target='is_fraud'):
+    """(index, X, y, masque test) pour chaque chunk du fichier."""
+    for i, chunk in enumerate(iter_chunks(data_path, nrows=nrows, chunk_size=chunk_size)):
+        y = chunk[target].to_numpy(dtype=bool)
+        X = chunk.drop(columns=[target])
+        yield i, X, y, split_mask(i, len(chunk), test_size, seed)
+
+
+def collect_statistics(data_path, nrows=None, chunk_size=500000, test_size=0.2, seed=42):
+    """
+    Passe 1 : statistiques du train en un seul parcours (moyenne/variance numériques par
+    StandardScaler.partial_fit, catégories observées, effectifs par classe).
+    """
+    scaler = StandardScaler()
+    categories = {}
+    numerical_cols = categorical_cols = None
+    first_chunk = None
+    n_train = n_test = 0
+    class_counts = np.zeros(2, dtype=np.int64)
+
+    for _, X, y, test in iter_split_chunks(data_path, nrows, chunk_size, test_size, seed):
+        if numerical_cols is None:
+            categorical_cols, numerical_cols = feature_columns(X)
+            categories = {col: set() for col in categorical_cols}
+            first_chunk = X.iloc[:1000]
+
+        X_train = X[~test]
+        if len(X_train):
+            scaler.partial_fit(X_train[numerical_cols])
+        for col in categorical_cols:
+            categories[col].update(X_train[col].dropna().unique().tolist())
+
+        n_train += int((~test).sum())
+        n_test += int(test.sum())
+        class_counts += np.bincount(y[~test].astype(np.int64), minlength=2)
+
+    if numerical_cols is None:
+        raise ValueError(f"Aucune donnée lue dans {data_path}")
+
+    logger.info(f"Passe 1 terminée: {n_train} lignes de train, {n_test} de test, classes {class_counts.tolist()}")
+    return {
+        "scaler": scaler,
+        "categories": categories,
+        "numerical_cols": numerical_cols,
+        "categorical_cols": categorical_cols,
+        "first_chunk": first_chunk,
+        "n_train": n_train,
+        "n_test": n_test,
+        "class_counts": class_counts,
+    }
+
+
+def build_preprocessor(stats):
+    """
+    ColumnTransformer équivalent à celui de l'entraînement en mémoire, construit à partir
+    des statistiques streamées (mêmes classes sklearn : artefact compatible avec l'API).
+    """
+    categories = []
+    for col in stats["categorical_cols"]:
+        values = sorted(stats["categories"][col])
+        dtype = bool if all(isinstance(v, (bool, np.bool_)) for v in values) else object
+        categories.append(np.array(values, dtype=dtype))
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), stats["numerical_cols"]),
+            ('cat', OneHotEncoder(categories=categories, handle_unknown='ignore', sparse_output=False),
+             stats["categorical_cols"])
+        ]
+    )
+    # Fit sur quelques lignes pour initialiser la structure, puis on y reporte les statistiques du train complet
+    preprocessor.fit(stats["first_chunk"])
+    scaler = preprocessor.named_transformers_['num']
+    for attr in ('mean_', 'var_', 'scale_', 'n_samples_seen_'):
+        setattr(scaler, attr, getattr(stats["scaler"], attr))
+    preprocessor.named_transformers_['cat'].categories = 'auto'
+    return preprocessor
+
+
+def fit_incremental_pca(data_path, preprocessor, n_components=10, nrows=None, chunk_size=500000,
+                        test_size=0.2, seed=42):
+    """Passe 2 : IncrementalPCA.partial_fit sur les chunks de train transformés."""
+    pca = IncrementalPCA(n_components=n_components)
+    carry = None
+    for _, X, _, test in iter_split_chunks(data_path, nrows, chunk_size, test_size, seed):
+        X_processed = preprocessor.transform(X[~test])
+        if carry is not None:
+            X_processed = np.vstack([carry, X_processed])
+            carry = None
+        # partial_fit exige au moins n_components lignes : un reliquat est reporté au chunk suivant
+        if len(X_processed) < n_components:
+            carry = X_processed
+            continue
+        pca.partial_fit(X_processed)
+    if carry is not None:
+        logger.warning(f"{len(carry)} ligne(s) ignorée(s) par l'IncrementalPCA (reliquat trop petit).")
+    return pca
+
+
+def transform_to_memmap(data_path, preprocessor, pca, stats, work_dir, nrows=None, chunk_size=500000,
+                        test_size=0.2, seed=42):
+    """
+    Passe 3 : projette train et test en composantes PCA dans des tableaux mmap sur disque.
+    La mémoire reste bornée par la taille d'un chunk.
+    """
+    n_components = pca.n_components_
+    X_train = np.lib.format.open_memmap(os.path.join(work_dir, 'train_pca.npy'), mode='w+',
+                                        dtype=np.float64, shape=(stats["n_train"], n_components))
+    X_test = np.lib.format.open_memmap(os.path.join(work_dir, 'test_pca.npy'), mode='w+',
+                                       dtype=np.float64, shape=(stats["n_test"], n_components))
+    y_train = np.empty(stats["n_train"], dtype=bool)
+    y_test = np.empty(stats["n_test"], dtype=bool)
+
+    i_train = i_test = 0
+    for _, X, y, test in iter_split_chunks(data_path, nrows, chunk_size, test_size, seed):
+        n_tr, n_te = int((~test).sum()), int(test.sum())
+        if n_tr:
+            X_train[i_train:i_train + n_tr] = pca.transform(preprocessor.transform(X[~test]))
+            y_train[i_train:i_train + n_tr] = y[~test]
+        if n_te:
+            X_test[i_test:i_test + n_te] = pca.transform(preprocessor.transform(X[test]))
+            y_test[i_test:i_test + n_te] = y[test]
+        i_train += n_tr
+        i_test += n_te
+
+    X_train.flush()
+    X_test.flush()
+    return X_train, y_train, X_test, y_test
+
+
+def predict_in_chunks(clf, X, chunk_size=500000):
+    return np.concatenate([clf.predict(X[i:i + chunk_size]) for i in range(0, len(X), chunk_size)]) \
+        if len(X) else np.empty(0, dtype=bool)
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import logging
+import tracemalloc
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SERVING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serving')
+
+METRICS_FILE = 'model_metrics.json'
+ARTIFACT_FILES = ('preprocessor.pickle', 'pca.pickle', 'model.pickle', 'model_pack.npy')
+
+
+def _percentiles_ms(durations):
+    values = 1000 * np.asarray(durations)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+
+def profile_artifacts(artifacts_dir, sample_rows, n_single=200, batch_size=1000, n_batches=5):
+    """
+    Mesure le coût d'inférence d'artefacts écrits dans `artifacts_dir` par le code de serving
+    (ArtifactBundle, comme serving/api.py : pack mmap si présent, sinon pickles compilés).
+    `sample_rows` : transactions brutes (dicts), comme reçues par /predict.
+    """
+    if SERVING_DIR not in sys.path:
+        sys.path.insert(0, SERVING_DIR)
+    from registry import ArtifactBundle
+
+    profile = {
+        "serialized_bytes": {name: os.path.getsize(os.path.join(artifacts_dir, name))
+                             for name in ARTIFACT_FILES if os.path.exists(os.path.join(artifacts_dir, name))},
+    }
+
+    # Mémoire du chargement par pickles (chemin de repli de l'API, le plus coûteux)
+    tracemalloc.start()
+    start = time.perf_counter()
+    ArtifactBundle.from_pickles(artifacts_dir, "profile")
+    profile["pickle_load_s"] = time.perf_counter() - start
+    profile["pickle_load_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    bundle = ArtifactBundle.from_dir(artifacts_dir, "profile")
+    bundle.warm_up()
+    profile["load_s"] = time.perf_counter() - start
+    profile["source"] = bundle.source
+    profile["compiled"] = {"features": bundle.features is not None, "forest": bundle.forest is not None}
+
+    def score(rows):
+        # Mêmes étapes que score_rows dans serving/api.py
+        predictions, proba = bundle.predict_with_proba(bundle.transform(rows))
+        return predictions, proba.max(axis=1)
+
+    # Latence unitaire (/predict)
+    single = []
+    for i in range(n_single):
+        row = sample_rows[i % len(sample_rows)]
+        start = time.perf_counter()
+        score(row)
+        single.append(time.perf_counter() - start)
+    profile["single_row_ms"] = _percentiles_ms(single)
+
+    # Débit par lots (/predict/batch, micro-batching)
+    batch = [sample_rows[i % len(sample_rows)] for i in range(batch_size)]
+    tracemalloc.start()
+    durations = []
+    for _ in range(n_batches):
+        start = time.perf_counter()
+        score(batch)
+        durations.append(time.perf_counter() - start)
+    profile["batch_inference_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    profile["batch_size"] = batch_size
+    profile["batch_ms"] = _percentiles_ms(durations)
+    profile["batch_us_per_row"] = 1e6 * float(np.median(durations)) / batch_size
+    return profile
+
+
+def check_budget(metrics, profile, min_f1=None, max_single_row_ms=None, max_batch_us_per_row=None,
+                 max_model_mb=None):
+    """Liste des contraintes non respectées (vide si le modèle respecte le budget)."""
+    violations = []
+    if min_f1 is not None and metrics.get("f1", 0.0) < min_f1:
+        violations.append(f"F1 {metrics['f1']:.4f} < {min_f1}")
+    if max_single_row_ms is not None and profile["single_row_ms"]["p99"] > max_single_row_ms:
+        violations.append(f"latence unitaire p99 {profile['single_row_ms']['p99']:.2f} ms > {max_single_row_ms} ms")
+    if max_batch_us_per_row is not None and profile["batch_us_per_row"] > max_batch_us_per_row:
+        violations.append(f"lot {profile['batch_us_per_row']:.1f} µs/ligne > {max_batch_us_per_row} µs/ligne")
+    model_mb = profile["serialized_bytes"].get("model.pickle", 0) / 1e6
+    if max_model_mb is not None and model_mb > max_model_mb:
+        violations.append(f"model.pickle {model_mb:.1f} MB > {max_model_mb} MB")
+    return violations
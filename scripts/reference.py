@@ -0,0 +1,233 @@
+import os
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+REF_DATA_FILE = 'ref_data.parquet'
+REF_STATS_FILE = 'ref_stats.json'
+REF_CSV_FILE = 'ref_data.csv'
+
+# Quantiles stockés (0 à 100 %, pas de 1 %) : suffisent pour PSI à effectifs égaux, KS et Wasserstein approchés
+QUANTILE_LEVELS = np.linspace(0, 1, 101)
+
+
+class ReservoirSampler:
+    """
+    Echantillon uniforme de taille fixe sur un flux de chunks (algorithme R), un réservoir par classe.
+
+    stratified : chaque classe reçoit une part proportionnelle à sa fréquence (connue à la fin du flux).
+    class_balanced : même quota pour chaque classe.
+    """
+
+    def __init__(self, max_rows, n_features, class_balanced=False, seed=42):
+        self.max_rows = max_rows
+        self.n_features = n_features
+        self.class_balanced = class_balanced
+        self.rng = np.random.default_rng(seed)
+        self._reservoirs = {}
+        self._seen = {}
+
+    def add(self, X, y):
+        for cls in np.unique(y):
+            X_cls = np.asarray(X[y == cls], dtype=np.float32)
+            seen = self._seen.get(cls, 0)
+            reservoir = self._reservoirs.get(cls)
+            if reservoir is None:
+                reservoir = self._reservoirs[cls] = np.empty((self.max_rows, self.n_features), dtype=np.float32)
+
+            # Remplissage initial, puis remplacement avec probabilité max_rows / (rang + 1)
+            n_fill = max(0, min(self.max_rows - seen, len(X_cls)))
+            reservoir[seen:seen + n_fill] = X_cls[:n_fill]
+            rest = X_cls[n_fill:]
+            if len(rest):
+                ranks = seen + n_fill + np.arange(len(rest))
+                slots = (self.rng.random(len(rest)) * (ranks + 1)).astype(np.int64)
+                keep = slots < self.max_rows
+                # Ordre du flux respecté : le dernier élément tiré pour un slot l'emporte
+                reservoir[slots[keep]] = rest[keep]
+            self._seen[cls] = seen + len(X_cls)
+
+    def result(self):
+        """(X, y) échantillonnés, avec les quotas par classe appliqués."""
+        total = sum(self._seen.values())
+        classes = sorted(self._seen)
+        X_parts, y_parts = [], []
+        for cls in classes:
+            if self.class_balanced:
+                quota = self.max_rows // len(classes)
+            else:
+                quota = int(round(self.max_rows * self._seen[cls] / total))
+            n = min(max(quota, 1), self._seen[cls], self.max_rows)
+            # Le réservoir est uniforme : en prendre un sous-ensemble aléatoire reste uniforme
+            idx = self.rng.choice(min(self._seen[cls], self.max_rows), size=n, replace=False)
+            X_parts.append(self._reservoirs[cls][np.sort(idx)])
+            y_parts.append(np.full(n, cls))
+        return np.vstack(X_parts), np.concatenate(y_parts)
+
+
+def stratified_sample(y, max_rows, class_balanced=False, seed=42):
+    """
+    Indices triés d'un échantillon respectant la proportion de chaque classe (toutes les lignes si max_rows suffit),
+    ou avec le même quota par classe si `class_balanced`.
+    """
+    if max_rows is None or (len(y) <= max_rows and not class_balanced):
+        return np.arange(len(y))
+    rng = np.random.default_rng(seed)
+    classes = np.unique(y)
+    indices = []
+    for cls in classes:
+        cls_idx = np.flatnonzero(y == cls)
+        quota = max_rows // len(classes) if class_balanced else int(round(max_rows * len(cls_idx) / len(y)))
+        n = min(max(quota, 1), len(cls_idx))
+        indices.append(rng.choice(cls_idx, size=n, replace=False))
+    # Trié pour lire un mmap séquentiellement
+    return np.sort(np.concatenate(indices))
+
+
+def sample_reference(X, y, max_rows=100000, method='stratified', class_balanced=False, chunk_size=500000, seed=42):
+    """
+    Echantillon de référence (float32). `X` peut être un mmap : le réservoir le parcourt par chunks.
+    `max_rows=None` : toutes les lignes, quelle que soit la méthode.
+    """
+    y = np.asarray(y)
+    if max_rows is None:
+        return np.asarray(X, dtype=np.float32), y
+    if method == 'reservoir':
+        sampler = ReservoirSampler(max_rows, X.shape[1], class_balanced=class_balanced, seed=seed)
+        for start in range(0, len(y), chunk_size):
+            sampler.add(X[start:start + chunk_size], y[start:start + chunk_size])
+        return sampler.result()
+    idx = stratified_sample(y, max_rows, class_balanced=class_balanced, seed=seed)
+    return np.asarray(X[idx], dtype=np.float32), y[idx]
+
+
+def feature_statistics(X, feature_names, n_bins=50, stats_rows=1000000, chunk_size=500000, seed=42):
+    """
+    Statistiques par feature pour le drift, sans relire les lignes :
+    moments exacts (calculés par chunks sur tout X) ; quantiles et histogramme sur au plus `stats_rows` lignes.
+    """
+    n = len(X)
+    count = 0
+    total = np.zeros(X.shape[1])
+    total_sq = np.zeros(X.shape[1])
+    minimum = np.full(X.shape[1], np.inf)
+    maximum = np.full(X.shape[1], -np.inf)
+    for start in range(0, n, chunk_size):
+        chunk = np.asarray(X[start:start + chunk_size], dtype=np.float64)
+        count += len(chunk)
+        total += chunk.sum(axis=0)
+        total_sq += (chunk ** 2).sum(axis=0)
+        minimum = np.minimum(minimum, chunk.min(axis=0))
+        maximum = np.maximum(maximum, chunk.max(axis=0))
+    mean = total / max(count, 1)
+    var = np.maximum(total_sq / max(count, 1) - mean ** 2, 0.0)
+
+    if n > stats_rows:
+        idx = np.sort(np.random.default_rng(seed).choice(n, size=stats_rows, replace=False))
+        sample = np.asarray(X[idx], dtype=np.float64)
+    else:
+        sample = np.asarray(X, dtype=np.float64)
+
+    features = {}
+    for j, name in enumerate(feature_names):
+        col = sample[:, j]
+        edges = np.linspace(minimum[j], maximum[j], n_bins + 1) if maximum[j] > minimum[j] \
+            else np.array([minimum[j] - 0.5, minimum[j] + 0.5])
+        counts, _ = np.histogram(col, bins=edges)
+        features[name] = {
+            "count": int(count),
+            "mean": float(mean[j]),
+            "std": float(np.sqrt(var[j])),
+            "min": float(minimum[j]),
+            "max": float(maximum[j]),
+            "quantiles": np.quantile(col, QUANTILE_LEVELS).tolist(),
+            "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+        }
+    return features
+
+
+def probability_statistics(proba, y_sample, class_counts, n_bins=10):
+    """
+    Distribution de P(fraude) du modèle sur l'échantillon de référence (histogramme sur [0, 1], moyenne,
+    taux de prédictions positives), repondérée aux proportions des classes du train si l'échantillon est équilibré.
+    """
+    proba = np.asarray(proba, dtype=np.float64)
+    y_sample = np.asarray(y_sample)
+    total = sum(class_counts.values())
+    weights = np.ones(len(proba))
+    for cls in np.unique(y_sample):
+        in_cls = y_sample == cls
+        weights[in_cls] = (class_counts[str(cls)] / total) / (in_cls.sum() / len(y_sample))
+    edges = np.linspace(0, 1, n_bins + 1)
+    counts, _ = np.histogram(proba, bins=edges, weights=weights)
+    return {
+        "mean": float(np.average(proba, weights=weights)),
+        "positive_rate": float(np.average(proba >= 0.5, weights=weights)),
+        "histogram": {"edges": edges.tolist(), "counts": (counts / weights.sum() * len(proba)).tolist()},
+    }
+
+
+def holdout_probability_statistics(clf, X, y, chunk_size=500000, n_bins=10):
+    """
+    probability_statistics de `clf` sur un jeu hors entraînement (test ou holdout), prédit par chunks :
+    sur les lignes du train, les P(fraude) d'une forêt profonde sont trop tranchées pour servir de référence.
+    """
+    y = np.asarray(y)
+    proba = np.concatenate([clf.predict_proba(np.asarray(X[i:i + chunk_size], dtype=np.float64))[:, -1]
+                            for i in range(0, len(y), chunk_size)]) if len(y) else np.empty(0)
+    classes, counts = np.unique(y, return_counts=True)
+    return probability_statistics(proba, y, {str(c): int(n) for c, n in zip(classes.tolist(), counts)}, n_bins=n_bins)
+
+
+def build_reference(X, y, max_rows=100000, method='stratified', class_balanced=False, n_bins=50, seed=42):
+    """
+    Données de référence du drift, en mémoire : échantillon float32 (DataFrame PCA_* + target) et
+    statistiques précalculées par feature sur tout `X` (qui peut être un mmap).
+    """
+    y = np.asarray(y)
+    pca_cols = [f'PCA_{i+1}' for i in range(X.shape[1])]
+
+    X_ref, y_ref = sample_reference(X, y, max_rows=max_rows, method=method, class_balanced=class_balanced, seed=seed)
+    ref_df = pd.DataFrame(X_ref, columns=pca_cols)
+    ref_df['target'] = y_ref
+
+    classes, counts = np.unique(y, return_counts=True)
+    stats = {
+        "n_rows": int(len(y)),
+        "sample_rows": int(len(y_ref)),
+        "sampling": {"method": method, "class_balanced": class_balanced, "max_rows": max_rows},
+        "target": {str(c): int(n) for c, n in zip(classes.tolist(), counts)},
+        "features": feature_statistics(X, pca_cols, n_bins=n_bins, seed=seed),
+    }
+    return ref_df, stats
+
+
+def save_reference(output_dir, ref_df, stats, fmt='parquet'):
+    """Ecrit l'échantillon (Parquet, ou CSV historique) et ref_stats.json dans `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    if fmt == 'csv':
+        ref_file = os.path.join(output_dir, REF_CSV_FILE)
+        ref_df.to_csv(ref_file, index=False)
+    else:
+        ref_file = os.path.join(output_dir, REF_DATA_FILE)
+        ref_df.to_parquet(ref_file + '.tmp', index=False)
+        os.replace(ref_file + '.tmp', ref_file)
+        # Un ancien CSV serait relu par un reporting antérieur à la place du nouvel échantillon
+        legacy = os.path.join(output_dir, REF_CSV_FILE)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    stats_file = os.path.join(output_dir, REF_STATS_FILE)
+    with open(stats_file + '.tmp', 'w') as f:
+        json.dump(stats, f)
+    os.replace(stats_file + '.tmp', stats_file)
+
+    sampling = stats["sampling"]
+    logger.info(f"Référence: {stats['sample_rows']}/{stats['n_rows']} lignes ({sampling['method']}"
+                f"{', équilibré' if sampling['class_balanced'] else ''}) dans {ref_file} "
+                f"({os.path.getsize(ref_file) / 1e6:.1f} MB), statistiques dans {stats_file}")
+    return ref_file
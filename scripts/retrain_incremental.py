@@ -0,0 +1,306 @@
+import os
+import sys
+import copy
+import json
+import hashlib
+import argparse
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score, accuracy_score
+
+from reference import holdout_probability_statistics
+from train_model import save_outputs, SERVING_DIR
+
+sys.path.insert(0, SERVING_DIR)
+from registry import ArtifactBundle, ArtifactRegistry, LEGACY_VERSION, MANIFEST_FILE, load_reference_stats  # noqa: E402
+from feedback_store import feedback_files, read_feedback  # noqa: E402
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'state.json'
+HOLDOUT_FILE = 'holdout.parquet'
+TRAIN_FILE = 'train.parquet'
+# Un worker de l'API peut écrire ses feedbacks (reçus plus tôt) après ceux d'un autre : les partitions
+# récentes sont relistées et leurs fichiers déjà ingérés sont reconnus par leur nom
+FILE_GRACE = pd.Timedelta(hours=2)
+
+
+def features_fingerprint(path, manifest=None):
+    """
+    Identifie l'espace PCA d'une version : hash de preprocessor + PCA, ou celui hérité de la
+    version de base pour une version publiée par ce job (seule la forêt change).
+    """
+    if manifest and manifest.get("features_fingerprint"):
+        return manifest["features_fingerprint"]
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ('preprocessor.pickle', 'pca.pickle'):
+        with open(os.path.join(path, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def version_dir(registry, version):
+    return registry.root if version == LEGACY_VERSION else os.path.join(registry.versions_dir, version)
+
+
+def compatible_versions(registry, fingerprint, known):
+    """Versions dont les vecteurs PCA sont dans le même espace que la base (`known` : cache version -> empreinte)."""
+    manifests = {m["version"]: m for m in registry.list_versions()}
+    versions = list(manifests)
+    if os.path.exists(os.path.join(registry.root, 'pca.pickle')):
+        versions.append(LEGACY_VERSION)
+    for version in versions:
+        if version not in known:
+            try:
+                known[version] = features_fingerprint(version_dir(registry, version), manifests.get(version))
+            except OSError:
+                known[version] = None
+    return {v for v in versions if known.get(v) == fingerprint}
+
+
+def load_state(state_dir):
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {"offset": None, "files": {}, "fingerprint": None, "fingerprints": {}, "runs": 0, "last_result": None}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state_dir, state):
+    tmp_path = os.path.join(state_dir, STATE_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, os.path.join(state_dir, STATE_FILE))
+
+
+def read_buffer(state_dir, name):
+    path = os.path.join(state_dir, name)
+    return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+
+
+def write_buffer(state_dir, name, df, max_rows):
+    """Garde les `max_rows` lignes les plus récentes (fenêtre glissante), écriture atomique."""
+    df = df.tail(max_rows).reset_index(drop=True)
+    tmp_path = os.path.join(state_dir, '.' + name + '.tmp')
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(state_dir, name))
+    return df
+
+
+def split_xy(df):
+    pca_cols = [c for c in df.columns if c.startswith('PCA_')]
+    pca_cols.sort(key=lambda c: int(c.split('_')[1]))
+    return df[pca_cols].to_numpy(dtype=np.float64), df['target'].to_numpy(dtype=bool)
+
+
+def build_candidate(base_model, X, y, strategy, new_trees=10, max_trees=200):
+    """
+    warm_start : la forêt de base garde ses arbres et en gagne `new_trees` entraînés sur les nouvelles
+    données (les plus anciens sont retirés au-delà de `max_trees`).
+    window : nouvelle forêt, mêmes hyperparamètres, entraînée sur la fenêtre glissante.
+    """
+    if strategy == "warm_start":
+        clf = copy.deepcopy(base_model)
+        clf.set_params(warm_start=True, n_estimators=len(clf.estimators_) + new_trees)
+        clf.fit(X, y)
+        if len(clf.estimators_) > max_trees:
+            clf.estimators_ = clf.estimators_[-max_trees:]
+        clf.set_params(warm_start=False, n_estimators=len(clf.estimators_))
+        return clf
+
+    params = base_model.get_params()
+    params["warm_start"] = False
+    clf = RandomForestClassifier(**params)
+    clf.fit(X, y)
+    return clf
+
+
+def evaluate(clf, X, y):
+    y_pred = clf.predict(X)
+    return {"f1": float(f1_score(y, y_pred, zero_division=0)), "accuracy": float(accuracy_score(y, y_pred))}
+
+
+def retrain(artifacts_dir, feedback_dir, state_dir, strategy="warm_start", new_trees=10, max_trees=200,
+            window_rows=50000, holdout_fraction=0.2, holdout_rows=5000, min_train_rows=100, min_holdout_rows=50,
+            budget=None, seed=42):
+    """
+    Consomme les feedbacks reçus depuis le dernier offset, met à jour les buffers (train / holdout),
+    puis publie une nouvelle version si le candidat fait au moins aussi bien que la base sur le holdout.
+    Renvoie la version publiée, ou None.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state = load_state(state_dir)
+
+    registry = ArtifactRegistry(artifacts_dir)
+    base_version = registry.target_version()
+    base_path = version_dir(registry, base_version)
+    manifest_path = os.path.join(base_path, MANIFEST_FILE)
+    base_manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            base_manifest = json.load(f)
+    base = ArtifactBundle.from_pickles(base_path, base_version, manifest=base_manifest, fast_forest=False)
+    fingerprint = features_fingerprint(base_path, base_manifest)
+
+    if state["fingerprint"] != fingerprint:
+        # Nouvel espace PCA (réentraînement complet) : les buffers ne sont plus comparables
+        if state["fingerprint"] is not None:
+            logger.info("Preprocessor/PCA de base modifiés, buffers réinitialisés.")
+        for name in (HOLDOUT_FILE, TRAIN_FILE):
+            if os.path.exists(os.path.join(state_dir, name)):
+                os.remove(os.path.join(state_dir, name))
+        state["fingerprint"] = fingerprint
+
+    # 1. Fichiers pas encore ingérés (partitions depuis l'offset moins FILE_GRACE), restreints au même espace PCA
+    since = pd.Timestamp(state["offset"]) if state["offset"] else None
+    listed = feedback_files(feedback_dir, since=since - FILE_GRACE if since is not None else None)
+    seen = state.get("files")
+    # Etat antérieur (offset seul) : les lignes déjà consommées sont filtrées une dernière fois par date
+    legacy_since = since if seen is None else None
+    seen = seen or {}
+    new_files = [(partition, path) for partition, path in listed
+                 if os.path.basename(path) not in seen.get(partition, ())]
+    new = read_feedback(feedback_dir, since=legacy_since, files=[path for _, path in new_files])
+    logger.info(f"Version de base {base_version}, {len(new)} nouveau(x) feedback(s) dans {len(new_files)} fichier(s).")
+
+    if new_files:
+        # Les partitions qui ne sont plus listées (antérieures à la grâce) sont oubliées
+        listed_partitions = {partition for partition, _ in listed}
+        files = {partition: names for partition, names in seen.items() if partition in listed_partitions}
+        for partition, path in new_files:
+            files.setdefault(partition, []).append(os.path.basename(path))
+        state["files"] = files
+
+    if len(new):
+        offset = max(new['received_at'].max(), since) if since is not None else new['received_at'].max()
+        versions = compatible_versions(registry, fingerprint, state["fingerprints"])
+        if 'artifact_version' in new.columns:
+            compatible = new['artifact_version'].isin(versions)
+        else:
+            compatible = pd.Series(False, index=new.index)
+        if (~compatible).any():
+            logger.info(f"{int((~compatible).sum())} feedback(s) ignoré(s) : version inconnue ou autre espace PCA.")
+        new = new[compatible]
+
+        # 2. Répartition holdout / train, ajout aux buffers persistés, puis avancée de l'offset
+        rng = np.random.default_rng([seed, int(offset.value % 2 ** 32)])
+        is_holdout = rng.random(len(new)) < holdout_fraction
+        holdout = write_buffer(state_dir, HOLDOUT_FILE,
+                               pd.concat([read_buffer(state_dir, HOLDOUT_FILE), new[is_holdout]], ignore_index=True),
+                               holdout_rows)
+        train = write_buffer(state_dir, TRAIN_FILE,
+                             pd.concat([read_buffer(state_dir, TRAIN_FILE), new[~is_holdout]], ignore_index=True),
+                             window_rows)
+        state["offset"] = offset.isoformat()
+        save_state(state_dir, state)
+    else:
+        holdout = read_buffer(state_dir, HOLDOUT_FILE)
+        train = read_buffer(state_dir, TRAIN_FILE)
+        if new_files:
+            save_state(state_dir, state)
+
+    state["runs"] += 1
+    state["last_run_at"] = datetime.now(timezone.utc).isoformat()
+
+    def finish(result):
+        state["last_result"] = result
+        save_state(state_dir, state)
+        logger.info(f"Résultat: {result}")
+        return result.get("version")
+
+    # 3. Assez de données ?
+    if len(train) < min_train_rows or len(holdout) < min_holdout_rows:
+        return finish({"status": "waiting", "train_rows": len(train), "holdout_rows": len(holdout)})
+    X_train, y_train = split_xy(train)
+    X_holdout, y_holdout = split_xy(holdout)
+    if len(np.unique(y_train)) < 2:
+        return finish({"status": "waiting", "reason": "une seule classe dans les données de train"})
+
+    # 4. Candidat et validation sur le holdout
+    candidate = build_candidate(base.model, X_train, y_train, strategy, new_trees=new_trees, max_trees=max_trees)
+    base_scores = evaluate(base.model, X_holdout, y_holdout)
+    candidate_scores = evaluate(candidate, X_holdout, y_holdout)
+    logger.info(f"Holdout ({len(holdout)} lignes) - base: {base_scores}, candidat: {candidate_scores}")
+
+    # Les données de train sont consommées par une tentative warm_start; la fenêtre, elle, glisse
+    if strategy == "warm_start":
+        write_buffer(state_dir, TRAIN_FILE, train.iloc[0:0], window_rows)
+
+    result = {
+        "strategy": strategy,
+        "base_version": base_version,
+        "train_rows": len(train),
+        "holdout_rows": len(holdout),
+        "base": base_scores,
+        "candidate": candidate_scores,
+    }
+    if candidate_scores["f1"] < base_scores["f1"]:
+        return finish({**result, "status": "rejected"})
+
+    # 5. Publication : preprocessor et PCA inchangés, seule la forêt change
+    manifest = {
+        "metrics": candidate_scores,
+        "params": {
+            "strategy": strategy,
+            "base_version": base_version,
+            "n_estimators": len(candidate.estimators_),
+            "train_rows": len(train),
+            "holdout_rows": len(holdout),
+            "feedback_offset": state["offset"],
+        },
+        "features_fingerprint": fingerprint,
+    }
+    # Même espace PCA : statistiques des features de la base ; distribution de P(fraude) du candidat sur le holdout
+    reference_stats = load_reference_stats(base_path)
+    if reference_stats is not None:
+        reference_stats["prediction_proba"] = holdout_probability_statistics(candidate, X_holdout, y_holdout)
+    else:
+        logger.warning(f"Pas de ref_stats.json pour la version {base_version} : drift en ligne désactivé pour le candidat.")
+    sample_rows = base.features.probe_rows() if base.features is not None else None
+    version = save_outputs(None, artifacts_dir, base.preprocessor, base.pca, candidate, None, manifest,
+                           sample_rows=sample_rows, budget=budget, reference_stats=reference_stats)
+    return finish({**result, "status": "published" if version else "rejected_budget", "version": version})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Réentraînement incrémental à partir des feedbacks de production")
+    parser.add_argument("--artifacts_dir", type=str, default="artifacts", help="Registre des artefacts (comme l'API)")
+    parser.add_argument("--feedback_dir", type=str, default="data/feedback", help="Store Parquet des feedbacks (FEEDBACK_STORE_PATH)")
+    parser.add_argument("--state_dir", type=str, default="data/retrain_state", help="Offset et buffers persistés du job")
+    parser.add_argument("--strategy", choices=["warm_start", "window"], default="warm_start",
+                        help="warm_start : ajoute des arbres ; window : réentraîne sur une fenêtre glissante")
+    parser.add_argument("--new_trees", type=int, default=10, help="warm_start : arbres ajoutés par exécution")
+    parser.add_argument("--max_trees", type=int, default=200, help="warm_start : nombre max d'arbres (les plus anciens sont retirés)")
+    parser.add_argument("--window_rows", type=int, default=50000, help="Taille de la fenêtre glissante de train")
+    parser.add_argument("--holdout_fraction", type=float, default=0.2, help="Part des nouveaux feedbacks réservée au holdout")
+    parser.add_argument("--holdout_rows", type=int, default=5000, help="Taille max du holdout (les plus récents)")
+    parser.add_argument("--min_train_rows", type=int, default=100)
+    parser.add_argument("--min_holdout_rows", type=int, default=50)
+    parser.add_argument("--max_single_row_ms", type=float, default=None, help="Budget : latence unitaire p99 max (ms)")
+    parser.add_argument("--max_model_mb", type=float, default=None, help="Budget : taille max de model.pickle (MB)")
+
+    args = parser.parse_args()
+
+    retrain(
+        artifacts_dir=args.artifacts_dir,
+        feedback_dir=args.feedback_dir,
+        state_dir=args.state_dir,
+        strategy=args.strategy,
+        new_trees=args.new_trees,
+        max_trees=args.max_trees,
+        window_rows=args.window_rows,
+        holdout_fraction=args.holdout_fraction,
+        holdout_rows=args.holdout_rows,
+        min_train_rows=args.min_train_rows,
+        min_holdout_rows=args.min_holdout_rows,
+        budget={"max_single_row_ms": args.max_single_row_ms, "max_model_mb": args.max_model_mb}
+    )
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Mêmes artefacts et même code de transformation que l'API (serving/)
+SERVING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serving')
+sys.path.insert(0, SERVING_DIR)
+
+from registry import ArtifactRegistry  # noqa: E402
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Bundle chargé une fois par process du pool
+_bundle = None
+
+
+def load_bundle(artifacts_dir, version=None):
+    """Version demandée, sinon celle que servirait l'API (épinglée ou la plus récente)."""
+    registry = ArtifactRegistry(artifacts_dir)
+    return registry.load_bundle(version or registry.target_version())
+
+
+def init_worker(artifacts_dir, version):
+    global _bundle
+    _bundle = load_bundle(artifacts_dir, version)
+
+
+def score_chunk(df):
+    """Scoring vectorisé d'un chunk : mêmes étapes que score_rows dans serving/api.py."""
+    X_pca = _bundle.transform_frame(df)
+    predictions, proba = _bundle.predict_with_proba(X_pca)
+    return np.asarray(predictions, dtype=bool), proba.max(axis=1)
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ndjson", ".jsonl", ".json"):
+        return "ndjson"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    return "csv"
+
+
+def read_chunks(path, chunk_size, columns=None):
+    """Itère sur le fichier par blocs de `chunk_size` lignes, sans jamais le charger en entier."""
+    fmt = detect_format(path)
+    if fmt == "csv":
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+    elif fmt == "ndjson":
+        for chunk in pd.read_json(path, lines=True, chunksize=chunk_size):
+            yield chunk[columns] if columns else chunk
+    else:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+
+
+def count_rows(path):
+    """Nombre de lignes si on peut l'obtenir sans lire les données (Parquet), sinon None."""
+    if detect_format(path) == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+
+class ResultWriter:
+    """Ecrit les prédictions au fil de l'eau (CSV ou NDJSON selon l'extension)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = "ndjson" if detect_format(path) == "ndjson" else "csv"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "w", newline="")
+        self._header = True
+
+    def write(self, out):
+        if self.format == "csv":
+            out.to_csv(self._file, index=False, header=self._header)
+        else:
+            # json.dumps plutôt que to_json : probabilités écrites sans arrondi, comme l'API
+            for record in out.to_dict(orient="records"):
+                self._file.write(json.dumps(record) + "\n")
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+
+def score_file(input_path, output_path, artifacts_dir, version=None, chunk_size=50000, workers=None,
+               keep_columns=None, log_every_s=5.0):
+    workers = workers or os.cpu_count() or 1
+    keep_columns = keep_columns or []
+
+    # Le parent charge aussi le bundle : version résolue une fois et colonnes d'entrée connues
+    bundle = load_bundle(artifacts_dir, version)
+    version = bundle.version
+    if bundle.features is not None:
+        feature_cols = bundle.features.numerical_cols + bundle.features.categorical_cols
+    else:
+        feature_cols = [c for _, _, cols in bundle.preprocessor.transformers_ for c in cols]
+    columns = list(dict.fromkeys(feature_cols + keep_columns))
+    logger.info(f"Scoring de {input_path} avec la version {version} ({workers} process, chunks de {chunk_size}).")
+
+    total = count_rows(input_path)
+    writer = ResultWriter(output_path)
+    n_rows = n_fraud = 0
+    start = last_log = time.perf_counter()
+
+    def drain(entry):
+        nonlocal n_rows, n_fraud
+        offset, kept, future = entry
+        predictions, probabilities = future.result()
+        out = kept.copy() if kept is not None else pd.DataFrame(index=range(len(predictions)))
+        out.insert(0, "row", np.arange(offset, offset + len(predictions)))
+        out["prediction"] = predictions
+        out["probability"] = probabilities
+        writer.write(out)
+        n_rows += len(predictions)
+        n_fraud += int(predictions.sum())
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(artifacts_dir, version)) as pool:
+            # Au plus 2 chunks en vol par process : mémoire bornée, résultats écrits dans l'ordre
+            pending = deque()
+            offset = 0
+            for chunk in read_chunks(input_path, chunk_size, columns):
+                chunk = chunk.reset_index(drop=True)
+                kept = chunk[keep_columns] if keep_columns else None
+                pending.append((offset, kept, pool.submit(score_chunk, chunk[feature_cols])))
+                offset += len(chunk)
+                while len(pending) >= 2 * workers:
+                    drain(pending.popleft())
+
+                now = time.perf_counter()
+                if now - last_log >= log_every_s:
+                    last_log = now
+                    progress = f"{n_rows}/{total}" if total else f"{n_rows}"
+                    logger.info(f"{progress} lignes scorées ({n_rows / (now - start):.0f} lignes/s).")
+            while pending:
+                drain(pending.popleft())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "version": version,
+        "rows": n_rows,
+        "fraud": n_fraud,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(n_rows / elapsed, 1) if elapsed else None,
+        "output": output_path,
+    }
+    logger.info(f"Scoring terminé: {json.dumps(summary)}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scoring hors ligne d'un fichier de transactions (CSV/NDJSON/Parquet)")
+    parser.add_argument("--input", type=str, default="synthetic_fraud_data.csv", help="Fichier à scorer")
+    parser.add_argument("--output", type=str, default="data/scores.csv", help="Fichier de sortie (.csv ou .ndjson)")
+    parser.add_argument("--artifacts_dir", type=str, default="artifacts", help="Dossier des artefacts (comme l'API)")
+    parser.add_argument("--version", type=str, default=None, help="Version d'artefacts (défaut : celle servie par l'API)")
+    parser.add_argument("--chunk_size", type=int, default=50000, help="Lignes par chunk")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de process (défaut : nombre de CPU)")
+    parser.add_argument("--keep", type=str, nargs="*", default=[], help="Colonnes d'entrée recopiées en sortie (ex: transaction_id)")
+
+    args = parser.parse_args()
+
+    score_file(
+        input_path=args.input,
+        output_path=args.output,
+        artifacts_dir=args.artifacts_dir,
+        version=args.version,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        keep_columns=args.keep
+    )
@@ -0,0 +1,149 @@
+import os
+import json
+import math
+import time
+import itertools
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score, accuracy_score
+
+logger = logging.getLogger(__name__)
+
+# Grille par défaut : 3 x 4 x 2 = 24 candidats
+DEFAULT_SPACE = {
+    "n_estimators": [50, 100, 200],
+    "max_depth": [6, 10, 14, None],
+    "min_samples_leaf": [1, 5],
+}
+
+LEADERBOARD_FILE = "leaderboard"
+
+
+def candidate_grid(space):
+    """Produit cartésien de l'espace de recherche, une config (dict) par candidat."""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def cache_matrices(work_dir, X_train_pca, y_train, val_fraction=0.2, seed=42):
+    """
+    Ecrit une fois les matrices PCA (fit / validation) en .npy, relues en mmap par les workers.
+    Les lignes de fit sont mélangées : les k premières forment un échantillon aléatoire de taille k.
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(y_train))
+    n_val = max(1, int(len(order) * val_fraction))
+    val_idx, fit_idx = order[:n_val], order[n_val:]
+
+    paths = {}
+    for name, array in (("X_fit", X_train_pca[fit_idx]), ("y_fit", y_train[fit_idx]),
+                        ("X_val", X_train_pca[val_idx]), ("y_val", y_train[val_idx])):
+        paths[name] = os.path.join(work_dir, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(array))
+    return paths, len(fit_idx)
+
+
+def evaluate_candidate(paths, params, n_rows, seed=42):
+    """Worker : entraîne un candidat sur les `n_rows` premières lignes de fit et le mesure sur la validation."""
+    X_fit = np.load(paths["X_fit"], mmap_mode='r')
+    y_fit = np.load(paths["y_fit"], mmap_mode='r')
+    X_val = np.load(paths["X_val"], mmap_mode='r')
+    y_val = np.load(paths["y_val"])
+
+    clf = RandomForestClassifier(random_state=seed, n_jobs=1, **params)
+    start = time.perf_counter()
+    clf.fit(np.asarray(X_fit[:n_rows]), np.asarray(y_fit[:n_rows]))
+    fit_time = time.perf_counter() - start
+
+    X_val = np.asarray(X_val)
+    start = time.perf_counter()
+    proba = clf.predict_proba(X_val)
+    batch_time = time.perf_counter() - start
+    y_pred = clf.classes_[proba.argmax(axis=1)]
+
+    # Latence unitaire, comme un appel /predict : médiane de quelques prédictions d'une ligne
+    single = []
+    for row in X_val[:20]:
+        start = time.perf_counter()
+        clf.predict_proba(row.reshape(1, -1))
+        single.append(time.perf_counter() - start)
+
+    return {
+        **{f"param_{k}": v for k, v in params.items()},
+        "params": params,
+        "n_rows": int(n_rows),
+        "f1": float(f1_score(y_val, y_pred)),
+        "accuracy": float(accuracy_score(y_val, y_pred)),
+        "fit_time_s": fit_time,
+        "latency_ms_per_row": 1000 * batch_time / len(X_val),
+        "single_row_latency_ms": 1000 * float(np.median(single)) if single else None,
+    }
+
+
+def successive_halving(paths, n_fit, candidates, n_jobs=None, factor=3, min_rows=1000):
+    """
+    Successive halving : tous les candidats sur peu de lignes, on garde le meilleur 1/`factor`,
+    puis on multiplie le budget (lignes de fit) par `factor` jusqu'au jeu complet.
+    """
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)) + 1) if len(candidates) > 1 else 1
+    rows = min(n_fit, max(min_rows, n_fit // factor ** (n_rounds - 1)))
+    n_jobs = n_jobs or os.cpu_count() or 1
+    results = []
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for round_index in range(n_rounds):
+            logger.info(f"Round {round_index + 1}/{n_rounds}: {len(candidates)} candidat(s) sur {rows} lignes")
+            futures = [pool.submit(evaluate_candidate, paths, params, rows) for params in candidates]
+            scores = [f.result() for f in futures]
+            for score in scores:
+                score["round"] = round_index + 1
+            results.extend(scores)
+
+            # Meilleur F1, puis le plus rapide à prédire à F1 égal
+            scores.sort(key=lambda s: (-s["f1"], s["latency_ms_per_row"]))
+            if len(scores) == 1 or rows >= n_fit and round_index > 0:
+                break
+            candidates = [s["params"] for s in scores[:max(1, math.ceil(len(scores) / factor))]]
+            rows = min(n_fit, rows * factor)
+
+    return results, scores[0]["params"]
+
+
+def write_leaderboard(results, artifacts_dir):
+    """Classement de tous les essais (CSV + JSON) à côté des artefacts."""
+    os.makedirs(artifacts_dir, exist_ok=True)
+    df = pd.DataFrame([{k: v for k, v in r.items() if k != "params"} for r in results])
+    df = df.sort_values(["round", "f1", "latency_ms_per_row"], ascending=[False, False, True])
+    csv_path = os.path.join(artifacts_dir, f"{LEADERBOARD_FILE}.csv")
+    df.to_csv(csv_path, index=False)
+    with open(os.path.join(artifacts_dir, f"{LEADERBOARD_FILE}.json"), 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    return csv_path
+
+
+def search_hyperparameters(X_train_pca, y_train, artifacts_dir, space=None, n_jobs=None, factor=3,
+                           min_rows=1000, work_dir=None):
+    """
+    Recherche des hyperparamètres de la forêt sur les matrices PCA déjà calculées.
+    Renvoie les paramètres du meilleur candidat (F1 de validation).
+    """
+    candidates = candidate_grid(space or DEFAULT_SPACE)
+    logger.info(f"Recherche d'hyperparamètres: {len(candidates)} candidats, {n_jobs or os.cpu_count()} process")
+    start = time.perf_counter()
+
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='search-') as tmp_dir:
+        paths, n_fit = cache_matrices(tmp_dir, np.asarray(X_train_pca), np.asarray(y_train))
+        results, best = successive_halving(paths, n_fit, candidates, n_jobs=n_jobs, factor=factor,
+                                           min_rows=min_rows)
+
+    csv_path = write_leaderboard(results, artifacts_dir)
+    logger.info(f"Recherche terminée en {time.perf_counter() - start:.1f}s, meilleur candidat: {best}. "
+                f"Leaderboard: {csv_path}")
+    return best
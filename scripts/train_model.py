@@ -2,8 +2,15 @@ import pandas as pd
 import numpy as np
 import pickle
 import os
+import sys
+import json
+import shutil
 import argparse
 import logging
+import tempfile
+import time
+from datetime import datetime, timezone
+import sklearn
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.decomposition import PCA
@@ -12,6 +19,16 @@ from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import f1_score, accuracy_score, classification_report
 
+from data_loader import load_dataset, feature_columns
+import out_of_core
+from search import search_hyperparameters
+from profiling import METRICS_FILE, check_budget, profile_artifacts
+from reference import REF_STATS_FILE, build_reference, holdout_probability_statistics, save_reference, stratified_sample
+
+# Modules de compilation partagés avec l'API (serving/)
+SERVING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serving')
+PACK_FILE = 'model_pack.npy' # serving/artifact_pack.py
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,12 +36,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimators=50, max_depth=10):
+def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimators=50, max_depth=10,
+                   chunk_size=500000, cache_dir=None, search=False, search_space=None, n_jobs=None, budget=None,
+                   ref_options=None, ref_format='parquet'):
     logger.info(f"Démarrage de l'entraînement. Data: {data_path}, Max Rows: {nrows}")
     
     try:
-        # Load Data
-        df = pd.read_csv(data_path, nrows=nrows)
+        # Load Data : colonnes utiles uniquement, types compacts, cache Parquet
+        df = load_dataset(data_path, nrows=nrows, chunk_size=chunk_size, cache_dir=cache_dir)
         logger.info(f"Données chargées: {df.shape}")
     except FileNotFoundError:
         logger.error(f"Fichier non trouvé: {data_path}")
@@ -35,14 +54,7 @@ def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimator
 
     # Preprocessing
     logger.info("Début du preprocessing...")
-    
-    # Drop columns
-    drop_cols = [
-        'transaction_id', 'customer_id', 'card_number', 'timestamp', 
-        'merchant', 'city', 'device_fingerprint', 'ip_address', 
-        'velocity_last_hour'
-    ]
-    df = df.drop(columns=drop_cols, errors='ignore')
+    # Les colonnes inutiles (identifiants, texte libre) ne sont pas lues par le loader
     
     # Features & Target
     if 'is_fraud' not in df.columns:
@@ -56,8 +68,7 @@ def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimator
     X_train_raw, X_test_raw, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
 
     # Identification des colonnes
-    categorical_cols = X.select_dtypes(include=['object', 'bool']).columns.tolist()
-    numerical_cols = X.select_dtypes(include=['number']).columns.tolist()
+    categorical_cols, numerical_cols = feature_columns(X)
     
     logger.info(f"Colonnes numériques: {len(numerical_cols)}")
     logger.info(f"Colonnes catégorielles: {len(categorical_cols)}")
@@ -85,9 +96,15 @@ def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimator
     X_train_pca = pca.fit_transform(X_train_processed)
     X_test_pca = pca.transform(X_test_processed)
 
+    # Recherche d'hyperparamètres (optionnelle) : preprocessing et PCA ne sont calculés qu'une fois
+    model_params = {"n_estimators": n_estimators, "max_depth": max_depth}
+    if search:
+        model_params = search_hyperparameters(X_train_pca, y_train.values, artifacts_dir, space=search_space,
+                                              n_jobs=n_jobs, work_dir=output_dir)
+
     # Entraînement Modèle
-    logger.info("Entraînement du modèle RandomForest...")
-    clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42)
+    logger.info(f"Entraînement du modèle RandomForest {model_params}...")
+    clf = RandomForestClassifier(**model_params, random_state=42)
     clf.fit(X_train_pca, y_train)
 
     # Évaluation
@@ -98,50 +115,315 @@ def train_and_save(data_path, output_dir, artifacts_dir, nrows=None, n_estimator
     logger.info(f"Modèle entraîné. F1-Score: {f1:.4f}, Accuracy: {acc:.4f}")
     logger.info("\n" + classification_report(y_test, y_pred))
 
-    # Sauvegarde des données de référence (Training data transformé) pour Drfit Monitoring
-    # On sauvegarde une partie pour pas faire exploser le fichier
-    logger.info("Sauvegarde des données de référence...")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    pca_cols = [f'PCA_{i+1}' for i in range(n_components)]
-    ref_df = pd.DataFrame(X_train_pca, columns=pca_cols)
-    ref_df['target'] = y_train.values
-    
-    ref_file = os.path.join(output_dir, 'ref_data.csv')
-    ref_df.to_csv(ref_file, index=False)
-    logger.info(f"Données de référence sauvegardées dans {ref_file}")
+    # Référence du drift : échantillon compact du train + statistiques sur le train complet ;
+    # distribution de P(fraude) sur le test (hors échantillon, comme le trafic servi)
+    reference = build_reference(X_train_pca, y_train.to_numpy(), **(ref_options or {}))
+    prediction_stats = holdout_probability_statistics(clf, X_test_pca, y_test.to_numpy())
+
+    manifest = {
+        "metrics": {"f1": f1, "accuracy": acc},
+        "params": {
+            **model_params,
+            "n_components": n_components,
+            "nrows": nrows,
+            "n_rows_loaded": len(df),
+            "data_path": data_path,
+            "search": search
+        }
+    }
+    # Transactions brutes pour le profilage de latence (comme reçues par l'API)
+    sample_rows = X_test_raw.head(1000).to_dict(orient='records')
+    return save_outputs(output_dir, artifacts_dir, preprocessor, pca, clf, reference, manifest,
+                        sample_rows=sample_rows, budget=budget, ref_format=ref_format, prediction_stats=prediction_stats)
+
+def train_out_of_core(data_path, output_dir, artifacts_dir, nrows=None, n_estimators=50, max_depth=10,
+                      chunk_size=500000, max_train_rows=2000000, work_dir=None, budget=None,
+                      ref_options=None, ref_format='parquet'):
+    """
+    Entraînement sur un fichier plus grand que la RAM, en trois passes par chunks :
+    statistiques du preprocessor, IncrementalPCA.partial_fit, projection PCA dans des mmap.
+    La forêt est entraînée sur un échantillon stratifié du mmap (au plus `max_train_rows` lignes).
+    Les artefacts produits sont les mêmes classes sklearn que l'entraînement en mémoire.
+    """
+    logger.info(f"Démarrage de l'entraînement out-of-core. Data: {data_path}, chunks de {chunk_size} lignes")
+    if not os.path.exists(data_path):
+        logger.error(f"Fichier non trouvé: {data_path}")
+        return
+    start = time.perf_counter()
+    n_components = 10
+
+    logger.info("Passe 1 : statistiques du preprocessor...")
+    stats = out_of_core.collect_statistics(data_path, nrows=nrows, chunk_size=chunk_size)
+    preprocessor = out_of_core.build_preprocessor(stats)
+    logger.info(f"Colonnes numériques: {len(stats['numerical_cols'])}")
+    logger.info(f"Colonnes catégorielles: {len(stats['categorical_cols'])}")
+
+    logger.info(f"Passe 2 : IncrementalPCA ({n_components} composants)...")
+    pca = out_of_core.fit_incremental_pca(data_path, preprocessor, n_components=n_components,
+                                          nrows=nrows, chunk_size=chunk_size)
+
+    work_dir = work_dir or output_dir
+    os.makedirs(work_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='ooc-') as tmp_dir:
+        logger.info("Passe 3 : projection PCA vers mmap...")
+        X_train_pca, y_train, X_test_pca, y_test = out_of_core.transform_to_memmap(
+            data_path, preprocessor, pca, stats, tmp_dir, nrows=nrows, chunk_size=chunk_size)
+
+        sample = stratified_sample(y_train, max_train_rows)
+        logger.info(f"Entraînement du modèle RandomForest sur {len(sample)}/{len(y_train)} lignes...")
+        clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42)
+        clf.fit(np.asarray(X_train_pca[sample]), y_train[sample])
+
+        # Évaluation sur tout le test, par chunks
+        y_pred = out_of_core.predict_in_chunks(clf, X_test_pca, chunk_size)
+        f1 = f1_score(y_test, y_pred)
+        acc = accuracy_score(y_test, y_pred)
+        logger.info(f"Modèle entraîné. F1-Score: {f1:.4f}, Accuracy: {acc:.4f}")
+        logger.info("\n" + classification_report(y_test, y_pred))
 
+        # Référence du drift : échantillon et statistiques calculés par chunks sur tout le mmap de train
+        reference = build_reference(X_train_pca, y_train, **(ref_options or {}))
+        prediction_stats = holdout_probability_statistics(clf, X_test_pca, y_test, chunk_size)
+
+        # Libère les mmap avant la suppression du dossier temporaire
+        del X_train_pca, X_test_pca
+
+    manifest = {
+        "metrics": {"f1": f1, "accuracy": acc},
+        "params": {
+            "n_estimators": n_estimators,
+            "max_depth": max_depth,
+            "n_components": n_components,
+            "nrows": nrows,
+            "n_rows_loaded": stats["n_train"] + stats["n_test"],
+            "data_path": data_path,
+            "out_of_core": True,
+            "chunk_size": chunk_size,
+            "train_rows_used": int(len(sample))
+        }
+    }
+    sample_rows = stats["first_chunk"].to_dict(orient='records')
+    version = save_outputs(output_dir, artifacts_dir, preprocessor, pca, clf, reference, manifest,
+                           sample_rows=sample_rows, budget=budget, ref_format=ref_format,
+                           prediction_stats=prediction_stats)
+    logger.info(f"Entraînement out-of-core terminé en {time.perf_counter() - start:.1f}s")
+    return version
+
+def save_outputs(output_dir, artifacts_dir, preprocessor, pca, clf, reference, manifest, sample_rows=None, budget=None,
+                 ref_format='parquet', reference_stats=None, prediction_stats=None):
+    """
+    Pickles et pack mmap écrits dans un dossier temporaire, profilés avec le code de serving, puis,
+    si le budget (F1 / latence / taille) est respecté : données de référence (si `reference`, cf. build_reference)
+    et nouvelle version. Sans `reference`, `reference_stats` (ref_stats.json déjà complet) est publié avec la version.
+    `prediction_stats` (cf. holdout_probability_statistics) complète les statistiques de `reference`.
+    Renvoie la version publiée, ou None si le modèle est rejeté.
+    """
     # Sauvegarde des artefacts
     logger.info("Sauvegarde des artefacts...")
     os.makedirs(artifacts_dir, exist_ok=True)
+    stage_dir = tempfile.mkdtemp(dir=artifacts_dir, prefix='.staging-')
+    try:
+        with open(os.path.join(stage_dir, 'preprocessor.pickle'), 'wb') as f:
+            pickle.dump(preprocessor, f)
+            
+        with open(os.path.join(stage_dir, 'pca.pickle'), 'wb') as f:
+            pickle.dump(pca, f)
+            
+        with open(os.path.join(stage_dir, 'model.pickle'), 'wb') as f:
+            pickle.dump(clf, f)
+
+        # Pack mmap (preprocessing + PCA + forêt en tableaux NumPy) pour un démarrage rapide de l'API
+        export_pack(stage_dir, preprocessor, pca, clf)
 
-    with open(os.path.join(artifacts_dir, 'preprocessor.pickle'), 'wb') as f:
-        pickle.dump(preprocessor, f)
-        
-    with open(os.path.join(artifacts_dir, 'pca.pickle'), 'wb') as f:
-        pickle.dump(pca, f)
-        
-    with open(os.path.join(artifacts_dir, 'model.pickle'), 'wb') as f:
-        pickle.dump(clf, f)
+        # Statistiques de référence publiées avec la version : l'API y compare le trafic en continu
+        if reference is not None:
+            ref_df, ref_stats = reference
+            if prediction_stats is not None:
+                ref_stats["prediction_proba"] = prediction_stats
+            reference_stats = ref_stats
+        if reference_stats is not None:
+            with open(os.path.join(stage_dir, REF_STATS_FILE), 'w') as f:
+                json.dump(reference_stats, f)
+
+        # Profilage : latence unitaire / par lot, mémoire, taille, via le chemin de serving
+        model_metrics = {**manifest["metrics"], "profile": None}
+        if sample_rows:
+            logger.info("Profilage de l'inférence...")
+            model_metrics["profile"] = profile_artifacts(stage_dir, sample_rows)
+            p = model_metrics["profile"]
+            logger.info(f"Latence unitaire p50/p99: {p['single_row_ms']['p50']:.3f}/{p['single_row_ms']['p99']:.3f} ms, "
+                        f"lot: {p['batch_us_per_row']:.1f} µs/ligne, pic mémoire chargement: {p['pickle_load_peak_mb']:.1f} MB")
+        with open(os.path.join(stage_dir, METRICS_FILE), 'w') as f:
+            json.dump(model_metrics, f, indent=2)
+
+        violations = check_budget(manifest["metrics"], model_metrics["profile"], **(budget or {})) \
+            if model_metrics["profile"] else []
+        if violations:
+            logger.error("Modèle rejeté, budget non respecté : " + "; ".join(violations))
+            shutil.copy2(os.path.join(stage_dir, METRICS_FILE), os.path.join(artifacts_dir, f"rejected_{METRICS_FILE}"))
+            return None
+
+        produced = os.listdir(stage_dir)
+        for name in produced:
+            os.replace(os.path.join(stage_dir, name), os.path.join(artifacts_dir, name))
+        # Pack non généré (artefacts non compilables) : l'ancien pack servirait l'ancien modèle sous la nouvelle version
+        stale_pack = os.path.join(artifacts_dir, PACK_FILE)
+        if PACK_FILE not in produced and os.path.exists(stale_pack):
+            logger.warning(f"Suppression du pack mmap d'un entraînement précédent ({stale_pack}).")
+            os.remove(stale_pack)
+    finally:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+
+    # Sauvegarde des données de référence (Training data transformé) pour Drfit Monitoring
+    # On sauvegarde un échantillon pour pas faire exploser le fichier
+    if reference is not None:
+        logger.info("Sauvegarde des données de référence...")
+        ref_df, ref_stats = reference
+        ref_file = save_reference(output_dir, ref_df, ref_stats, fmt=ref_format)
+        logger.info(f"Données de référence sauvegardées dans {ref_file}")
+
+    # Nouvelle version dans le registre (rechargée à chaud par serving/api.py)
+    manifest = {**manifest, "profile": model_metrics["profile"]}
+    version = publish_version(artifacts_dir, manifest, files=produced)
     
     logger.info("Terminé.")
+    return version
+
+def export_pack(artifacts_dir, preprocessor, pca, clf):
+    """
+    Exporte preprocessor, PCA et forêt en tableaux plats dans `model_pack.npy` (header JSON + tableaux),
+    ouvrable par l'API avec np.load(mmap_mode='r'). Les versions compilées sont vérifiées contre sklearn.
+    """
+    if SERVING_DIR not in sys.path:
+        sys.path.insert(0, SERVING_DIR)
+    from artifact_pack import write_pack
+    from fast_forest import compile_forest
+    from fast_pipeline import compile_pipeline
+
+    def sklearn_features(rows):
+        return pca.transform(preprocessor.transform(pd.DataFrame(rows)))
+
+    features = compile_pipeline(preprocessor, pca, reference_fn=sklearn_features)
+    forest = compile_forest(clf)
+    if features is None or forest is None:
+        logger.warning("Artefacts non compilables, pack mmap non généré.")
+        return None
+
+    pack_path = os.path.join(artifacts_dir, PACK_FILE)
+    write_pack(pack_path, features, forest)
+    logger.info(f"Pack mmap écrit dans {pack_path} ({os.path.getsize(pack_path) / 1e6:.1f} MB)")
+    return pack_path
+
+def publish_version(artifacts_dir, manifest, version=None, files=None):
+    """
+    Copie les pickles de `artifacts_dir` dans `artifacts_dir/versions/<version>/` avec un manifest.
+    `files` : noms des fichiers écrits par cet entraînement (par défaut, tous les artefacts connus présents).
+    Le dossier est préparé sous un nom temporaire puis renommé : l'API ne voit jamais de version partielle.
+    """
+    created_at = datetime.now(timezone.utc)
+    version = version or created_at.strftime("v%Y%m%d-%H%M%S")
+    versions_dir = os.path.join(artifacts_dir, 'versions')
+    tmp_dir = os.path.join(versions_dir, f".{version}.tmp")
+    final_dir = os.path.join(versions_dir, version)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    if files is None:
+        files = ('preprocessor.pickle', 'pca.pickle', 'model.pickle', PACK_FILE, METRICS_FILE, REF_STATS_FILE)
+    for name in files:
+        if os.path.exists(os.path.join(artifacts_dir, name)):
+            shutil.copy2(os.path.join(artifacts_dir, name), os.path.join(tmp_dir, name))
+
+    manifest = {
+        "version": version,
+        "created_at": created_at.isoformat(),
+        "sklearn_version": sklearn.__version__,
+        **manifest
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_dir, final_dir)
+    logger.info(f"Version {version} publiée dans {final_dir}")
+    return version
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Script d'entraînement MLOps")
     parser.add_argument("--data_path", type=str, default="synthetic_fraud_data.csv", help="Chemin vers le CSV de données")
     parser.add_argument("--output_dir", type=str, default="data", help="Dossier pour les données générées (ref_data)")
     parser.add_argument("--artifacts_dir", type=str, default="artifacts", help="Dossier pour les modèles sauvegardés")
-    parser.add_argument("--nrows", type=int, default=100000, help="Nombre de lignes à lire (None pour tout)")
+    parser.add_argument("--nrows", type=int, default=100000, help="Nombre de lignes à lire (0 pour tout)")
     parser.add_argument("--n_estimators", type=int, default=50, help="RandomForest n_estimators")
     parser.add_argument("--max_depth", type=int, default=10, help="RandomForest max_depth")
+    parser.add_argument("--chunk_size", type=int, default=500000, help="Lignes lues par chunk CSV")
+    parser.add_argument("--cache_dir", type=str, default="data/cache", help="Cache Parquet des données parsées")
+    parser.add_argument("--no_cache", action="store_true", help="Désactive le cache Parquet")
+    parser.add_argument("--out_of_core", action="store_true", help="Entraînement par chunks (IncrementalPCA, mmap) pour les fichiers plus grands que la RAM")
+    parser.add_argument("--search", action="store_true", help="Recherche d'hyperparamètres (successive halving) avant l'entraînement final")
+    parser.add_argument("--search_space", type=str, default=None, help="Fichier JSON de l'espace de recherche ({param: [valeurs]})")
+    parser.add_argument("--n_jobs", type=int, default=None, help="Process de la recherche (défaut : nombre de CPU)")
+    parser.add_argument("--min_f1", type=float, default=None, help="Budget : F1 minimal pour publier le modèle")
+    parser.add_argument("--max_single_row_ms", type=float, default=None, help="Budget : latence unitaire p99 max (ms)")
+    parser.add_argument("--max_batch_us_per_row", type=float, default=None, help="Budget : coût max par ligne en lot (µs)")
+    parser.add_argument("--max_model_mb", type=float, default=None, help="Budget : taille max de model.pickle (MB)")
+    parser.add_argument("--max_train_rows", type=int, default=2000000, help="Out-of-core : taille max de l'échantillon stratifié de la forêt")
+    parser.add_argument("--ref_max_rows", type=int, default=100000, help="Taille max de l'échantillon de référence du drift (0 pour tout)")
+    parser.add_argument("--ref_sampling", choices=["stratified", "reservoir"], default="stratified",
+                        help="Echantillonnage de la référence : stratifié par classe, ou réservoir en un passage par chunks")
+    parser.add_argument("--ref_class_balanced", action="store_true", help="Même quota de lignes de référence par classe")
+    parser.add_argument("--ref_format", choices=["parquet", "csv"], default="parquet", help="Format de l'échantillon de référence")
 
     args = parser.parse_args()
-    
-    train_and_save(
-        data_path=args.data_path, 
-        output_dir=args.output_dir, 
-        artifacts_dir=args.artifacts_dir,
-        nrows=args.nrows,
-        n_estimators=args.n_estimators,
-        max_depth=args.max_depth
-    )
+
+    budget = {
+        "min_f1": args.min_f1,
+        "max_single_row_ms": args.max_single_row_ms,
+        "max_batch_us_per_row": args.max_batch_us_per_row,
+        "max_model_mb": args.max_model_mb
+    }
+
+    ref_options = {
+        "max_rows": args.ref_max_rows or None,
+        "method": args.ref_sampling,
+        "class_balanced": args.ref_class_balanced
+    }
+
+    search_space = None
+    if args.search_space:
+        with open(args.search_space) as f:
+            search_space = json.load(f)
+
+    if args.out_of_core:
+        version = train_out_of_core(
+            data_path=args.data_path,
+            output_dir=args.output_dir,
+            artifacts_dir=args.artifacts_dir,
+            nrows=args.nrows or None,
+            n_estimators=args.n_estimators,
+            max_depth=args.max_depth,
+            chunk_size=args.chunk_size,
+            max_train_rows=args.max_train_rows,
+            budget=budget,
+            ref_options=ref_options,
+            ref_format=args.ref_format
+        )
+    else:
+        version = train_and_save(
+            data_path=args.data_path, 
+            output_dir=args.output_dir, 
+            artifacts_dir=args.artifacts_dir,
+            nrows=args.nrows or None,
+            n_estimators=args.n_estimators,
+            max_depth=args.max_depth,
+            chunk_size=args.chunk_size,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            search=args.search,
+            search_space=search_space,
+            n_jobs=args.n_jobs,
+            budget=budget,
+            ref_options=ref_options,
+            ref_format=args.ref_format
+        )
+
+    # Code retour non nul si aucun modèle n'a été publié (données absentes, budget non respecté)
+    if version is None:
+        sys.exit(1)
@@ -0,0 +1,210 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import httpx
+
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class AlertDispatcher:
+    """
+    Envoi non bloquant des alertes de fraude vers le webhook n8n.
+
+    - enqueue() est O(1) et ne fait jamais d'I/O réseau : /predict n'attend pas n8n.
+    - Un worker vide une file bornée avec un client HTTP asynchrone (connexions keep-alive).
+    - Les alertes peuvent être regroupées (batch_size > 1) dans un seul POST {"alerts": [...]}.
+    - Seule une réponse 2xx vaut livraison (n8n répond 404 si le workflow est inactif).
+    - En cas d'échec : retries avec backoff exponentiel, puis écriture dans un fichier
+      NDJSON local (spool) rejoué dès que n8n répond à nouveau. Le spool est partagé par les
+      workers gunicorn : écritures et reprise se font sous un verrou fichier (flock).
+    - A l'arrêt, le lot en cours d'envoi et la file repartent dans le spool.
+    """
+
+    def __init__(self, url: str, spool_path: str, max_queue: int = 1000, batch_size: int = 1,
+                 flush_interval_ms: float = 200, max_retries: int = 3, backoff_s: float = 0.5,
+                 timeout_s: float = 5.0):
+        self.url = url
+        self.spool_path = spool_path
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Statistiques
+        self.sent_total = 0
+        self.posts_total = 0
+        self.failed_posts_total = 0
+        self.spilled_total = 0
+        self.replayed_total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout_s,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Dispatcher d'alertes démarré (batch={self.batch_size}, file={self.max_queue}).")
+
+    async def stop(self):
+        """Arrête le worker et écrit dans le spool les alertes encore en file."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            self._spill(pending)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def enqueue(self, alert: dict) -> bool:
+        """Ajoute une alerte sans bloquer; si la file est pleine (ou arrêtée), elle part dans le spool."""
+        if self.running:
+            try:
+                self._queue.put_nowait(alert)
+                return True
+            except asyncio.QueueFull:
+                logger.warning("File d'alertes pleine, écriture dans le spool.")
+        self._spill([alert])
+        return False
+
+    async def _collect(self) -> List[dict]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _post(self, batch: List[dict]) -> bool:
+        """POST avec retries et backoff exponentiel. Renvoie True si n8n a accepté (2xx)."""
+        body = batch[0] if len(batch) == 1 else {"alerts": batch}
+        for attempt in range(self.max_retries + 1):
+            try:
+                with STAGE_LATENCY.time("alert_post"):
+                    response = await self._client.post(self.url, json=body)
+                self.posts_total += 1
+                if response.is_success:
+                    logger.info(f"{len(batch)} alerte(s) envoyée(s) à n8n. Status: {response.status_code}")
+                    self.sent_total += len(batch)
+                    return True
+                logger.warning(f"n8n a répondu {response.status_code} (tentative {attempt + 1}).")
+            except httpx.HTTPError as e:
+                logger.warning(f"Echec de l'envoi vers n8n (tentative {attempt + 1}): {e}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff_s * (2 ** attempt))
+        self.failed_posts_total += 1
+        return False
+
+    async def _run(self):
+        # Alertes restées dans le spool lors d'une exécution précédente
+        replay = True
+        while True:
+            try:
+                if replay:
+                    await self._replay_spool()
+                batch = await self._collect()
+                try:
+                    replay = await self._post(batch)
+                except asyncio.CancelledError:
+                    # Arrêt pendant l'envoi : le lot n'est pas perdu
+                    self._spill(batch)
+                    raise
+                if not replay:
+                    self._spill(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur du dispatcher d'alertes: {e}")
+                replay = False
+
+    @contextmanager
+    def _spool_locked(self):
+        """Section critique inter-processus sur le spool."""
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        with open(self.spool_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spill(self, alerts: List[dict]):
+        if not alerts:
+            return
+        try:
+            with self._spool_locked(), open(self.spool_path, "a") as f:
+                for alert in alerts:
+                    f.write(json.dumps(alert, default=str) + "\n")
+            self.spilled_total += len(alerts)
+            logger.warning(f"{len(alerts)} alerte(s) écrite(s) dans le spool {self.spool_path}.")
+        except OSError as e:
+            logger.error(f"Impossible d'écrire le spool d'alertes: {e}")
+
+    async def _replay_spool(self):
+        """Rejoue le spool quand n8n est de nouveau joignable; ce qui échoue y retourne."""
+        if not os.path.exists(self.spool_path):
+            return
+        # Un seul worker reprend le spool : il est lu et supprimé sous verrou, aucun append n'est perdu
+        with self._spool_locked():
+            if not os.path.exists(self.spool_path):
+                return
+            with open(self.spool_path) as f:
+                alerts = [json.loads(line) for line in f if line.strip()]
+            os.remove(self.spool_path)
+
+        logger.info(f"Rejeu de {len(alerts)} alerte(s) depuis le spool.")
+        for i in range(0, len(alerts), self.batch_size):
+            batch = alerts[i:i + self.batch_size]
+            try:
+                delivered = await self._post(batch)
+            except asyncio.CancelledError:
+                self._spill(alerts[i:])
+                raise
+            if delivered:
+                self.replayed_total += len(batch)
+            else:
+                self._spill(alerts[i:])
+                return
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "sent_total": self.sent_total,
+            "posts_total": self.posts_total,
+            "failed_posts_total": self.failed_posts_total,
+            "spilled_total": self.spilled_total,
+            "replayed_total": self.replayed_total,
+        }
@@ -1,12 +1,26 @@
-import pickle
+import json
+import asyncio
 import pandas as pd
 import numpy as np
 import os
 import logging
-import requests
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Header
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ValidationError
+from typing import Optional, Dict, Any, List, Union
+
+from alerts import AlertDispatcher
+from batching import MicroBatcher
+from drift_monitor import DriftMonitor
+from feedback_ledger import FeedbackLedger
+from feedback_store import FeedbackStore
+from metrics import REGISTRY, STAGE_LATENCY, MultiprocessCollector
+from prediction_cache import PredictionCache
+from quality_tracker import QualityTracker, load_or_create_key
+from registry import ArtifactRegistry
 
 # Configuration Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,37 +28,191 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Fraud Detection API", version="2.0")
 
-# Global Artifacts
-artifacts = {
-    "model": None,
-    "pca": None,
-    "preprocessor": None
-}
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Le template de la route (et non le chemin brut) borne la cardinalité des labels
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint)
+        REQUESTS.inc(endpoint, request.method, str(status))
+        if status >= 500:
+            REQUEST_ERRORS.inc(endpoint)
 
 # Configuration
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL", "http://n8n:5678/webhook/fraud-alert")
+DRIFT_WEBHOOK_URL = os.getenv("DRIFT_WEBHOOK_URL", "http://n8n:5678/webhook/drift-alert") # Rapports de drift (équipe ML, pas le client)
 FRAUD_THRESHOLD = 0.7
 RETRAIN_THRESHOLD = 100 # Nombre de nouvelles données avant retrain
+RETRAIN_LABEL_SHIFT = float(os.getenv("RETRAIN_LABEL_SHIFT", "0.1")) # Ecart de taux de fraude déclenchant un retrain
+RETRAIN_DRIFT_THRESHOLD = float(os.getenv("RETRAIN_DRIFT_THRESHOLD", "0.2")) # Score de drift déclenchant un retrain
+RETRAIN_COMMAND = os.getenv("RETRAIN_COMMAND") # Commande du job de réentraînement (ex: python scripts/retrain_incremental.py)
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000")) # Taille max d'un lot /predict/batch
+DATA_PATH = os.getenv("DATA_PATH", "/data")
+ARTIFACT_PATH = os.getenv("ARTIFACT_PATH", "/artifacts")
+ARTIFACT_POLL_INTERVAL_S = float(os.getenv("ARTIFACT_POLL_INTERVAL_S", "10")) # Surveillance des nouvelles versions
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # Si défini, exigé (header X-Admin-Token) sur /admin/*
+
+# Feedbacks : buffer mémoire puis Parquet partitionné par heure + export CSV historique
+PROD_DATA_PATH = os.path.join(DATA_PATH, "prod_data.csv")
+FEEDBACK_STORE_PATH = os.getenv("FEEDBACK_STORE_PATH", os.path.join(DATA_PATH, "feedback"))
+FEEDBACK_FLUSH_ROWS = int(os.getenv("FEEDBACK_FLUSH_ROWS", "500"))
+FEEDBACK_FLUSH_INTERVAL_S = float(os.getenv("FEEDBACK_FLUSH_INTERVAL_S", "1"))
+FEEDBACK_LEDGER_PATH = os.path.join(DATA_PATH, "feedback_ledger.json")
+
+# Dispatcher d'alertes n8n (file bornée + spool local si n8n est indisponible)
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "1")) # >1 : POST {"alerts": [...]} groupés
+ALERT_FLUSH_INTERVAL_MS = float(os.getenv("ALERT_FLUSH_INTERVAL_MS", "200"))
+ALERT_MAX_RETRIES = int(os.getenv("ALERT_MAX_RETRIES", "3"))
+ALERT_SPOOL_PATH = os.getenv("ALERT_SPOOL_PATH", os.path.join(DATA_PATH, "alerts_spool.ndjson"))
+DRIFT_ALERT_SPOOL_PATH = os.getenv("DRIFT_ALERT_SPOOL_PATH", os.path.join(DATA_PATH, "drift_alerts_spool.ndjson"))
+
+# Drift en ligne : histogrammes décroissants des sorties PCA et de P(fraude), comparés au ref_stats.json de la version
+DRIFT_MONITOR_ENABLED = os.getenv("DRIFT_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+DRIFT_HALF_LIFE_S = float(os.getenv("DRIFT_HALF_LIFE_S", "300")) # Demi-vie des compteurs
+DRIFT_PSI_ALERT_THRESHOLD = float(os.getenv("DRIFT_PSI_ALERT_THRESHOLD", "0.2"))
+DRIFT_FRAUD_RATE_SHIFT = float(os.getenv("DRIFT_FRAUD_RATE_SHIFT", "0.05")) # Ecart de taux de fraude prédit déclenchant une alerte
+DRIFT_MIN_ROWS = float(os.getenv("DRIFT_MIN_ROWS", "500")) # Effectif (décru) minimal avant de conclure
+DRIFT_CHECK_INTERVAL_S = float(os.getenv("DRIFT_CHECK_INTERVAL_S", "30"))
+DRIFT_ALERT_COOLDOWN_S = float(os.getenv("DRIFT_ALERT_COOLDOWN_S", "900"))
+
+# Qualité en ligne : labels différés de /feedback rattachés à leur prédiction par prediction_id
+QUALITY_WINDOW_S = float(os.getenv("QUALITY_WINDOW_S", "3600")) # Fenêtre des matrices de confusion (heure de prédiction)
+QUALITY_RETENTION_WINDOWS = int(os.getenv("QUALITY_RETENTION_WINDOWS", "168")) # Fenêtres gardées (labels plus tardifs ignorés)
+QUALITY_ROLLING_WINDOWS = int(os.getenv("QUALITY_ROLLING_WINDOWS", "24")) # Fenêtres agrégées par défaut sur /quality/stats
+QUALITY_MAX_SKEW_S = float(os.getenv("QUALITY_MAX_SKEW_S", "300")) # Avance d'horloge tolérée sur l'heure d'un prediction_id
+PREDICTION_ID_SECRET = os.getenv("PREDICTION_ID_SECRET") # Clé HMAC des prediction_id ; à défaut, clé générée partagée via DATA_PATH
+PREDICTION_ID_KEY_PATH = os.path.join(DATA_PATH, "prediction_id.key")
+QUALITY_DB_PATH = os.getenv("QUALITY_DB_PATH", os.path.join(DATA_PATH, "quality.sqlite")) # Fenêtres partagées par les workers
+
+# Mode multi-workers (gunicorn.conf.py) : instantanés des registres des workers, fusionnés à chaque scrape de /metrics
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_SYNC_INTERVAL_S = float(os.getenv("METRICS_SYNC_INTERVAL_S", "5")) # Ecriture périodique de l'instantané du worker
+
+# Lissage exponentiel du taux de fraude exposé sur /metrics (~ fenêtre de 1/alpha prédictions)
+FRAUD_RATE_ALPHA = float(os.getenv("FRAUD_RATE_ALPHA", "0.01"))
+
+# Inférence hors de la boucle d'événements (pool dédié, 1 thread par défaut : un worker = un coeur)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))
+
+# Micro-batching (opt-in) : regroupe les /predict concurrents en un seul appel modèle
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2"))
+
+# Pipeline de features compilé (sans DataFrame); FAST_PIPELINE_ENABLED=false pour revenir à sklearn
+FAST_PIPELINE_ENABLED = os.getenv("FAST_PIPELINE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Forêt compilée (une seule traversée pour classe + proba); FAST_FOREST_ENABLED=false pour revenir à sklearn
+FAST_FOREST_ENABLED = os.getenv("FAST_FOREST_ENABLED", "true").lower() in ("1", "true", "yes")
+# Pack mmap (model_pack.npy) préféré aux pickles quand il existe; PACKED_ARTIFACTS_ENABLED=false pour l'ignorer
+PACKED_ARTIFACTS_ENABLED = os.getenv("PACKED_ARTIFACTS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Cache des résultats de /predict (rejeux d'autorisations identiques) ; 0 désactive le cache
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "300"))
+
+# Métriques (collecteur en mémoire par process, exposé au format Prometheus sur /metrics)
+REQUESTS = REGISTRY.counter("fraud_http_requests_total", "Requêtes HTTP par endpoint et statut.", ["endpoint", "method", "status"])
+REQUEST_ERRORS = REGISTRY.counter("fraud_http_errors_total", "Requêtes HTTP en erreur (5xx).", ["endpoint"])
+REQUEST_LATENCY = REGISTRY.histogram("fraud_http_request_latency_seconds", "Latence HTTP de bout en bout.", ["endpoint"])
+PREDICTIONS = REGISTRY.counter("fraud_predictions_total", "Transactions scorées par résultat.", ["result"])
+ALERTS_TRIGGERED = REGISTRY.counter("fraud_alerts_triggered_total", "Alertes de fraude mises en file pour n8n.")
+FRAUD_RATE = REGISTRY.gauge("fraud_rate_ewma", "Taux de fraude prédit, moyenne mobile exponentielle.")
+ARTIFACT_INFO = REGISTRY.gauge("fraud_artifact_info", "Version des artefacts servie par ce process.", ["version", "source"])
+COMPONENT_GAUGES = {} # fraud_<composant>_<stat>, créées une fois (cf. update_component_metrics)
+
+# Registre versionné des artefacts : le bundle actif (preprocessor, PCA, modèle) est remplacé d'un bloc
+registry = ArtifactRegistry(
+    ARTIFACT_PATH,
+    poll_interval_s=ARTIFACT_POLL_INTERVAL_S,
+    use_pack=PACKED_ARTIFACTS_ENABLED,
+    fast_pipeline=FAST_PIPELINE_ENABLED,
+    fast_forest=FAST_FOREST_ENABLED
+)
+
+def preload_artifacts():
+    """Chargement synchrone, appelé par gunicorn dans le master avant le fork (pages partagées en copy-on-write)."""
+    registry.active = registry.load_bundle(registry.target_version())
+    logger.info(f"Artefacts préchargés (version {registry.active.version}).")
 
 @app.on_event("startup")
 async def load_artifacts():
-    """Charge les modèles et préprocesseurs au démarrage."""
-    try:
-        artifact_path = os.getenv("ARTIFACT_PATH", "/artifacts")
-        
-        with open(os.path.join(artifact_path, 'model.pickle'), 'rb') as f:
-            artifacts["model"] = pickle.load(f)
-            
-        with open(os.path.join(artifact_path, 'pca.pickle'), 'rb') as f:
-            artifacts["pca"] = pickle.load(f)
-            
-        with open(os.path.join(artifact_path, 'preprocessor.pickle'), 'rb') as f:
-            artifacts["preprocessor"] = pickle.load(f)
-            
-        logger.info("Artefacts chargés avec succès.")
-    except Exception as e:
-        logger.error(f"Erreur fatal au chargement des artefacts: {e}")
+    """Charge les modèles et préprocesseurs au démarrage, puis surveille les nouvelles versions."""
+    await registry.refresh()
+    if registry.active is not None:
+        logger.info(f"Artefacts chargés avec succès (version {registry.active.version}).")
+    else:
         # On ne crash pas l'app, mais les prédictions échoueront
+        logger.error("Erreur fatal au chargement des artefacts.")
+    registry.start_watcher()
+
+@app.on_event("shutdown")
+async def stop_artifact_watcher():
+    await registry.stop_watcher()
+
+@app.on_event("startup")
+async def start_micro_batcher():
+    if MICRO_BATCH_ENABLED:
+        micro_batcher.start()
+
+@app.on_event("startup")
+async def start_alert_dispatcher():
+    alert_dispatcher.start()
+    drift_alert_dispatcher.start()
+
+@app.on_event("startup")
+async def start_feedback_store():
+    feedback_ledger.load(legacy_csv_path=PROD_DATA_PATH)
+    feedback_store.start()
+
+@app.on_event("startup")
+async def start_quality_tracker():
+    if quality_tracker.key is None:
+        quality_tracker.key = load_or_create_key(PREDICTION_ID_KEY_PATH)
+    quality_tracker.start()
+
+@app.on_event("startup")
+async def start_drift_monitor():
+    if DRIFT_MONITOR_ENABLED:
+        drift_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_micro_batcher():
+    await micro_batcher.stop()
+
+@app.on_event("shutdown")
+async def stop_alert_dispatcher():
+    await alert_dispatcher.stop()
+    await drift_alert_dispatcher.stop()
+
+@app.on_event("shutdown")
+async def stop_feedback_store():
+    await feedback_store.stop()
+
+@app.on_event("shutdown")
+async def stop_drift_monitor():
+    await drift_monitor.stop()
+
+@app.on_event("shutdown")
+async def stop_quality_tracker():
+    await quality_tracker.stop()
+
+@app.on_event("startup")
+async def start_metrics_collector():
+    if metrics_collector is not None:
+        metrics_collector.start()
+
+@app.on_event("shutdown")
+async def stop_metrics_collector():
+    if metrics_collector is not None:
+        await metrics_collector.stop()
         
 class TransactionInput(BaseModel):
     merchant_category: str
@@ -67,88 +235,382 @@ class FeedbackInput(BaseModel):
     payload: Dict[str, Any]
     correct_class: bool # True = Fraud, False = Legit
     prediction: bool
+    prediction_id: Optional[str] = None # Renvoyé par /predict : rattache le label à la prédiction (qualité en ligne)
 
-def process_features(data: dict):
-    """Transforme les données brutes en vecteurs PCA."""
-    if not all(artifacts.values()):
+def get_bundle():
+    """Bundle d'artefacts actif; une requête le lit une seule fois pour rester cohérente pendant un swap."""
+    bundle = registry.active
+    if bundle is None:
         raise ValueError("Modèles non chargés.")
-        
-    df = pd.DataFrame([data])
-    
-    # Preprocess
-    X_processed = artifacts["preprocessor"].transform(df)
-    
-    # PCA
-    X_pca = artifacts["pca"].transform(X_processed)
-    
-    return X_pca
+    return bundle
+
+def process_features(data: Union[dict, List[dict]], bundle=None):
+    """Transforme les données brutes (une transaction ou une liste) en vecteurs PCA."""
+    bundle = bundle or get_bundle()
+    return bundle.transform(data)
 
-async def trigger_fraud_alert(transaction_data: dict, probability: float):
-    """Envoie une alerte à n8n en arrière-plan."""
+def score_rows(rows: List[dict]) -> List[tuple]:
+    """Score un lot en une passe : renvoie (prediction, probabilité max, vecteur PCA) par ligne, dans l'ordre."""
+    bundle = get_bundle()
+    X_pca = process_features(rows, bundle)
+    predictions, proba = bundle.predict_with_proba(X_pca)
+    probabilities = proba.max(axis=1)
+    observe_drift(X_pca, proba[:, -1], bundle)
+
+    results = [(bool(p), float(prob), x) for p, prob, x in zip(predictions, probabilities, X_pca)]
+    record_predictions(results)
+    return results
+
+def observe_drift(X_pca, proba_fraud, bundle):
+    """Alimente le drift monitor ; une erreur de monitoring ne doit jamais faire échouer une prédiction."""
+    if not DRIFT_MONITOR_ENABLED:
+        return
     try:
-        payload = {
-            "transaction": transaction_data,
-            "probability": probability,
-            "alert_time": pd.Timestamp.now().isoformat()
-        }
-        response = requests.post(N8N_WEBHOOK_URL, json=payload, timeout=5)
-        logger.info(f"Alerte envoyée à n8n. Status: {response.status_code}")
+        drift_monitor.observe(X_pca, proba_fraud, bundle)
     except Exception as e:
-        logger.error(f"Echec de l'envoi vers n8n: {e}")
+        logger.error(f"Erreur du drift monitor: {e}")
+
+def record_predictions(results: List[tuple]):
+    n_fraud = sum(1 for is_fraud, *_ in results if is_fraud)
+    PREDICTIONS.inc("fraud", amount=n_fraud)
+    PREDICTIONS.inc("legit", amount=len(results) - n_fraud)
+    rate = FRAUD_RATE.value()
+    for is_fraud, *_ in results:
+        rate = float(is_fraud) if rate is None else (1 - FRAUD_RATE_ALPHA) * rate + FRAUD_RATE_ALPHA * is_fraud
+    FRAUD_RATE.set(rate)
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+
+async def score_rows_async(rows: List[dict]) -> List[tuple]:
+    """score_rows exécuté dans le pool d'inférence : la boucle reste libre pour les autres requêtes."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, score_rows, rows)
+
+micro_batcher = MicroBatcher(
+    score_rows,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+    executor=inference_executor
+)
+
+# Les entrées sont liées à la version d'artefacts active et vidées quand elle change
+prediction_cache = PredictionCache(max_size=PREDICTION_CACHE_SIZE, ttl_s=PREDICTION_CACHE_TTL_S)
+
+alert_dispatcher = AlertDispatcher(
+    N8N_WEBHOOK_URL,
+    spool_path=ALERT_SPOOL_PATH,
+    max_queue=ALERT_QUEUE_SIZE,
+    batch_size=ALERT_BATCH_SIZE,
+    flush_interval_ms=ALERT_FLUSH_INTERVAL_MS,
+    max_retries=ALERT_MAX_RETRIES
+)
+
+def trigger_fraud_alert(transaction_data: dict, probability: float, prediction_id: str):
+    """
+    Met une alerte en file pour n8n (aucune I/O réseau dans la requête). Le workflow renvoie
+    `prediction_id` avec le label du client dans /feedback.
+    """
+    payload = {
+        "transaction": transaction_data,
+        "probability": probability,
+        "prediction_id": prediction_id,
+        "alert_time": pd.Timestamp.now().isoformat()
+    }
+    alert_dispatcher.enqueue(payload)
+    ALERTS_TRIGGERED.inc()
+
+feedback_ledger = FeedbackLedger(
+    FEEDBACK_LEDGER_PATH,
+    retrain_threshold=RETRAIN_THRESHOLD,
+    label_shift_threshold=RETRAIN_LABEL_SHIFT,
+    drift_threshold=RETRAIN_DRIFT_THRESHOLD
+)
+
+feedback_store = FeedbackStore(
+    FEEDBACK_STORE_PATH,
+    csv_path=PROD_DATA_PATH,
+    flush_rows=FEEDBACK_FLUSH_ROWS,
+    flush_interval_s=FEEDBACK_FLUSH_INTERVAL_S,
+    ledger=feedback_ledger
+)
+
+# Webhook dédié : le workflow fraud-alert écrit au client de la transaction, un rapport de drift n'en a pas
+drift_alert_dispatcher = AlertDispatcher(
+    DRIFT_WEBHOOK_URL,
+    spool_path=DRIFT_ALERT_SPOOL_PATH,
+    max_retries=ALERT_MAX_RETRIES
+)
+
+def trigger_drift_alert(report: dict):
+    """Alerte de drift agrégée (champ `type` = "drift"), envoyée au webhook n8n des rapports de drift."""
+    drift_alert_dispatcher.enqueue({**report, "alert_time": pd.Timestamp.now().isoformat()})
+
+# Le score de drift alimente aussi la décision de réentraînement du ledger
+drift_monitor = DriftMonitor(
+    half_life_s=DRIFT_HALF_LIFE_S,
+    psi_threshold=DRIFT_PSI_ALERT_THRESHOLD,
+    fraud_rate_shift=DRIFT_FRAUD_RATE_SHIFT,
+    min_rows=DRIFT_MIN_ROWS,
+    check_interval_s=DRIFT_CHECK_INTERVAL_S,
+    alert_cooldown_s=DRIFT_ALERT_COOLDOWN_S,
+    on_alert=trigger_drift_alert,
+    on_score=feedback_ledger.update_drift
+)
+
+quality_tracker = QualityTracker(
+    QUALITY_DB_PATH,
+    key=PREDICTION_ID_SECRET.encode() if PREDICTION_ID_SECRET else None,
+    window_s=QUALITY_WINDOW_S,
+    retention_windows=QUALITY_RETENTION_WINDOWS,
+    max_skew_s=QUALITY_MAX_SKEW_S
+)
+
+def prediction_id(version: str, is_fraud: bool, probability: float) -> str:
+    """Identifiant renvoyé au client ; `probability` est celle de la classe prédite."""
+    return quality_tracker.prediction_id(version, is_fraud, probability if is_fraud else 1 - probability)
+
+def claim_retrain() -> Optional[str]:
+    """
+    Les feedbacks encore en buffer comptent dans la décision : si le seuil est atteint avec eux,
+    le buffer est écrit avant la décision, pour que le job de réentraînement voie ces lignes.
+    """
+    pending_rows, pending_fraud = feedback_store.pending()
+    if pending_rows and feedback_ledger.retrain_reason(pending_rows, pending_fraud) is not None:
+        feedback_store.flush()
+    return feedback_ledger.claim_retrain()
 
 async def check_and_retrain():
-    """Vérifie si on doit réentraîner (Simulation)."""
-    # Logique simplifiée pour ne pas bloquer l'API
-    # Dans un vrai système, cela serait fait par un job séparé (Airflow/Cron)
-    file_path = '/data/prod_data.csv'
-    if os.path.exists(file_path):
-        # On compte juste les lignes pour l'exemple
-        with open(file_path) as f:
-            count = sum(1 for _ in f) - 1
-        
-        if count % RETRAIN_THRESHOLD == 0:
-            logger.info(f"Seuil de réentraînement atteint ({count}). Triggering Retraining Job...")
-            # Ici on pourrait lancer le script train_model.py via subprocess
-            # ou envoyer un signal à un orchestrateur.
+    """Vérifie si on doit réentraîner et lance alors le job configuré (RETRAIN_COMMAND)."""
+    # Décision en O(1) sur les compteurs persistants du ledger, sans relire les données.
+    # Dans un vrai système, le réentraînement serait fait par un job séparé (Airflow/Cron)
+    # claim_retrain prend le verrou fichier du ledger : hors de la boucle d'événements
+    loop = asyncio.get_running_loop()
+    with STAGE_LATENCY.time("retrain_check"):
+        reason = await loop.run_in_executor(None, claim_retrain)
+    if reason is not None:
+        logger.info(f"Seuil de réentraînement atteint ({reason}). Triggering Retraining Job...")
+        # Le job tourne dans un process séparé; la nouvelle version est ensuite rechargée à chaud par le registre
+        if RETRAIN_COMMAND:
+            try:
+                process = await asyncio.create_subprocess_exec(*shlex.split(RETRAIN_COMMAND))
+                logger.info(f"Job de réentraînement lancé (pid {process.pid}).")
+            except OSError as e:
+                logger.error(f"Impossible de lancer le job de réentraînement: {e}")
     
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "artifacts_loaded": all(artifacts.values())}
+    return {
+        "status": "ok",
+        "artifacts_loaded": registry.active is not None,
+        "artifact_version": registry.active.version if registry.active is not None else None
+    }
+
+class PinInput(BaseModel):
+    version: Optional[str] = None # None = revenir à la version la plus récente
+
+def check_admin(token: Optional[str]):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/admin/artifacts")
+def artifacts_status(x_admin_token: Optional[str] = Header(None)):
+    """Version active, version épinglée et versions disponibles dans le registre."""
+    check_admin(x_admin_token)
+    return registry.status()
+
+@app.post("/admin/artifacts/pin")
+async def pin_artifacts(pin: PinInput, x_admin_token: Optional[str] = Header(None)):
+    """Epingle une version (ou désépingle avec version=null) et l'active sans interrompre le trafic."""
+    check_admin(x_admin_token)
+    try:
+        registry.pin(pin.version)
+        await registry.activate(registry.target_version())
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erreur d'activation de la version {pin.version}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return registry.status()
+
+@app.get("/alerts/stats")
+def alerts_stats():
+    """Etat du dispatcher d'alertes : file, envois, échecs, spool."""
+    return alert_dispatcher.stats()
+
+@app.get("/drift/stats")
+def drift_stats():
+    """Drift en ligne : PSI par composante PCA et sur P(fraude), taux de fraude prédit, alertes."""
+    return {**drift_monitor.stats(), "report": drift_monitor.report(), "dispatcher": drift_alert_dispatcher.stats()}
+
+@app.get("/quality/stats")
+def quality_stats(windows: int = QUALITY_ROLLING_WINDOWS, version: Optional[str] = None):
+    """Précision / rappel / F1 glissants et courbe de calibration par version, à partir des labels reçus."""
+    return {**quality_tracker.stats(), "report": quality_tracker.report(windows=windows, version=version)}
+
+@app.get("/feedback/stats")
+def feedback_stats():
+    """Etat du store de feedbacks et compteurs persistants du ledger."""
+    return {**feedback_store.stats(), "ledger": feedback_ledger.state}
+
+def update_component_metrics():
+    """Version servie et état des composants de fond, relevés avant un scrape ou l'écriture de l'instantané."""
+    ARTIFACT_INFO.clear()
+    if registry.active is not None:
+        ARTIFACT_INFO.set(1, registry.active.version, registry.active.source)
+
+    for component, stats in (("microbatch", micro_batcher.stats()),
+                             ("prediction_cache", prediction_cache.stats()),
+                             ("alerts", alert_dispatcher.stats()),
+                             ("drift_alerts", drift_alert_dispatcher.stats()),
+                             ("drift", drift_monitor.stats()),
+                             ("quality", quality_tracker.stats()),
+                             ("feedback", {**feedback_store.stats(), **feedback_ledger.state})):
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                name = f"fraud_{component}_{key}"
+                gauge = COMPONENT_GAUGES.get(name)
+                if gauge is None:
+                    gauge = COMPONENT_GAUGES[name] = REGISTRY.gauge(name, f"{component}: {key}")
+                gauge.set(float(value))
+
+metrics_collector = MultiprocessCollector(
+    METRICS_MULTIPROC_DIR,
+    REGISTRY,
+    interval_s=METRICS_SYNC_INTERVAL_S,
+    before_write=update_component_metrics
+) if METRICS_MULTIPROC_DIR else None
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Métriques au format texte Prometheus (latences par étape, requêtes, erreurs, taux de fraude, version).
+    Sous gunicorn, compteurs et histogrammes sont agrégés sur tous les workers et les jauges portent un label `pid`.
+    """
+    if metrics_collector is not None:
+        return metrics_collector.render()
+    update_component_metrics()
+    return REGISTRY.render()
+
+@app.get("/batching/stats")
+def batching_stats():
+    """Métriques du micro-batching : profondeur de file, taille des lots, temps d'attente."""
+    return micro_batcher.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Etat du cache de prédictions : taille, hits/misses, expirations, invalidations."""
+    return prediction_cache.stats()
 
 @app.post("/predict")
-async def predict(transaction: TransactionInput, background_tasks: BackgroundTasks):
-    if not all(artifacts.values()):
+async def predict(transaction: TransactionInput):
+    if registry.active is None:
         raise HTTPException(status_code=503, detail="Service Unavailable: Models not loaded")
     
     try:
         data = transaction.dict()
-        X_pca = process_features(data)
-        
-        # Predict
-        model = artifacts["model"]
-        prediction = model.predict(X_pca)[0]
-        probability = model.predict_proba(X_pca).max()
-        
-        is_fraud = bool(prediction)
+        bundle = get_bundle()
+        version = bundle.version
+        cache_key = prediction_cache.key(data)
+
+        # Le vecteur PCA est gardé avec le résultat : un rejeu compte aussi dans le drift en ligne
+        cached = prediction_cache.get(cache_key, version)
+        if cached is not None:
+            is_fraud, probability, features = cached
+            record_predictions([cached])
+            observe_drift(features[None], [probability if is_fraud else 1 - probability], bundle)
+        elif micro_batcher.running:
+            result = await micro_batcher.submit(data)
+            is_fraud, probability, _ = result
+            prediction_cache.put(cache_key, result, version)
+        else:
+            result = (await score_rows_async([data]))[0]
+            is_fraud, probability, _ = result
+            prediction_cache.put(cache_key, result, version)
         
+        pid = prediction_id(version, is_fraud, probability)
+
         # Trigger n8n if fraud suspected
         if is_fraud or probability > FRAUD_THRESHOLD:
             logger.info(f"Fraude suspectée ({probability:.2f}). Déclenchement alerte.")
-            background_tasks.add_task(trigger_fraud_alert, data, probability)
+            trigger_fraud_alert(data, probability, pid)
             
         return {
             "prediction": is_fraud,
-            "probability": float(probability)
+            "probability": float(probability),
+            "prediction_id": pid
         }
         
     except Exception as e:
         logger.error(f"Erreur prédiction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def parse_batch_body(body: bytes, content_type: str) -> List[dict]:
+    """Décode un lot de transactions (tableau JSON ou NDJSON) et valide chaque ligne."""
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        raw_rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        raw_rows = json.loads(text)
+        if not isinstance(raw_rows, list):
+            raise ValueError("Le corps doit être un tableau JSON de transactions.")
+
+    if len(raw_rows) > MAX_BATCH_SIZE:
+        raise ValueError(f"Lot trop grand ({len(raw_rows)} > {MAX_BATCH_SIZE}).")
+
+    rows = []
+    for i, raw in enumerate(raw_rows):
+        try:
+            rows.append(TransactionInput(**raw).dict())
+        except (ValidationError, TypeError) as e:
+            raise ValueError(f"Transaction {i} invalide: {e}")
+    return rows
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request):
+    """Score un lot de transactions en une seule passe vectorisée (JSON array ou NDJSON)."""
+    if registry.active is None:
+        raise HTTPException(status_code=503, detail="Service Unavailable: Models not loaded")
+
+    try:
+        rows = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if not rows:
+        return {"count": 0, "results": []}
+
+    try:
+        version = registry.active.version
+        results = []
+        n_alerts = 0
+        for data, (is_fraud, probability, _) in zip(rows, await score_rows_async(rows)):
+            pid = prediction_id(version, is_fraud, probability)
+            if is_fraud or probability > FRAUD_THRESHOLD:
+                trigger_fraud_alert(data, probability, pid)
+                n_alerts += 1
+            results.append({
+                "prediction": is_fraud,
+                "probability": probability,
+                "prediction_id": pid
+            })
+
+        if n_alerts:
+            logger.info(f"Fraude suspectée sur {n_alerts}/{len(rows)} transactions du lot. Déclenchement alertes.")
+
+        return {"count": len(results), "results": results}
+
+    except Exception as e:
+        logger.error(f"Erreur prédiction batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/feedback")
 async def feedback(feedback_data: FeedbackInput, background_tasks: BackgroundTasks):
     try:
         logger.info("Feedback reçu.")
+        version = registry.active.version if registry.active is not None else None
+        # Qualité en ligne : O(1), avant tout calcul (un label sans payload compte aussi)
+        quality_tracker.record(feedback_data.correct_class, prediction_id=feedback_data.prediction_id)
+
         # Re-calcul du PCA pour sauvegarde
         data = feedback_data.payload
         
@@ -156,17 +618,12 @@ async def feedback(feedback_data: FeedbackInput, background_tasks: BackgroundTas
             logger.warning("Empty payload in feedback. Skipping feature processing and saving. (Known limitation in v2)")
             return {"status": "recorded_only_label"}
 
-        X_pca = process_features(data)
-        
-        # Sauvegarde
-        pca_cols = [f'PCA_{i+1}' for i in range(X_pca.shape[1])]
-        row_df = pd.DataFrame(X_pca, columns=pca_cols)
-        row_df['target'] = feedback_data.correct_class
-        row_df['prediction'] = feedback_data.prediction
+        bundle = get_bundle()
+        loop = asyncio.get_running_loop()
+        X_pca = await loop.run_in_executor(inference_executor, process_features, data, bundle)
         
-        file_path = '/data/prod_data.csv'
-        header = not os.path.exists(file_path)
-        row_df.to_csv(file_path, mode='a', header=header, index=False)
+        # Sauvegarde (bufferisée, écrite par lots par le FeedbackStore), avec la version qui a calculé le PCA
+        feedback_store.append(X_pca[0], feedback_data.correct_class, feedback_data.prediction, version=bundle.version)
         
         # Check Retrain
         background_tasks.add_task(check_and_retrain)
@@ -0,0 +1,86 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from fast_forest import CompiledForest
+from fast_pipeline import CompiledFeaturePipeline
+
+PACK_FILE = "model_pack.npy"
+PACK_FORMAT = 1
+ALIGN = 64
+
+
+def write_pack(path: str, features: CompiledFeaturePipeline, forest: CompiledForest,
+               manifest: Optional[dict] = None):
+    """
+    Ecrit pipeline compilé + forêt dans un seul fichier .npy (blob uint8) :
+        [longueur du header sur 8 octets][header JSON][tableaux bruts alignés sur 64 octets]
+    Le header décrit chaque tableau (dtype, shape, offset). Ouvert avec np.load(mmap_mode='r'),
+    les tableaux sont des vues sur le page cache, partagées entre processus.
+    """
+    sections = {}
+    blobs = []
+    offset = 0
+
+    def add(prefix, arrays):
+        nonlocal offset
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = -(-offset // ALIGN) * ALIGN
+            sections[f"{prefix}.{name}"] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            blobs.append((offset, array))
+            offset += array.nbytes
+
+    features_meta, features_arrays = features.to_arrays()
+    forest_meta, forest_arrays = forest.to_arrays()
+    add("features", features_arrays)
+    add("forest", forest_arrays)
+
+    header = json.dumps({
+        "format": PACK_FORMAT,
+        "manifest": manifest or {},
+        "features": features_meta,
+        "forest": forest_meta,
+        "arrays": sections,
+    }).encode("utf-8")
+    data_start = -(-(8 + len(header)) // ALIGN) * ALIGN
+
+    blob = np.zeros(data_start + offset, dtype=np.uint8)
+    blob[:8] = np.frombuffer(np.uint64(len(header)).tobytes(), dtype=np.uint8)
+    blob[8:8 + len(header)] = np.frombuffer(header, dtype=np.uint8)
+    for array_offset, array in blobs:
+        start = data_start + array_offset
+        blob[start:start + array.nbytes] = np.frombuffer(array.tobytes(), dtype=np.uint8)
+
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, blob)
+    os.replace(tmp_path, path)
+
+
+def read_pack(path: str, mmap: bool = True):
+    """Ouvre un pack; renvoie (pipeline compilé, forêt compilée, header)."""
+    blob = np.load(path, mmap_mode='r' if mmap else None)
+    header_len = int(np.frombuffer(bytes(blob[:8]), dtype=np.uint64)[0])
+    header = json.loads(bytes(blob[8:8 + header_len]).decode("utf-8"))
+    if header.get("format") != PACK_FORMAT:
+        raise ValueError(f"Format de pack non supporté: {header.get('format')}")
+    data_start = -(-(8 + header_len) // ALIGN) * ALIGN
+
+    arrays = {"features": {}, "forest": {}}
+    for key, spec in header["arrays"].items():
+        prefix, name = key.split(".", 1)
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = data_start + spec["offset"]
+        view = blob[start:start + count * dtype.itemsize].view(dtype)
+        arrays[prefix][name] = view.reshape(spec["shape"])
+
+    features = CompiledFeaturePipeline.from_arrays(header["features"], arrays["features"])
+    forest = CompiledForest.from_arrays(header["forest"], arrays["forest"])
+    return features, forest, header
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Regroupe les appels concurrents à /predict en un seul appel de scoring.
+
+    Chaque appel dépose sa transaction dans une file; un worker unique attend
+    au plus `max_wait_ms` (ou `max_batch_size` éléments), score le lot en une
+    fois dans un thread, puis résout le future de chaque appelant.
+    """
+
+    def __init__(self, score_fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0, executor: Optional[Executor] = None):
+        self.score_fn = score_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Statistiques exposées comme métriques
+        self.batches_total = 0
+        self.items_total = 0
+        self.max_batch_seen = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seen = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Démarre le worker sur la boucle d'événements courante."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Micro-batching actif (max {self.max_batch_size} items / {self.max_wait * 1000:.1f} ms).")
+
+    async def stop(self):
+        """Arrête le worker; les appels encore en file reçoivent une erreur."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Micro-batcher arrêté."))
+
+    async def submit(self, item: Any) -> Any:
+        """Ajoute un élément à la file et attend son résultat."""
+        if not self.running:
+            raise RuntimeError("Micro-batcher non démarré.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        """Attend un premier élément puis remplit le lot jusqu'à la fenêtre ou la taille max."""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+
+            now = time.perf_counter()
+            waits = [now - enqueued_at for _, _, enqueued_at in batch]
+            self.batches_total += 1
+            self.items_total += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.wait_seconds_total += sum(waits)
+            self.max_wait_seen = max(self.max_wait_seen, max(waits))
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.score_fn, items)
+            except Exception as e:
+                logger.error(f"Erreur scoring micro-batch: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "queue_depth": self.queue_depth,
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "avg_batch_size": self.items_total / self.batches_total if self.batches_total else 0.0,
+            "max_batch_size_seen": self.max_batch_seen,
+            "avg_wait_ms": 1000 * self.wait_seconds_total / self.items_total if self.items_total else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_seen,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_window_ms": self.max_wait * 1000,
+        }
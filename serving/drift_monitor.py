@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Déciles de la référence : les quantiles stockés vont de 0 à 100 % par pas de 1 %
+DECILE_INDEXES = list(range(10, 100, 10))
+PSI_EPS = 1e-4
+# Nombre de demi-vies au-delà duquel les compteurs sont renormalisés (décroissance paresseuse, cf. DriftMonitor.observe) ;
+# borné avant le calcul de 2 ** n, qui déborderait après ~1024 demi-vies sans trafic
+MAX_HALF_LIVES = 64.0
+
+
+def psi(current: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """PSI ligne par ligne entre deux matrices de proportions (bins en dernière dimension)."""
+    p = np.maximum(current, PSI_EPS)
+    q = np.maximum(reference, PSI_EPS)
+    return ((p - q) * np.log(p / q)).sum(axis=-1)
+
+
+class DriftReference:
+    """
+    Bins et proportions de référence d'une version, tirés de son ref_stats.json :
+    déciles de chaque composante PCA (10 % par bin) et histogramme de P(fraude) sur [0, 1].
+    """
+
+    def __init__(self, stats: dict):
+        features = stats["features"]
+        self.feature_names = sorted(features, key=lambda name: int(name.rsplit("_", 1)[-1]))
+        self.edges = np.array([[features[name]["quantiles"][i] for i in DECILE_INDEXES]
+                               for name in self.feature_names])
+        self.proportions = np.full((len(self.feature_names), len(DECILE_INDEXES) + 1), 1 / (len(DECILE_INDEXES) + 1))
+        self.mean = np.array([features[name]["mean"] for name in self.feature_names])
+        self.std = np.array([features[name]["std"] for name in self.feature_names])
+
+        proba = stats.get("prediction_proba")
+        if proba is not None:
+            counts = np.asarray(proba["histogram"]["counts"], dtype=np.float64)
+            self.proba_edges = np.asarray(proba["histogram"]["edges"][1:-1])
+            self.proba_proportions = counts / max(counts.sum(), 1e-12)
+            self.positive_rate = proba["positive_rate"]
+        else:
+            self.proba_edges = None
+            self.proba_proportions = None
+            target = stats.get("target", {})
+            total = sum(target.values())
+            self.positive_rate = target.get("True", 0) / total if total else None
+
+
+class DriftMonitor:
+    """
+    Détection de drift en continu sur le trafic de /predict, sans relire de données.
+
+    Chaque lot scoré met à jour, sous un verrou, des histogrammes à décroissance exponentielle
+    (demi-vie `half_life_s`) sur les déciles de référence des composantes PCA et sur P(fraude),
+    ainsi que les moments et le taux de prédictions positives : quelques opérations NumPy par lot.
+    Toutes les `check_interval_s` secondes, le PSI de chaque série est comparé à `psi_threshold` ;
+    un dépassement (ou un écart de taux de fraude prédit de `fraud_rate_shift`) donne une seule
+    alerte agrégée, au plus une par `alert_cooldown_s`. Les compteurs repartent de zéro quand la
+    version d'artefacts change (nouvel espace PCA, nouvelle référence).
+    """
+
+    def __init__(self, half_life_s: float = 300.0, psi_threshold: float = 0.2, fraud_rate_shift: float = 0.05,
+                 min_rows: float = 500, check_interval_s: float = 30.0, alert_cooldown_s: float = 900.0,
+                 on_alert: Optional[Callable[[dict], None]] = None,
+                 on_score: Optional[Callable[[float], None]] = None):
+        self.half_life_s = half_life_s
+        self.psi_threshold = psi_threshold
+        self.fraud_rate_shift = fraud_rate_shift
+        self.min_rows = min_rows
+        self.check_interval_s = check_interval_s
+        self.alert_cooldown_s = alert_cooldown_s
+        self.on_alert = on_alert
+        self.on_score = on_score
+        self._lock = threading.Lock()
+        self._worker: Optional[asyncio.Task] = None
+        self._version = None
+        self._reference: Optional[DriftReference] = None
+        self._last_alert = None
+        self._report: dict = {}
+
+        # Statistiques
+        self.rows_observed = 0
+        self.checks_total = 0
+        self.alerts_total = 0
+
+    # --- Mise à jour par requête ---------------------------------------------
+
+    def _reset(self, bundle):
+        """Nouvelle version : nouvelle référence et compteurs vides."""
+        self._version = bundle.version
+        stats = getattr(bundle, "reference_stats", None)
+        self._reference = DriftReference(stats) if stats else None
+        if self._reference is None:
+            logger.warning(f"Pas de ref_stats.json pour la version {bundle.version} : drift en ligne désactivé.")
+            return
+        n_features, n_bins = self._reference.proportions.shape
+        n_proba_bins = len(self._reference.proba_edges) + 1 if self._reference.proba_edges is not None else 0
+        self._origin = time.time()
+        self._bin_offsets = np.arange(n_features) * n_bins
+        # Bins des composantes puis de P(fraude), dans un seul tableau (un seul bincount par lot)
+        self._counts = np.zeros(n_features * n_bins + n_proba_bins)
+        # Somme, somme des carrés par composante, puis somme de P(fraude), prédictions positives, poids total
+        self._moments = np.zeros(2 * n_features + 3)
+
+    def observe(self, X_pca, proba_fraud, bundle):
+        """Ajoute un lot scoré (vecteurs PCA et P(fraude)) aux histogrammes décroissants."""
+        X = np.asarray(X_pca, dtype=np.float64)
+        p = np.asarray(proba_fraud, dtype=np.float64)
+        with self._lock:
+            if bundle.version != self._version:
+                self._reset(bundle)
+            ref = self._reference
+            if ref is None or X.shape[1] != ref.edges.shape[0]:
+                return
+
+            # Décroissance paresseuse : plutôt que de multiplier tous les compteurs par 0.5 ** (dt / demi-vie)
+            # à chaque lot, les nouvelles lignes pèsent 2 ** (âge de l'origine / demi-vie) ; seuls les ratios comptent
+            scale = self._scale()
+
+            # Bin de chaque valeur = nombre de bornes de déciles qu'elle dépasse
+            bins = (X[:, :, None] > ref.edges[None]).sum(axis=2) + self._bin_offsets
+            if ref.proba_edges is not None:
+                proba_bins = np.searchsorted(ref.proba_edges, p, side="right") + ref.proportions.size
+                bins = np.concatenate([bins.ravel(), proba_bins])
+            self._counts += np.bincount(bins.ravel(), minlength=len(self._counts)) * scale
+            n_features = X.shape[1]
+            values = np.empty((len(X), len(self._moments)))
+            values[:, :n_features] = X
+            np.multiply(X, X, out=values[:, n_features:2 * n_features])
+            values[:, -3] = p
+            values[:, -2] = p >= 0.5
+            values[:, -1] = 1.0
+            self._moments += values.sum(axis=0) * scale
+            self.rows_observed += len(X)
+
+    def _scale(self) -> float:
+        """Poids courant d'une nouvelle ligne (appelé sous verrou) ; rebase l'origine quand l'écart devient grand."""
+        now = time.time()
+        half_lives = (now - self._origin) / self.half_life_s
+        if half_lives > MAX_HALF_LIVES:
+            # 0.5 ** n tend vers 0 sans erreur : après une longue inactivité, les compteurs repartent de zéro
+            decay = 0.5 ** half_lives
+            self._counts *= decay
+            self._moments *= decay
+            self._origin = now
+            half_lives = 0.0
+        return 2.0 ** half_lives
+
+    # --- Vérification périodique ---------------------------------------------
+
+    def report(self) -> dict:
+        """PSI par composante et sur P(fraude), moments et taux de fraude prédit de la fenêtre décroissante."""
+        with self._lock:
+            ref = self._reference
+            if ref is None or self._moments[-1] <= 0:
+                return {"version": self._version, "enabled": ref is not None, "effective_rows": 0.0}
+            # Poids ramenés à l'instant présent (une ligne observée maintenant pèse 1)
+            scale = self._scale()
+            if self._moments[-1] <= 0:
+                return {"version": self._version, "enabled": True, "effective_rows": 0.0}
+            counts = self._counts / scale
+            moments = self._moments / scale
+
+        n_features, n_bins = ref.proportions.shape
+        weight = moments[-1]
+        feature_counts = counts[:n_features * n_bins].reshape(n_features, n_bins) / weight
+        proba_counts = counts[n_features * n_bins:] / weight if ref.proba_edges is not None else None
+        mean = moments[:n_features] / weight
+        var = np.maximum(moments[n_features:2 * n_features] / weight - mean ** 2, 0.0)
+        proba_mean = moments[-3] / weight
+        fraud_rate = moments[-2] / weight
+
+        feature_psi = psi(feature_counts, ref.proportions)
+        report = {
+            "version": self._version,
+            "enabled": True,
+            "effective_rows": float(weight),
+            "max_psi": float(feature_psi.max()),
+            "features": {
+                name: {"psi": float(feature_psi[j]), "mean": float(mean[j]), "std": float(np.sqrt(var[j])),
+                       "reference_mean": float(ref.mean[j]), "reference_std": float(ref.std[j])}
+                for j, name in enumerate(ref.feature_names)
+            },
+            "drifted_features": [name for j, name in enumerate(ref.feature_names)
+                                 if feature_psi[j] >= self.psi_threshold],
+            "prediction_psi": float(psi(proba_counts, ref.proba_proportions)) if proba_counts is not None else None,
+            "probability_mean": float(proba_mean),
+            "fraud_rate": float(fraud_rate),
+            "reference_fraud_rate": ref.positive_rate,
+        }
+        return report
+
+    def check(self, now: Optional[float] = None) -> dict:
+        """Calcule le rapport, le transmet à `on_score` et lève une alerte si un seuil est franchi."""
+        report, score, alert = self._evaluate(now)
+        if alert is not None and self.on_alert is not None:
+            self.on_alert(alert)
+        if score is not None and self.on_score is not None:
+            self.on_score(score)
+        return report
+
+    def _evaluate(self, now: Optional[float] = None):
+        """(rapport, score de drift ou None, alerte ou None), sans appeler les callbacks."""
+        now = time.time() if now is None else now
+        report = self.report()
+        self._report = report
+        self.checks_total += 1
+        if report.get("effective_rows", 0) < self.min_rows:
+            return report, None, None
+
+        score = max(report["max_psi"], report["prediction_psi"] or 0.0)
+        reasons = []
+        if report["drifted_features"]:
+            reasons.append(f"PSI >= {self.psi_threshold} sur {', '.join(report['drifted_features'])}")
+        if (report["prediction_psi"] or 0.0) >= self.psi_threshold:
+            reasons.append(f"PSI de P(fraude) {report['prediction_psi']:.3f}")
+        if report["reference_fraud_rate"] is not None \
+                and abs(report["fraud_rate"] - report["reference_fraud_rate"]) >= self.fraud_rate_shift:
+            reasons.append(f"taux de fraude prédit {report['fraud_rate']:.3f} "
+                           f"(référence {report['reference_fraud_rate']:.3f})")
+
+        cooled_down = self._last_alert is None or now - self._last_alert >= self.alert_cooldown_s
+        if not (reasons and cooled_down):
+            return report, score, None
+        self._last_alert = now
+        self.alerts_total += 1
+        logger.warning(f"Drift détecté (version {report['version']}): {'; '.join(reasons)}")
+        alert = {
+            "type": "drift",
+            "version": report["version"],
+            "reasons": reasons,
+            "max_psi": report["max_psi"],
+            "prediction_psi": report["prediction_psi"],
+            "drifted_features": report["drifted_features"],
+            "fraud_rate": report["fraud_rate"],
+            "reference_fraud_rate": report["reference_fraud_rate"],
+            "effective_rows": report["effective_rows"],
+        }
+        return report, score, alert
+
+    # --- Worker --------------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.check_interval_s)
+            try:
+                # Rapport (quelques opérations NumPy) et alerte sur la boucle : on_alert peut alimenter une
+                # file asyncio ; seul on_score, qui écrit le ledger sous verrou fichier, passe par l'executor
+                _, score, alert = self._evaluate()
+                if alert is not None and self.on_alert is not None:
+                    self.on_alert(alert)
+                if score is not None and self.on_score is not None:
+                    await loop.run_in_executor(None, self.on_score, score)
+            except Exception as e:
+                logger.error(f"Erreur du moniteur de drift: {e}")
+
+    def stats(self) -> dict:
+        report = self._report
+        return {
+            "rows_observed": self.rows_observed,
+            "effective_rows": report.get("effective_rows", 0.0),
+            "max_psi": report.get("max_psi") or 0.0,
+            "prediction_psi": report.get("prediction_psi") or 0.0,
+            "fraud_rate": report.get("fraud_rate") or 0.0,
+            "checks_total": self.checks_total,
+            "alerts_total": self.alerts_total,
+        }
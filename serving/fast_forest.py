@@ -0,0 +1,118 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledForest:
+    """
+    RandomForestClassifier aplati en tableaux NumPy contigus.
+
+    Tous les arbres sont concaténés (feature, threshold, left, right, value) avec
+    des indices de noeuds globaux. L'inférence descend tous les arbres pour tout
+    le lot en même temps, niveau par niveau, puis moyenne les probabilités des
+    feuilles : classe et probabilité sortent d'une seule traversée.
+    """
+
+    def __init__(self, model):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_leaf = left == -1
+
+            value = tree.value[:, 0, :].astype(np.float64)
+            value = value / value.sum(axis=1, keepdims=True)
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(tree.threshold.astype(np.float64))
+            # Une feuille pointe sur elle-même : la descente s'y arrête naturellement
+            self_index = np.arange(offset, offset + tree.node_count)
+            lefts.append(np.where(is_leaf, self_index, left + offset))
+            rights.append(np.where(is_leaf, self_index, right + offset))
+            values.append(value)
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        self.classes_ = model.classes_
+        self.n_features = model.n_features_in_
+        self.max_depth = max_depth
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.feature = np.concatenate(features)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts)
+        self.right = np.concatenate(rights)
+        self.value = np.ascontiguousarray(np.concatenate(values))
+
+    ARRAYS = ("roots", "feature", "threshold", "left", "right", "value")
+
+    def to_arrays(self):
+        """Export (métadonnées JSON, tableaux) pour le format mmap de artifact_pack."""
+        meta = {
+            "classes": self.classes_.tolist(),
+            "n_features": int(self.n_features),
+            "max_depth": int(self.max_depth),
+        }
+        return meta, {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, meta: dict, arrays: dict):
+        """Reconstruit la forêt depuis to_arrays(); les tableaux peuvent être des vues mmap."""
+        self = cls.__new__(cls)
+        self.classes_ = np.asarray(meta["classes"])
+        self.n_features = meta["n_features"]
+        self.max_depth = meta["max_depth"]
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        return self
+
+    def predict_proba(self, X) -> np.ndarray:
+        # sklearn compare en float32 contre des seuils float64 : on reproduit le même cast
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        return self.value[nodes].mean(axis=1)
+
+    def predict_with_proba(self, X):
+        """Renvoie (classes prédites, probabilités) à partir d'une seule traversée."""
+        proba = self.predict_proba(X)
+        return self.classes_[proba.argmax(axis=1)], proba
+
+
+def compile_forest(model, n_check=256, atol=1e-12):
+    """
+    Compile la forêt; renvoie None (repli sur sklearn) si le modèle n'est pas supporté
+    ou si les probabilités divergent de model.predict_proba sur des points de contrôle.
+    """
+    try:
+        forest = CompiledForest(model)
+
+        # Points de contrôle couvrant la plage des seuils de chaque feature
+        rng = np.random.default_rng(0)
+        low = np.full(forest.n_features, -1.0)
+        high = np.full(forest.n_features, 1.0)
+        for j in range(forest.n_features):
+            used = forest.threshold[(forest.feature == j) & (forest.left != np.arange(len(forest.left)))]
+            if len(used):
+                low[j], high[j] = used.min() - 1.0, used.max() + 1.0
+        X_check = rng.uniform(low, high, size=(n_check, forest.n_features))
+
+        max_err = float(np.abs(forest.predict_proba(X_check) - model.predict_proba(X_check)).max())
+        if max_err > atol:
+            raise ValueError(f"écart max {max_err:.2e} avec model.predict_proba")
+        return forest
+    except Exception as e:
+        logger.warning(f"Forêt compilée indisponible, repli sur sklearn: {e}")
+        return None
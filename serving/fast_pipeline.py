@@ -0,0 +1,167 @@
+import logging
+from typing import Dict, List, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledFeaturePipeline:
+    """
+    Version compilée de preprocessor (StandardScaler + OneHotEncoder) suivi de la PCA.
+
+    Les deux étapes étant linéaires, on les fusionne au chargement :
+        X_pca = num @ W_num + bias + somme des contributions one-hot
+    - le scaling est replié dans W_num et bias,
+    - chaque catégorie pointe directement vers sa colonne de composantes PCA,
+    - une catégorie inconnue ne contribue pas (équivalent à handle_unknown='ignore').
+    Une transaction devient ainsi ses composantes PCA sans passer par un DataFrame.
+    """
+
+    def __init__(self, preprocessor, pca):
+        components = np.asarray(pca.components_, dtype=np.float64)  # (n_components, n_features)
+        if getattr(pca, "whiten", False):
+            components = components / np.sqrt(pca.explained_variance_)[:, np.newaxis]
+        n_features = components.shape[1]
+
+        self.n_components = components.shape[0]
+        self.numerical_cols: List[str] = []
+        self.categorical_cols: List[str] = []
+        self._category_index: List[Dict] = []
+        self._category_tables: List[np.ndarray] = []
+
+        bias = -np.asarray(pca.mean_, dtype=np.float64) @ components.T
+        w_num = []
+        seen_width = 0
+
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == "remainder" or transformer == "drop":
+                continue
+            cols = list(columns)
+            out = preprocessor.output_indices_[name]
+            block = components[:, out]  # (n_components, largeur du bloc)
+            seen_width += block.shape[1]
+            kind = type(transformer).__name__
+
+            if kind == "StandardScaler":
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(len(cols))
+                scale = transformer.scale_ if transformer.with_std else np.ones(len(cols))
+                w = (block / scale).T  # (n_num, n_components)
+                bias = bias - (mean / scale) @ block.T
+                self.numerical_cols.extend(cols)
+                w_num.append(w)
+
+            elif kind == "OneHotEncoder":
+                if transformer.drop_idx_ is not None or getattr(transformer, "infrequent_categories_", None):
+                    raise ValueError("OneHotEncoder avec drop/infrequent non supporté par le pipeline compilé.")
+                offset = 0
+                for col, categories in zip(cols, transformer.categories_):
+                    width = len(categories)
+                    # Dernière ligne à zéro : contribution d'une catégorie inconnue
+                    table = np.zeros((width + 1, self.n_components))
+                    table[:width] = block[:, offset:offset + width].T
+                    index = {(c.item() if isinstance(c, np.generic) else c): i for i, c in enumerate(categories)}
+                    self.categorical_cols.append(col)
+                    self._category_index.append(index)
+                    self._category_tables.append(table)
+                    offset += width
+
+            else:
+                raise ValueError(f"Transformer '{kind}' non supporté par le pipeline compilé.")
+
+        if seen_width != n_features:
+            raise ValueError(f"Largeur incohérente: {seen_width} colonnes vues, PCA en attend {n_features}.")
+
+        self.bias = bias
+        self.w_num = np.vstack(w_num) if w_num else np.zeros((0, self.n_components))
+
+    def to_arrays(self):
+        """Export (métadonnées JSON, tableaux) pour le format mmap de artifact_pack."""
+        tables = np.vstack(self._category_tables) if self._category_tables else np.zeros((0, self.n_components))
+        meta = {
+            "n_components": self.n_components,
+            "numerical_cols": self.numerical_cols,
+            "categorical_cols": self.categorical_cols,
+            "categories": [list(index) for index in self._category_index],
+        }
+        return meta, {"w_num": self.w_num, "bias": self.bias, "cat_tables": tables}
+
+    @classmethod
+    def from_arrays(cls, meta: dict, arrays: dict):
+        """Reconstruit le pipeline depuis to_arrays(); les tableaux peuvent être des vues mmap."""
+        self = cls.__new__(cls)
+        self.n_components = meta["n_components"]
+        self.numerical_cols = list(meta["numerical_cols"])
+        self.categorical_cols = list(meta["categorical_cols"])
+        self.w_num = arrays["w_num"]
+        self.bias = arrays["bias"]
+        self._category_index = []
+        self._category_tables = []
+        offset = 0
+        for categories in meta["categories"]:
+            # Chaque table a une ligne de plus (catégorie inconnue)
+            self._category_index.append({c: i for i, c in enumerate(categories)})
+            self._category_tables.append(arrays["cat_tables"][offset:offset + len(categories) + 1])
+            offset += len(categories) + 1
+        return self
+
+    def transform(self, data: Union[dict, List[dict]]) -> np.ndarray:
+        """Transforme une transaction (ou une liste) en composantes PCA, shape (n, n_components)."""
+        rows = [data] if isinstance(data, dict) else data
+
+        num = np.array([[row[c] for c in self.numerical_cols] for row in rows], dtype=np.float64)
+        X = num.reshape(len(rows), -1) @ self.w_num + self.bias
+
+        for col, index, table in zip(self.categorical_cols, self._category_index, self._category_tables):
+            unknown = len(table) - 1
+            idx = [index.get(row[col], unknown) for row in rows]
+            X += table[idx]
+
+        return X
+
+    def transform_frame(self, df) -> np.ndarray:
+        """
+        Variante colonne par colonne de transform() pour un DataFrame (scoring hors ligne).
+        Mêmes opérations dans le même ordre : le résultat est identique bit à bit.
+        """
+        num = df[self.numerical_cols].to_numpy(dtype=np.float64)
+        X = num.reshape(len(df), -1) @ self.w_num + self.bias
+
+        for col, index, table in zip(self.categorical_cols, self._category_index, self._category_tables):
+            unknown = len(table) - 1
+            idx = df[col].map(index).fillna(unknown).to_numpy(dtype=np.int64)
+            X += table[idx]
+
+        return X
+
+    def probe_rows(self) -> List[dict]:
+        """Une ligne par catégorie connue (plus une inconnue), pour vérifier la compilation."""
+        n_rows = max([len(index) for index in self._category_index] + [1]) + 1
+        rows = []
+        for i in range(n_rows):
+            row = {c: float(i) for c in self.numerical_cols}
+            for col, index in zip(self.categorical_cols, self._category_index):
+                categories = list(index)
+                row[col] = categories[i] if i < len(categories) else categories[0]
+            rows.append(row)
+        if self.categorical_cols:
+            rows[-1][self.categorical_cols[0]] = "__unknown__"
+        return rows
+
+
+def compile_pipeline(preprocessor, pca, reference_fn=None, atol=1e-8):
+    """
+    Compile le pipeline; renvoie None (repli sur sklearn) si les artefacts ne sont pas supportés
+    ou si la sortie diverge de `reference_fn` (chemin sklearn) sur des lignes de contrôle.
+    """
+    try:
+        pipeline = CompiledFeaturePipeline(preprocessor, pca)
+        if reference_fn is not None:
+            rows = pipeline.probe_rows()
+            max_err = float(np.abs(pipeline.transform(rows) - reference_fn(rows)).max())
+            if max_err > atol:
+                raise ValueError(f"écart max {max_err:.2e} avec le chemin sklearn")
+        return pipeline
+    except Exception as e:
+        logger.warning(f"Pipeline compilé indisponible, repli sur sklearn: {e}")
+        return None
@@ -0,0 +1,147 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackLedger:
+    """
+    Compteurs persistants des feedbacks, pour décider d'un réentraînement sans relire les données.
+
+    Le ledger est mis à jour à chaque flush du FeedbackStore et réécrit atomiquement
+    (fichier temporaire + os.replace). Au démarrage il est simplement relu : O(1)
+    quelle que soit la taille de l'historique. Chaque mise à jour relit l'état sous un
+    verrou fichier (flock), plusieurs workers peuvent donc partager le même ledger.
+    """
+
+    def __init__(self, path: str, retrain_threshold: int = 100, label_shift_threshold: float = 0.1,
+                 label_shift_min_rows: int = 50, drift_threshold: Optional[float] = None):
+        self.path = path
+        self.retrain_threshold = retrain_threshold
+        self.label_shift_threshold = label_shift_threshold
+        self.label_shift_min_rows = label_shift_min_rows
+        self.drift_threshold = drift_threshold
+        self._lock = threading.Lock()
+        self.state = {
+            "total_rows": 0,
+            "fraud_rows": 0,
+            "rows_since_retrain": 0,
+            "fraud_since_retrain": 0,
+            "retrains_triggered": 0,
+            "last_retrain_at": None,
+            "last_retrain_reason": None,
+            "drift_score": None,
+            "updated_at": None,
+        }
+
+    @contextmanager
+    def _locked(self):
+        """Section critique inter-threads et inter-processus; l'état est relu depuis le disque."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._reload()
+                    yield self.state
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                self.state.update(json.load(f))
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"Ledger feedback illisible ({e}), réinitialisation.")
+            return False
+
+    def load(self, legacy_csv_path: Optional[str] = None):
+        """Relit le ledger; à défaut, l'initialise une seule fois depuis l'ancien CSV."""
+        with self._locked() as state:
+            if os.path.exists(self.path) and state["updated_at"] is not None:
+                logger.info(f"Ledger feedback chargé: {state['total_rows']} lignes.")
+                return
+
+            if legacy_csv_path and os.path.exists(legacy_csv_path):
+                # Migration unique : seul cas où l'on scanne le fichier
+                import pandas as pd
+                targets = pd.read_csv(legacy_csv_path, usecols=['target'])['target'].astype(bool)
+                state["total_rows"] = int(len(targets))
+                state["fraud_rows"] = int(targets.sum())
+                logger.info(f"Ledger feedback initialisé depuis {legacy_csv_path}: {len(targets)} lignes.")
+            self._save()
+
+    def record(self, n_rows: int, n_fraud: int):
+        """Comptabilise un lot de feedbacks écrit sur disque."""
+        with self._locked() as state:
+            state["total_rows"] += n_rows
+            state["fraud_rows"] += n_fraud
+            state["rows_since_retrain"] += n_rows
+            state["fraud_since_retrain"] += n_fraud
+            self._save()
+
+    def update_drift(self, score: float):
+        with self._locked() as state:
+            state["drift_score"] = float(score)
+            self._save()
+
+    def retrain_reason(self, pending_rows: int = 0, pending_fraud: int = 0) -> Optional[str]:
+        """
+        Renvoie la raison d'un réentraînement (volume, mix de labels, drift) ou None.
+        `pending_*` : feedbacks pas encore écrits, comptés en plus des compteurs du ledger.
+        """
+        s = self.state
+        new_rows = s["rows_since_retrain"] + pending_rows
+        if new_rows >= self.retrain_threshold:
+            return f"{new_rows} nouvelles lignes (seuil {self.retrain_threshold})"
+
+        old_rows = s["total_rows"] - s["rows_since_retrain"]
+        if new_rows >= self.label_shift_min_rows and old_rows > 0:
+            new_rate = (s["fraud_since_retrain"] + pending_fraud) / new_rows
+            old_rate = (s["fraud_rows"] - s["fraud_since_retrain"]) / old_rows
+            if abs(new_rate - old_rate) >= self.label_shift_threshold:
+                return f"taux de fraude {old_rate:.2%} -> {new_rate:.2%}"
+
+        if self.drift_threshold is not None and s["drift_score"] is not None \
+                and s["drift_score"] >= self.drift_threshold:
+            return f"drift {s['drift_score']:.3f} (seuil {self.drift_threshold})"
+
+        return None
+
+    def claim_retrain(self) -> Optional[str]:
+        """
+        Vérifie les seuils et, s'ils sont atteints, remet à zéro les compteurs depuis le dernier
+        réentraînement dans la même section critique : un seul worker déclenche le job.
+        """
+        with self._locked() as state:
+            reason = self.retrain_reason()
+            if reason is None:
+                return None
+            state["rows_since_retrain"] = 0
+            state["fraud_since_retrain"] = 0
+            state["retrains_triggered"] += 1
+            state["last_retrain_at"] = time.time()
+            state["last_retrain_reason"] = reason
+            state["drift_score"] = None
+            self._save()
+            return reason
+
+    def _save(self):
+        self.state["updated_at"] = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Impossible d'écrire le ledger feedback: {e}")
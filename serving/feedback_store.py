@@ -0,0 +1,212 @@
+import asyncio
+import fcntl
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackStore:
+    """
+    Stockage bufferisé des feedbacks (vecteurs PCA + target + prediction).
+
+    /feedback ne fait qu'ajouter une ligne en mémoire. Un worker vide le buffer par lots
+    (toutes les `flush_interval_s` secondes ou dès `flush_rows` lignes) :
+    - un fichier Parquet par flush, partitionné par heure (date=YYYY-MM-DD/hour=HH/),
+      écrit sous un nom temporaire puis renommé atomiquement;
+    - un append unique dans le CSV historique (prod_data.csv) lu par reporting/project.py.
+    Un seul thread écrit par process ; entre workers gunicorn, l'append CSV est pris sous un
+    verrou fichier (flock) : les lignes ne s'entrelacent pas et l'en-tête n'est écrit qu'une fois.
+    """
+
+    def __init__(self, root_dir: str, csv_path: Optional[str] = None,
+                 flush_rows: int = 500, flush_interval_s: float = 1.0, ledger=None):
+        self.root_dir = root_dir
+        self.csv_path = csv_path
+        self.ledger = ledger
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self._buffer: List[tuple] = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Statistiques
+        self.rows_written = 0
+        self.flushes_total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def pending(self) -> Tuple[int, int]:
+        """(lignes, fraudes) encore en buffer, pas encore écrites ni comptées dans le ledger."""
+        with self._buffer_lock:
+            return len(self._buffer), sum(row[1] for row in self._buffer)
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Arrête le worker et écrit ce qui reste dans le buffer."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.flush()
+
+    def append(self, pca_row, target: bool, prediction: bool, version: Optional[str] = None):
+        """Ajoute un feedback au buffer (aucune I/O disque). `version` : artefacts qui ont calculé le vecteur PCA."""
+        row = (np.asarray(pca_row, dtype=np.float64).ravel(), bool(target), bool(prediction), time.time(), version)
+        with self._buffer_lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_rows
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"Erreur d'écriture des feedbacks: {e}")
+
+    def flush(self) -> int:
+        """Ecrit le buffer courant; renvoie le nombre de lignes écrites."""
+        with self._write_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+
+            df = self._to_frame(rows)
+            try:
+                with STAGE_LATENCY.time("feedback_parquet"):
+                    self._write_parquet(df)
+            except Exception:
+                # On remet les lignes en tête du buffer pour le prochain flush
+                with self._buffer_lock:
+                    self._buffer = rows + self._buffer
+                raise
+
+            # Compteurs persistants mis à jour avec chaque écriture
+            if self.ledger is not None:
+                self.ledger.record(len(rows), int(df['target'].sum()))
+
+            if self.csv_path:
+                try:
+                    with STAGE_LATENCY.time("feedback_csv"):
+                        self._append_csv(df)
+                except OSError as e:
+                    logger.error(f"Export CSV des feedbacks impossible: {e}")
+
+            self.rows_written += len(rows)
+            self.flushes_total += 1
+            return len(rows)
+
+    @staticmethod
+    def _to_frame(rows: List[tuple]) -> pd.DataFrame:
+        X = np.vstack([r[0] for r in rows])
+        df = pd.DataFrame(X, columns=[f'PCA_{i+1}' for i in range(X.shape[1])])
+        df['target'] = [r[1] for r in rows]
+        df['prediction'] = [r[2] for r in rows]
+        df['received_at'] = pd.to_datetime([r[3] for r in rows], unit='s', utc=True)
+        df['artifact_version'] = [r[4] for r in rows]
+        return df
+
+    def _write_parquet(self, df: pd.DataFrame):
+        hours = df['received_at'].dt.floor('h')
+        for hour, part in df.groupby(hours):
+            part_dir = os.path.join(self.root_dir, f"date={hour:%Y-%m-%d}", f"hour={hour:%H}")
+            os.makedirs(part_dir, exist_ok=True)
+            name = f"part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.parquet"
+            tmp_path = os.path.join(part_dir, "." + name + ".tmp")
+            part.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, os.path.join(part_dir, name))
+
+    def _append_csv(self, df: pd.DataFrame):
+        # Même schéma qu'avant (PCA_* + target + prediction) pour reporting/project.py
+        with open(self.csv_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                header = not os.path.exists(self.csv_path)
+                df.drop(columns=['received_at', 'artifact_version']).to_csv(self.csv_path, mode='a', header=header,
+                                                                            index=False)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.buffered,
+            "rows_written": self.rows_written,
+            "flushes_total": self.flushes_total,
+        }
+
+
+def _partition_hour(part_dir: str) -> Optional[pd.Timestamp]:
+    """Heure d'une partition `.../date=YYYY-MM-DD/hour=HH`, None si le chemin n'a pas ce format."""
+    hour_dir, date_dir = os.path.basename(part_dir), os.path.basename(os.path.dirname(part_dir))
+    if not (hour_dir.startswith("hour=") and date_dir.startswith("date=")):
+        return None
+    try:
+        return pd.Timestamp(f"{date_dir[5:]} {hour_dir[5:]}:00", tz="UTC")
+    except ValueError:
+        return None
+
+
+def feedback_files(root_dir: str, since: Optional[pd.Timestamp] = None) -> List[Tuple[str, str]]:
+    """
+    (partition, chemin) des fichiers Parquet du store, triés.
+    Avec `since`, les partitions horaires entièrement antérieures ne sont pas listées.
+    """
+    if not os.path.isdir(root_dir):
+        return []
+    files = []
+    for d, _, names in os.walk(root_dir):
+        hour = _partition_hour(d)
+        if since is not None and hour is not None and hour + pd.Timedelta(hours=1) <= since:
+            continue
+        partition = os.path.relpath(d, root_dir)
+        files.extend((partition, os.path.join(d, f)) for f in names if f.endswith(".parquet") and not f.startswith("."))
+    return sorted(files)
+
+
+def read_feedback(root_dir: str, since: Optional[pd.Timestamp] = None, files: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Relit le store Parquet (optionnellement les seules lignes reçues après `since`), ou seulement `files`.
+    Avec `since`, les partitions horaires entièrement antérieures ne sont pas ouvertes.
+    """
+    if files is None:
+        files = [path for _, path in feedback_files(root_dir, since=since)]
+    if not files:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+    if since is not None:
+        df = df[df['received_at'] > since]
+    return df.sort_values('received_at', kind='stable').reset_index(drop=True)
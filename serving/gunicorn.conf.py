@@ -0,0 +1,66 @@
+"""
+Mode production : N workers uvicorn derrière gunicorn.
+
+- Les artefacts sont chargés une seule fois dans le master (preload_app + when_ready),
+  puis partagés en copy-on-write par les workers forkés (et via le page cache pour le pack mmap).
+- Chaque worker est épinglé sur un coeur (CPU_PINNING) et les threads BLAS sont limités à 1,
+  pour que N workers occupent N coeurs sans sur-souscription.
+- Chaque worker écrit ses métriques dans METRICS_MULTIPROC_DIR ; /metrics les agrège sur tous les workers.
+
+Lancement : gunicorn -c gunicorn.conf.py api:app
+"""
+import os
+import shutil
+
+# A fixer avant l'import de numpy (preload de l'app)
+BLAS_THREADS = os.getenv("BLAS_THREADS", "1")
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+    os.environ.setdefault(var, BLAS_THREADS)
+
+# Avant le preload : l'app crée son MultiprocessCollector à l'import
+METRICS_MULTIPROC_DIR = os.environ.setdefault("METRICS_MULTIPROC_DIR", "/tmp/fraud_metrics")
+
+CPU_PINNING = os.getenv("CPU_PINNING", "true").lower() in ("1", "true", "yes")
+AVAILABLE_CORES = sorted(os.sched_getaffinity(0))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("SERVING_WORKERS", str(len(AVAILABLE_CORES))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+
+
+def on_starting(server):
+    """Master : repart d'un dossier de métriques vide (les compteurs d'une exécution précédente ne comptent plus)."""
+    shutil.rmtree(METRICS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+
+
+def when_ready(server):
+    """Master : charge les artefacts avant le fork des workers."""
+    import api
+    try:
+        api.preload_artifacts()
+    except Exception as e:
+        server.log.error(f"Préchargement des artefacts impossible, chargement par worker: {e}")
+    # Les mesures du préchargement ne doivent pas être héritées (et sommées) par chaque worker
+    api.REGISTRY.reset()
+
+
+def post_fork(server, worker):
+    """Worker : épinglage sur un coeur (round-robin sur les coeurs disponibles)."""
+    if not CPU_PINNING:
+        return
+    core = AVAILABLE_CORES[(worker.age - 1) % len(AVAILABLE_CORES)]
+    try:
+        os.sched_setaffinity(0, {core})
+        server.log.info(f"Worker {worker.pid} épinglé sur le coeur {core}.")
+    except OSError as e:
+        server.log.warning(f"Epinglage CPU impossible: {e}")
+
+
+def child_exit(server, worker):
+    """Master : les jauges d'un worker terminé disparaissent, ses compteurs restent dans les totaux."""
+    from metrics import mark_process_dead
+    mark_process_dead(METRICS_MULTIPROC_DIR, worker.pid)
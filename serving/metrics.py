@@ -0,0 +1,308 @@
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Buckets de latence (secondes) : de 50 µs à 5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(labels), value] for labels, value in self._values.items()]
+        return {"kind": self.kind, "documentation": self.documentation, "labelnames": list(self.labelnames),
+                "values": values}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def value(self, *labels) -> Optional[float]:
+        return self._values.get(labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple, List[int]] = {}
+        self._sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(labels), [list(counts), self._sums[labels]]] for labels, counts in self._counts.items()]
+        return {"kind": self.kind, "documentation": self.documentation, "labelnames": list(self.labelnames),
+                "buckets": list(self.buckets), "values": values}
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(self._sums[labels])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collecteur en mémoire, rendu au format texte Prometheus (sans dépendance externe)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def reset(self):
+        """Remet toutes les valeurs à zéro (les métriques restent enregistrées)."""
+        for metric in self._metrics.values():
+            with metric._lock:
+                for attr in ("_values", "_counts", "_sums"):
+                    if hasattr(metric, attr):
+                        getattr(metric, attr).clear()
+
+
+def _merge(snapshots: Dict[int, dict]) -> MetricsRegistry:
+    """
+    Fusionne les instantanés des workers : compteurs et histogrammes sommés (y compris ceux des workers
+    terminés, pour rester monotones), jauges gardées par worker avec un label `pid`.
+    """
+    merged = MetricsRegistry()
+    for pid, snapshot in sorted(snapshots.items()):
+        for name, data in snapshot.items():
+            labelnames = data["labelnames"]
+            if data["kind"] == "counter":
+                metric = merged.counter(name, data["documentation"], labelnames)
+                for labels, value in data["values"]:
+                    metric.inc(*labels, amount=value)
+            elif data["kind"] == "gauge":
+                metric = merged.gauge(name, data["documentation"], labelnames + ["pid"])
+                for labels, value in data["values"]:
+                    metric.set(value, *labels, str(pid))
+            elif data["kind"] == "histogram":
+                metric = merged.histogram(name, data["documentation"], labelnames, data["buckets"])
+                for labels, (counts, total) in data["values"]:
+                    key = tuple(labels)
+                    current = metric._counts.setdefault(key, [0] * len(counts))
+                    metric._counts[key] = [a + b for a, b in zip(current, counts)]
+                    metric._sums[key] = metric._sums.get(key, 0.0) + total
+    return merged
+
+
+class MultiprocessCollector:
+    """
+    Agrégation des métriques des workers gunicorn derrière un même port.
+
+    Chaque worker écrit l'instantané de son registre dans `directory/<pid>.json` (fichier temporaire
+    puis os.replace), toutes les `interval_s` secondes et avant chaque scrape ; /metrics fusionne les
+    fichiers de tous les workers (cf. _merge), un scrape donne donc le même total quel que soit le worker
+    qui répond. `before_write` met à jour les jauges d'état du worker juste avant l'écriture.
+    """
+
+    def __init__(self, directory: str, registry: MetricsRegistry, interval_s: float = 5.0,
+                 before_write: Optional[Callable[[], None]] = None):
+        self.directory = directory
+        self.registry = registry
+        self.interval_s = interval_s
+        self.before_write = before_write
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def path(self) -> str:
+        # Calculé à chaque appel : le registre est créé avant le fork des workers (preload_app)
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Arrête le worker et écrit le dernier instantané."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.write()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await loop.run_in_executor(None, self.write)
+            except Exception as e:
+                logger.error(f"Ecriture des métriques impossible: {e}")
+
+    def write(self):
+        if self.before_write is not None:
+            self.before_write()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def render(self) -> str:
+        self.write()
+        snapshots = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshots[int(os.path.basename(path)[:-5])] = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Métriques illisibles ({path}): {e}")
+        return _merge(snapshots).render()
+
+
+def mark_process_dead(directory: str, pid: int):
+    """Worker terminé (hook gunicorn child_exit) : ses jauges disparaissent, ses compteurs restent dans les totaux."""
+    path = os.path.join(directory, f"{pid}.json")
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        snapshot = {name: data for name, data in snapshot.items() if data["kind"] != "gauge"}
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+    except (OSError, ValueError):
+        pass
+
+
+# Collecteur du process (un par worker ; agrégé entre workers par MultiprocessCollector)
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "fraud_stage_latency_seconds",
+    "Latence par étape du pipeline d'inférence et des tâches de fond.",
+    ["stage"]
+)
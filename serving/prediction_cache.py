@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from metrics import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter("fraud_prediction_cache_lookups_total", "Consultations du cache de prédictions.", ["result"])
+
+
+class PredictionCache:
+    """
+    Cache LRU + TTL des résultats de /predict, indexé par un hash des features normalisées.
+
+    Les rejeux d'une même autorisation (retries des acquéreurs, formulaire renvoyé par la
+    webapp) sont servis sans repasser par preprocessor/PCA/forêt. Les entrées appartiennent
+    à une version d'artefacts : dès qu'une autre version est demandée, le cache est vidé.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_s: float = 300.0, exclude: Iterable[str] = ("email",)):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.exclude = frozenset(exclude)
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def key(self, data: Dict[str, Any]) -> str:
+        """Hash stable des features : clés triées, types normalisés, champs exclus ignorés."""
+        canonical = {}
+        for name, value in data.items():
+            if name in self.exclude:
+                continue
+            if isinstance(value, bool) or value is None:
+                canonical[name] = value
+            elif isinstance(value, (int, float)):
+                canonical[name] = float(value)
+            else:
+                canonical[name] = str(value)
+        raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def _check_version(self, version: str):
+        # Appelé sous verrou
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key: str, version: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_s:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc("miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        CACHE_LOOKUPS.inc("hit")
+        return entry[1]
+
+    def put(self, key: str, value: Any, version: str):
+        """Mémorise un résultat calculé avec `version`; ignoré si le cache a déjà changé de version."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
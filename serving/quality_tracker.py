@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Colonnes de la matrice de confusion d'une fenêtre
+TP, FP, FN, TN = range(4)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (prediction_id TEXT PRIMARY KEY, window INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS seen_window ON seen (window);
+CREATE TABLE IF NOT EXISTS confusion (
+    window INTEGER NOT NULL, version TEXT NOT NULL, tp INTEGER NOT NULL, fp INTEGER NOT NULL,
+    fn INTEGER NOT NULL, tn INTEGER NOT NULL, PRIMARY KEY (window, version));
+CREATE TABLE IF NOT EXISTS calibration (
+    window INTEGER NOT NULL, version TEXT NOT NULL, bin INTEGER NOT NULL, count INTEGER NOT NULL,
+    total_proba REAL NOT NULL, positives INTEGER NOT NULL, PRIMARY KEY (window, version, bin));
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def _signature(key: bytes, payload: str) -> str:
+    return hmac.new(key, payload.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def make_prediction_id(key: bytes, version: str, is_fraud: bool, probability_fraud: float,
+                       predicted_at: Optional[float] = None) -> str:
+    """
+    Identifiant de prédiction autoporteur et signé :
+    `<version>:<ms depuis epoch>:<P(fraude) en 1e-4>:<classe servie>:<aléa>:<HMAC>`.
+
+    Le label arrive des heures plus tard, possiblement sur un autre worker ou après un redémarrage :
+    l'identifiant contient tout ce qu'il faut pour la jointure, l'API ne garde aucune prédiction en attente.
+    La signature (HMAC-SHA256 tronqué, clé partagée par les workers) empêche /feedback d'accepter
+    une version, une heure ou une probabilité inventées.
+    """
+    predicted_at = time.time() if predicted_at is None else predicted_at
+    payload = (f"{version}:{int(predicted_at * 1000)}:{int(round(probability_fraud * 10000))}:"
+               f"{int(bool(is_fraud))}:{uuid.uuid4().hex[:12]}")
+    return f"{payload}:{_signature(key, payload)}"
+
+
+def parse_prediction_id(key: bytes, prediction_id: str) -> Tuple[str, float, float, bool]:
+    """
+    (version, horodatage en secondes, P(fraude), classe servie) d'un identifiant ;
+    ValueError s'il est mal formé ou si sa signature ne correspond pas.
+    """
+    payload, _, signature = prediction_id.rpartition(":")
+    if not hmac.compare_digest(signature, _signature(key, payload)):
+        raise ValueError(f"Signature invalide: {prediction_id}")
+    version, ms, proba, served, _ = payload.rsplit(":", 4)
+    probability = int(proba) / 10000
+    if not version or not 0 <= probability <= 1 or served not in ("0", "1"):
+        raise ValueError(f"Identifiant de prédiction invalide: {prediction_id}")
+    return version, int(ms) / 1000, probability, served == "1"
+
+
+def load_or_create_key(path: str) -> bytes:
+    """
+    Clé de signature partagée par les workers : relue depuis `path`, ou créée une seule fois
+    (fichier temporaire puis os.link, qui échoue si un autre worker l'a créée avant).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(secrets.token_bytes(32))
+        os.chmod(tmp_path, 0o600)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _scores(confusion: np.ndarray) -> dict:
+    tp, fp, fn, tn = (int(c) for c in confusion)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "count": tp + fp + fn + tn,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+class QualityTracker:
+    """
+    Qualité de classification en ligne à partir des labels différés de /feedback.
+
+    Chaque label est rattaché à sa prédiction par son identifiant signé (cf. make_prediction_id) puis
+    compté dans la fenêtre `window_s` de l'heure de prédiction et de la version qui a prédit : matrice
+    de confusion et, par bin de P(fraude), effectif, somme des probabilités et nombre de fraudes
+    (courbe de calibration). Un label sans identifiant n'est compté que comme non vérifié ; un
+    identifiant mal signé, daté de plus de `max_skew_s` dans le futur ou antérieur à la rétention est rejeté.
+
+    record() ne fait qu'ajouter le label à un buffer mémoire ; un worker l'écrit par lots (comme le
+    FeedbackStore) dans une base SQLite partagée par les workers gunicorn et conservée au redémarrage :
+    fenêtres, identifiants déjà labellisés (dédoublonnage entre workers) et compteurs. Seules les
+    `retention_windows` dernières fenêtres, et les identifiants qui y tombent, sont gardés.
+    """
+
+    def __init__(self, path: str = ":memory:", key: Optional[bytes] = None, window_s: float = 3600.0,
+                 retention_windows: int = 168, n_bins: int = 10, max_skew_s: float = 300.0,
+                 flush_rows: int = 500, flush_interval_s: float = 1.0):
+        self.path = path
+        self.key = key
+        self.max_skew_s = max_skew_s
+        self.window_s = window_s
+        self.retention_windows = retention_windows
+        self.n_bins = n_bins
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self._buffer: List[tuple] = []
+        self._buffer_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Statistiques de ce process (les labels comptés sont dans la base)
+        self.invalid_ids_total = 0
+        self.rejected_ids_total = 0
+        self.unverified_total = 0
+
+    def _window(self, predicted_at: float) -> int:
+        return int(predicted_at // self.window_s)
+
+    def prediction_id(self, version: str, is_fraud: bool, probability_fraud: float,
+                      predicted_at: Optional[float] = None) -> str:
+        """Identifiant signé avec la clé du tracker (cf. make_prediction_id)."""
+        return make_prediction_id(self.key, version, is_fraud, probability_fraud, predicted_at)
+
+    # --- /feedback ------------------------------------------------------------
+
+    def record(self, label: bool, prediction_id: Optional[str] = None) -> bool:
+        """
+        Valide l'identifiant et met le label en buffer (aucune I/O). Sans identifiant, la prédiction
+        n'est pas vérifiable : le label n'est pas compté dans les fenêtres. Renvoie False s'il est écarté.
+        """
+        if prediction_id is None:
+            self.unverified_total += 1
+            return False
+        now = time.time()
+        try:
+            version, predicted_at, probability, prediction = parse_prediction_id(self.key, prediction_id)
+        except ValueError:
+            self.invalid_ids_total += 1
+            return False
+        # Une date future ferait expirer toutes les fenêtres au prochain flush
+        if predicted_at > now + self.max_skew_s or predicted_at < now - self.retention_windows * self.window_s:
+            self.rejected_ids_total += 1
+            return False
+
+        cell = (FN if label else TN) if not prediction else (TP if label else FP)
+        calibration_bin = min(int(probability * self.n_bins), self.n_bins - 1)
+        row = (prediction_id, self._window(predicted_at), version, cell, calibration_bin, probability, bool(label))
+        with self._buffer_lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_rows
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    # --- Ecriture par lots ----------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Arrête le worker et écrit ce qui reste dans le buffer."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"Erreur d'écriture des labels de qualité: {e}")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Appelé sous _db_lock ; une connexion par process, le verrou SQLite sérialise les workers
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            if self.path != ":memory:":
+                db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def flush(self) -> int:
+        """Ecrit le buffer dans la base en une transaction ; renvoie le nombre de labels comptés."""
+        with self._db_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            db = self._connect()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                counted = self._write(db, rows)
+                db.execute("COMMIT")
+            except Exception:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                # On remet les lignes en tête du buffer pour le prochain flush
+                with self._buffer_lock:
+                    self._buffer = rows + self._buffer
+                raise
+            return counted
+
+    def _write(self, db: sqlite3.Connection, rows: List[tuple]) -> int:
+        latest = max([row[1] for row in rows] + [self._counter(db, "latest_window")])
+        oldest = latest - self.retention_windows
+        confusion, calibration = {}, {}
+        counted = duplicates = expired = 0
+        for prediction_id, window, version, cell, calibration_bin, probability, label in rows:
+            if window <= oldest:
+                expired += 1
+                continue
+            # Dédoublonnage entre workers : l'identifiant est la clé primaire de `seen`
+            if db.execute("INSERT OR IGNORE INTO seen VALUES (?, ?)", (prediction_id, window)).rowcount == 0:
+                duplicates += 1
+                continue
+            confusion.setdefault((window, version), [0, 0, 0, 0])[cell] += 1
+            entry = calibration.setdefault((window, version, calibration_bin), [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += probability
+            entry[2] += int(label)
+            counted += 1
+
+        db.executemany(
+            "INSERT INTO confusion VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (window, version) DO UPDATE SET "
+            "tp = tp + excluded.tp, fp = fp + excluded.fp, fn = fn + excluded.fn, tn = tn + excluded.tn",
+            [(*key, *cells) for key, cells in confusion.items()])
+        db.executemany(
+            "INSERT INTO calibration VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (window, version, bin) DO UPDATE SET "
+            "count = count + excluded.count, total_proba = total_proba + excluded.total_proba, "
+            "positives = positives + excluded.positives",
+            [(*key, *entry) for key, entry in calibration.items()])
+        for table in ("seen", "confusion", "calibration"):
+            db.execute(f"DELETE FROM {table} WHERE window <= ?", (oldest,))
+        db.executemany(
+            "INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            [("labels_total", counted), ("duplicates_total", duplicates), ("expired_total", expired)])
+        db.execute("INSERT INTO counters VALUES ('latest_window', ?) ON CONFLICT (name) DO UPDATE SET value = ?",
+                   (latest, latest))
+        return counted
+
+    @staticmethod
+    def _counter(db: sqlite3.Connection, name: str) -> int:
+        row = db.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else -(2 ** 62)
+
+    # --- Lecture --------------------------------------------------------------
+
+    def report(self, windows: int = 24, version: Optional[str] = None) -> dict:
+        """Précision / rappel / F1 et calibration glissants sur les `windows` dernières fenêtres, par version."""
+        with self._db_lock:
+            db = self._connect()
+            latest = db.execute("SELECT value FROM counters WHERE name = 'latest_window'").fetchone()
+            if latest is None:
+                return {"window_s": self.window_s, "versions": {}}
+            first = latest[0] - windows + 1
+            where = "WHERE window >= ?" + (" AND version = ?" if version is not None else "")
+            params = (first,) if version is None else (first, version)
+            confusion_rows = db.execute(
+                f"SELECT window, version, tp, fp, fn, tn FROM confusion {where} ORDER BY window, version",
+                params).fetchall()
+            calibration_rows = db.execute(
+                f"SELECT version, bin, SUM(count), SUM(total_proba), SUM(positives) FROM calibration {where} "
+                f"GROUP BY version, bin", params).fetchall()
+
+        versions = {}
+        for window, v, *cells in confusion_rows:
+            agg = versions.setdefault(v, {"confusion": np.zeros(4, dtype=np.int64),
+                                          "calibration": np.zeros((self.n_bins, 3)), "windows": []})
+            agg["confusion"] += cells
+            agg["windows"].append({"start": window * self.window_s, **_scores(np.asarray(cells))})
+        for v, calibration_bin, count, total_proba, positives in calibration_rows:
+            if v in versions:
+                versions[v]["calibration"][calibration_bin] = (count, total_proba, positives)
+
+        edges = np.linspace(0, 1, self.n_bins + 1)
+        for v, agg in versions.items():
+            calibration = agg.pop("calibration")
+            agg.update(_scores(agg.pop("confusion")))
+            agg["calibration"] = [
+                {"bin": [float(edges[i]), float(edges[i + 1])], "count": int(count),
+                 "mean_predicted": total_proba / count, "observed_rate": positives / count}
+                for i, (count, total_proba, positives) in enumerate(calibration) if count
+            ]
+        return {"window_s": self.window_s, "windows": windows, "versions": versions}
+
+    def stats(self) -> dict:
+        """Compteurs partagés (base) et rejets de ce process."""
+        with self._db_lock:
+            db = self._connect()
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            n_windows = db.execute("SELECT COUNT(*) FROM confusion").fetchone()[0]
+        return {
+            "labels_total": counters.get("labels_total", 0),
+            "duplicates_total": counters.get("duplicates_total", 0),
+            "expired_total": counters.get("expired_total", 0),
+            "unverified_total": self.unverified_total,
+            "invalid_ids_total": self.invalid_ids_total,
+            "rejected_ids_total": self.rejected_ids_total,
+            "buffered": len(self._buffer),
+            "windows": n_windows,
+        }
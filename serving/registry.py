@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import time
+from typing import List, Optional, Union
+
+import pandas as pd
+
+from artifact_pack import PACK_FILE, read_pack
+from fast_forest import compile_forest
+from fast_pipeline import compile_pipeline
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+REFERENCE_STATS_FILE = "ref_stats.json"
+PIN_FILE = "pinned_version"
+LEGACY_VERSION = "legacy"
+
+
+class ArtifactBundle:
+    """
+    Triplet preprocessor / PCA / modèle d'une version, avec ses versions compilées.
+
+    Un bundle est immuable une fois construit : l'API remplace le bundle actif d'un
+    seul coup, une requête en cours garde donc un triplet cohérent.
+    """
+
+    def __init__(self, version: str, model=None, pca=None, preprocessor=None, manifest: Optional[dict] = None,
+                 features=None, forest=None):
+        self.version = version
+        self.model = model
+        self.pca = pca
+        self.preprocessor = preprocessor
+        self.manifest = manifest or {"version": version}
+        self.features = features
+        self.forest = forest
+        # Statistiques de la référence d'entraînement (ref_stats.json), pour le drift en ligne
+        self.reference_stats: Optional[dict] = None
+        self.source = "pickle"
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_pickles(cls, path: str, version: str, manifest: Optional[dict] = None,
+                     fast_pipeline: bool = True, fast_forest: bool = True):
+        """Dépickle le triplet sklearn puis compile les chemins NumPy (vérifiés contre sklearn)."""
+        with open(os.path.join(path, 'model.pickle'), 'rb') as f:
+            model = pickle.load(f)
+
+        with open(os.path.join(path, 'pca.pickle'), 'rb') as f:
+            pca = pickle.load(f)
+
+        with open(os.path.join(path, 'preprocessor.pickle'), 'rb') as f:
+            preprocessor = pickle.load(f)
+
+        bundle = cls(version, model, pca, preprocessor, manifest=manifest)
+        if fast_pipeline:
+            bundle.features = compile_pipeline(preprocessor, pca, reference_fn=bundle.sklearn_features)
+        if fast_forest:
+            bundle.forest = compile_forest(model)
+        return bundle
+
+    @classmethod
+    def from_pack(cls, path: str, version: str, manifest: Optional[dict] = None):
+        """Ouvre le pack mmap : ni unpickling ni import sklearn, pages partagées entre workers."""
+        features, forest, _ = read_pack(os.path.join(path, PACK_FILE))
+        bundle = cls(version, manifest=manifest, features=features, forest=forest)
+        bundle.source = "pack"
+        return bundle
+
+    @classmethod
+    def from_dir(cls, path: str, version: str, manifest: Optional[dict] = None,
+                 use_pack: bool = True, **kwargs):
+        if use_pack and os.path.exists(os.path.join(path, PACK_FILE)):
+            return cls.from_pack(path, version, manifest=manifest)
+        return cls.from_pickles(path, version, manifest=manifest, **kwargs)
+
+    def sklearn_features(self, data: Union[dict, List[dict]]):
+        """Chemin de référence : DataFrame -> preprocessor -> PCA."""
+        rows = [data] if isinstance(data, dict) else data
+        with STAGE_LATENCY.time("dataframe"):
+            df = pd.DataFrame(rows)
+
+        # Preprocess
+        with STAGE_LATENCY.time("preprocessor"):
+            X_processed = self.preprocessor.transform(df)
+
+        # PCA
+        with STAGE_LATENCY.time("pca"):
+            return self.pca.transform(X_processed)
+
+    def transform(self, data: Union[dict, List[dict]]):
+        """Données brutes -> vecteurs PCA (pipeline compilé si disponible)."""
+        if self.features is not None:
+            with STAGE_LATENCY.time("features_compiled"):
+                return self.features.transform(data)
+        return self.sklearn_features(data)
+
+    def transform_frame(self, df: pd.DataFrame):
+        """Comme transform(), pour un DataFrame déjà chargé (scoring hors ligne par chunks)."""
+        if self.features is not None:
+            with STAGE_LATENCY.time("features_compiled"):
+                return self.features.transform_frame(df)
+        return self.pca.transform(self.preprocessor.transform(df))
+
+    def predict_with_proba(self, X_pca):
+        """Classes prédites et probabilités à partir d'une seule évaluation de la forêt."""
+        if self.forest is not None:
+            with STAGE_LATENCY.time("forest_compiled"):
+                return self.forest.predict_with_proba(X_pca)
+        # Un seul predict_proba : la classe prédite est l'argmax, comme dans RandomForest.predict
+        with STAGE_LATENCY.time("predict_proba"):
+            proba = self.model.predict_proba(X_pca)
+        return self.model.classes_[proba.argmax(axis=1)], proba
+
+    def warm_up(self):
+        """Premier passage complet (caches NumPy/sklearn) avant d'exposer le bundle au trafic."""
+        if self.features is not None:
+            rows = self.features.probe_rows()[:1]
+            self.predict_with_proba(self.transform(rows))
+
+
+def load_reference_stats(path: str) -> Optional[dict]:
+    """ref_stats.json d'une version (absent des versions antérieures : None)."""
+    stats_path = os.path.join(path, REFERENCE_STATS_FILE)
+    if not os.path.exists(stats_path):
+        return None
+    try:
+        with open(stats_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Statistiques de référence illisibles ({stats_path}): {e}")
+        return None
+
+
+class ArtifactRegistry:
+    """
+    Registre versionné des artefacts.
+
+    Chaque entraînement écrit `<root>/versions/<version>/` avec les trois pickles et un
+    manifest.json (écrit en dernier : un dossier sans manifest est ignoré). La version
+    active est la plus récente, sauf si une version est épinglée (fichier `pinned_version`).
+    A défaut de version, les pickles à la racine de `root` (format historique) sont utilisés.
+    """
+
+    def __init__(self, root: str, poll_interval_s: float = 10.0, **bundle_kwargs):
+        self.root = root
+        self.versions_dir = os.path.join(root, "versions")
+        self.poll_interval_s = poll_interval_s
+        self.bundle_kwargs = bundle_kwargs
+        self.active: Optional[ArtifactBundle] = None
+        self._failed = set()
+        self._swap_lock = asyncio.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+
+    # --- Lecture du registre -------------------------------------------------
+
+    def list_versions(self) -> List[dict]:
+        """Manifests des versions complètes, de la plus ancienne à la plus récente."""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.versions_dir):
+            manifest_path = os.path.join(self.versions_dir, name, MANIFEST_FILE)
+            if not os.path.exists(manifest_path):
+                continue
+            try:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Manifest illisible pour {name}: {e}")
+                continue
+            manifest.setdefault("version", name)
+            manifests.append(manifest)
+        return sorted(manifests, key=lambda m: (m.get("created_at", ""), m["version"]))
+
+    @property
+    def pinned(self) -> Optional[str]:
+        pin_path = os.path.join(self.root, PIN_FILE)
+        if not os.path.exists(pin_path):
+            return None
+        with open(pin_path) as f:
+            return f.read().strip() or None
+
+    def target_version(self) -> str:
+        """Version qui devrait être servie : épinglée, sinon la plus récente."""
+        pinned = self.pinned
+        if pinned is not None:
+            return pinned
+        candidates = [m["version"] for m in self.list_versions() if m["version"] not in self._failed]
+        return candidates[-1] if candidates else LEGACY_VERSION
+
+    def load_bundle(self, version: str) -> ArtifactBundle:
+        """Charge, compile et chauffe une version (appel bloquant, à lancer hors boucle)."""
+        if version == LEGACY_VERSION:
+            path = self.root
+            bundle = ArtifactBundle.from_dir(path, LEGACY_VERSION, **self.bundle_kwargs)
+        else:
+            path = os.path.join(self.versions_dir, version)
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            bundle = ArtifactBundle.from_dir(path, version, manifest=manifest, **self.bundle_kwargs)
+        bundle.reference_stats = load_reference_stats(path)
+        bundle.warm_up()
+        return bundle
+
+    # --- Chargement / swap ---------------------------------------------------
+
+    async def activate(self, version: str) -> ArtifactBundle:
+        """Charge une version en arrière-plan puis la rend active d'un seul coup."""
+        async with self._swap_lock:
+            loop = asyncio.get_running_loop()
+            bundle = await loop.run_in_executor(None, self.load_bundle, version)
+            previous = self.active.version if self.active is not None else None
+            self.active = bundle
+            logger.info(f"Artefacts actifs: version {bundle.version} (précédente: {previous}).")
+            return bundle
+
+    async def refresh(self):
+        """Active la version cible si elle diffère de la version servie."""
+        target = self.target_version()
+        current = self.active.version if self.active is not None else None
+        if target == current or target in self._failed:
+            return
+        try:
+            await self.activate(target)
+        except Exception as e:
+            logger.error(f"Echec du chargement de la version {target}: {e}")
+            self._failed.add(target)
+
+    def pin(self, version: Optional[str]):
+        """Epingle une version (None pour revenir à la plus récente)."""
+        pin_path = os.path.join(self.root, PIN_FILE)
+        if version is None:
+            if os.path.exists(pin_path):
+                os.remove(pin_path)
+            return
+        if version != LEGACY_VERSION and not os.path.exists(os.path.join(self.versions_dir, version, MANIFEST_FILE)):
+            raise ValueError(f"Version inconnue: {version}")
+        self._failed.discard(version)
+        tmp_path = pin_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(version)
+        os.replace(tmp_path, pin_path)
+
+    # --- Surveillance --------------------------------------------------------
+
+    def start_watcher(self):
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_s)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Erreur de surveillance du registre: {e}")
+
+    def status(self) -> dict:
+        return {
+            "active_version": self.active.version if self.active is not None else None,
+            "active_manifest": self.active.manifest if self.active is not None else None,
+            "loaded_at": self.active.loaded_at if self.active is not None else None,
+            "source": self.active.source if self.active is not None else None,
+            "pinned_version": self.pinned,
+            "versions": [m["version"] for m in self.list_versions()],
+            "failed_versions": sorted(self._failed),
+        }